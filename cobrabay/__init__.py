@@ -16,9 +16,12 @@ import cobrabay.triggers
 # Unitary Classes
 from .bay import CBBay
 from .display import CBDisplay
+from .mailbox import CBMailbox
 from .core import CBCore
 from .network import CBNetwork
-from .sensormgr import CBSensorMgr
+from .sensorboard import CBSensorBoard
+from .sensorhistory import CBSensorHistory
+from .sensormgr import CBSensorMgr, CBSensorMgrProcess
 from .systemhw import CBPiStatus
 from .version import __version__
 
@@ -28,9 +31,13 @@ all = [
     'CBDisplay',
     'CBCore',
     'CBConfig',
+    'CBMailbox',
     'CBNetwork',
     'CBPiStatus',
+    'CBSensorBoard',
+    'CBSensorHistory',
     'CBSensorMgr',
+    'CBSensorMgrProcess',
     'const',
     'sensors',
     'triggers',
@@ -4,18 +4,20 @@ Cobrabay Bay Object
 
 
 import time
+from bisect import bisect_left, bisect_right
 
 import pint.errors
 from pint import UnitRegistry, Quantity
 from time import monotonic
 from math import floor
 from numpy import datetime64
-from numpy import int32 as np_int32
+from numpy import timedelta64
 import logging
 from pprint import pformat
 from operator import attrgetter
 from cobrabay.const import *
-from cobrabay.datatypes import Intercept, Vector
+from cobrabay.datatypes import BaySnapshot, Intercept, Vector, SensorProfile
+from cobrabay.tracking import CBRangeTracker
 
 
 class CBBay:
@@ -31,6 +33,7 @@ class CBBay:
                  q_cbsmcontrol,
                  timeouts,
                  triggers=None,
+                 profiles=None,
                  report_adjusted=True,
                  log_level="WARNING"):
         """
@@ -51,6 +54,9 @@ class CBBay:
         :param timeouts: Dict with timeouts for 'dock','undock' and 'postroll' times.
         :param triggers: Dictionary of Triggers for this bay. Can be modified later with register_trigger.
         :type triggers: dict
+        :param profiles: Sensor profiles to apply when entering bay states, keyed by state. Each may have 'ranging',
+        'timing' and 'distance_mode' keys.
+        :type profiles: dict
         :param log_level: Log level for the bay, must be a Logging level.
         :type log_level: str
         """
@@ -72,6 +78,10 @@ class CBBay:
             self._triggers = {}
         else:
             self._triggers = triggers
+        if profiles is None:
+            self._profiles = {}
+        else:
+            self._profiles = profiles
         self._report_adjusted = report_adjusted
 
         # Debug output....
@@ -103,8 +113,8 @@ class CBBay:
         self._occupancy_score = None
         self._position = {}
         self._previous = {}
-        self._previous_scan_ts = 0
         self._quality_ranges = {}
+        self._quality_tables = {}  # Compiled quality ranges. Sorted bounds in mm and the quality between each pair.
         self._sensor_info = {
             'state': {},
             'status': {},
@@ -112,16 +122,32 @@ class CBBay:
             'quality': {},
             'motion': {},
             'vector': {},
-            'intercepted': {}
+            'intercepted': {},
+            'tracking': {}
         }
         self._state = None
         self._trigger_registry = {}
+        self._vector_cache = None  # Generation of the sensor history, the vector and its newest reading time.
+        self._generation = None  # Sensor history generation the sensor info was last updated from.
+        self._derived = {}  # Values derived from the sensor info, cleared when it's updated.
+        self._snapshot = None  # Snapshot of the bay as of the last update. Built when first asked for.
 
         # Create a unit registry.
         self._ureg = UnitRegistry
 
+        # Create trackers for longitudinal sensors which want them.
+        self._trackers = {}
+        for sensor_id in self._configured_sensors['long']:
+            if self._config_merged[sensor_id].get('tracking', False):
+                self._trackers[sensor_id] = CBRangeTracker(alpha=self._config_merged[sensor_id]['tracking_alpha'],
+                                                           beta=self._config_merged[sensor_id]['tracking_beta'])
+                self._logger.info("Tracking readings from '{}'".format(sensor_id))
+
         # Calculate ranges for sensors.
         self._calculate_quality_ranges(longitudinal=longitudinal, lateral=lateral)
+        # Intercepts in mm, in the same order as the sorted laterals, and each lateral's position in them.
+        self._intercepts_mm = [intercept.intercept.m_as('mm') for intercept in self.lateral_sorted]
+        self._intercept_index = {intercept.sensor_id: i for i, intercept in enumerate(self.lateral_sorted)}
 
         # Set the occupancy score. This is set statically, so it doesn't change if/when sensors die.
         self._occupancy_score = self._calculate_occupancy_score()
@@ -237,32 +263,29 @@ class CBBay:
         Read in sensor values and update all derived values.
         """
 
-        # If the data hasn't changed, don't update.
-        if len(self._cbcore.sensor_log) > 0:
-            # if self._cbcore.sensor_latest_data.timestamp == self._sensor_log[0].timestamp:
-            #     self._logger.debug("No change to latest sensor data, nothing to update.")
-            #     return
-            # else:
-            #     # Proceed with update.
-            #     self._logger.debug("Adding latest sensor data to log.")
-            #     self._sensor_log = [copy.deepcopy(self._cbcore.sensor_latest_data)] + self._sensor_log[0:9]
-            #     self._logger.debug("Sensor log now has '{}' entries.".format(len(self._sensor_log)))
-            #     self._logger.debug("Latest entry is: {}".format(self._sensor_log[0]))
-
+        # If there's no data yet, or it hasn't changed since the last update, there's nothing to update. Tracked readings
+        # are projected to the current time, so bays with trackers always update.
+        history = self._cbcore.sensor_history
+        latest = history.latest
+        if latest is not None and (history.generation != self._generation or self._trackers):
+            self._generation = history.generation
+            self._derived = {}
             # Update all the Longitudinal sensors.
             for sensor_id in self._configured_sensors['long']:
                 self._logger.debug("Updating values for '{}' (Long)".format(sensor_id))
                 # State
-                self._sensor_info['status'][sensor_id] = self._cbcore.sensor_log[0].sensors[sensor_id].response_type
+                self._sensor_info['status'][sensor_id] = latest.sensors[sensor_id].response_type
 
                 # Reading
-                if self._cbcore.sensor_log[0].sensors[sensor_id].response_type == SENSOR_RESP_OK:
+                if sensor_id in self._trackers:
+                    self._sensor_info['reading'][sensor_id] = self._tracked_reading(sensor_id, latest)
+                elif latest.sensors[sensor_id].response_type == SENSOR_RESP_OK:
                     # If the sensor actually reported a value, go with it.
                     self._sensor_info['reading'][sensor_id] = (
-                            self._cbcore.sensor_log[0].sensors[sensor_id].range - self._config_merged[sensor_id][
+                            latest.sensors[sensor_id].range - self._config_merged[sensor_id][
                         'zero_point']
                     )
-                elif self._cbcore.sensor_log[0].sensors[sensor_id].response_type == SENSOR_RESP_INR:
+                elif latest.sensors[sensor_id].response_type == SENSOR_RESP_INR:
                     # This means we're waiting for the interrupt. Continue to use the most recent value.
                     self._sensor_info['reading'][sensor_id] = self._most_recent_reading(sensor_id)
                 else:
@@ -279,13 +302,13 @@ class CBBay:
                 self._logger.debug("Updating values for '{}' (Lat)".format(sensor_id))
 
                 # Update the readings.
-                if self._cbcore.sensor_log[0].sensors[sensor_id].response_type == SENSOR_RESP_OK:
+                if latest.sensors[sensor_id].response_type == SENSOR_RESP_OK:
                     # If the sensor actually reported a value, update it with the offset and store.
                     self._sensor_info['reading'][sensor_id] = (
-                            self._cbcore.sensor_log[0].sensors[sensor_id].range - self._config_merged[sensor_id][
+                            latest.sensors[sensor_id].range - self._config_merged[sensor_id][
                         'zero_point']
                     )
-                elif self._cbcore.sensor_log[0].sensors[sensor_id].response_type == SENSOR_RESP_INR:
+                elif latest.sensors[sensor_id].response_type == SENSOR_RESP_INR:
                     # This means we're waiting for the interrupt. Continue to use the most recent value.
                     self._sensor_info['reading'][sensor_id] = self._most_recent_reading(sensor_id)
                 else:
@@ -300,6 +323,8 @@ class CBBay:
         # If bay is in a motion state, check the timer for expiration.
         if self.state in BAYSTATE_MOTION:
             self.check_timer()
+        # The motion timer and tracked readings move even without new data, so always take a new snapshot.
+        self._snapshot = None
 
     ## Public Properties
 
@@ -428,55 +453,11 @@ class CBBay:
         :returns: bay occupancy state
         :rtype: bool
         """
-        # TODO: Rework all this logic. Should probably be a rolling monitor of values?
-
-        self._logger.debug("Checking for occupancy.")
-        # Status variable for occupancy. Start at unknown.
-        occ = GEN_UNKNOWN
-
-        # Must be actively ranging to determine occupancy. Check for that, return unknown otherwise.
-        if self._selected_range not in self._sensor_info['status']:
-            self._logger.info("Cannot calculate occupancy, selected longitudinal sensor does not have a known status. "
-                              "This is fine on startup.")
-            self._logger.info("Current sensor_info: {}".format(self._sensor_info))
-            return GEN_UNKNOWN
-
-        if self._sensor_info['status'][self._selected_range] != SENSOR_RESP_OK:
-            self._logger.debug("Selected longitudinal sensor not ranging. Occupancy 'unknown'")
-            return GEN_UNKNOWN
-
-        range_quality = self._sensor_info['quality'][self._selected_range]
-        if range_quality in (SENSOR_QUALITY_NOOBJ, SENSOR_QUALITY_DOOROPEN, SENSOR_QUALITY_BEYOND):
-            # Cases where there's no vehicle longitudinally means we jump straight to unoccupied.
-            self._logger.debug("Longitudinal quality is '{}', not occupied.".format(range_quality))
-            occ = "false"
-        elif range_quality in (SENSOR_QUALITY_EMERG, SENSOR_QUALITY_BACKUP, SENSOR_QUALITY_PARK,
-                               SENSOR_QUALITY_FINAL, SENSOR_QUALITY_BASE, SENSOR_QUALITY_OK):
-            self._logger.debug("Matched longitudinal quality: {}".format(range_quality))
-            # If the detector is giving us any of the 'close enough' qualities, there's something being found that
-            # could be a vehicle. Check the lateral sensors to be sure that's what it is, rather than somebody blocking
-            # the sensors or whatnot
-            occ_score = 1
-            for sensor_id in self._configured_sensors['lat']:
-                self._logger.debug("Checking quality for lateral sensor '{}'.".format(sensor_id))
-                if self._sensor_info['quality'][sensor_id] in (SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN,
-                                                               SENSOR_QUALITY_CRIT):
-                    # No matter how badly parked the vehicle is, it's still *there*
-                    occ_score += 1
-            self._logger.debug("Achieved lateral score {} of {}".format(occ_score, self._occupancy_score))
-            if occ_score >= self._occupancy_score:
-                # All sensors have found something more or less in the right place, so yes, we're occupied!
-                occ = 'true'
-            else:
-                occ = 'false'
-        else:
-            self._logger.warning(
-                "Occupancy cannot be calculated, longitudinal sensor had quality '{}'".format(range_quality))
-            occ = 'error'
-        if occ != self._occupancy:
-            self._logger.info("Occupancy has changed from '{}' to '{}'".format(self._occupancy, occ))
-        self._occupancy = occ
-        return occ
+        try:
+            return self._derived['occupied']
+        except KeyError:
+            self._derived['occupied'] = self._calculate_occupancy()
+            return self._derived['occupied']
 
     @property
     def range_pct(self):
@@ -484,18 +465,24 @@ class CBBay:
         Percentage of distance covered from the garage door to the stop point.
         :return: float
         """
-        # TODO: Fix range references.
-        # If it's not a Quantity, just return zero.
-        self._logger.debug("Calculating range percentage")
-        self._logger.debug("Range value: {} ({})".format(self.range.value, type(self.range.value)))
-        self._logger.debug("Adjusted depth: {}".format(self.depth))
-        if isinstance(self.range.value, Quantity):
-            range_pct = self.range.value.to('cm') / self.depth.to('cm')
-            # Singe this is dimensionless, just take the value and make it a Python scalar.
-            range_pct = range_pct.magnitude
-            return range_pct
-        else:
-            return 0
+        try:
+            return self._derived['range_pct']
+        except KeyError:
+            self._derived['range_pct'] = self._calculate_range_pct()
+            return self._derived['range_pct']
+
+    @property
+    def range_span(self):
+        """
+        Lowest and highest readings the longitudinal sensors can give, relative to their zero points. Readings are
+        negative when a vehicle has gone past the zero point.
+
+        :return: tuple of Quantity, or None if there are no longitudinal sensors.
+        """
+        zero_points = [self._config_merged[sensor_id]['zero_point'] for sensor_id in self._configured_sensors['long']]
+        if len(zero_points) == 0:
+            return None
+        return -max(zero_points), self.depth_abs - min(zero_points)
 
     @property
     def selected_range(self):
@@ -508,6 +495,32 @@ class CBBay:
     def sensor_info(self):
         return self._sensor_info
 
+    @property
+    def snapshot(self):
+        """
+        Immutable snapshot of the bay's state and derived values as of the last update.
+
+        :return: BaySnapshot
+        """
+        if self._snapshot is None:
+            self._snapshot = BaySnapshot(
+                id=self.id,
+                name=self._name,
+                state=self._state,
+                generation=self._generation,
+                occupied=self.occupied,
+                vector=self.vector,
+                motion_timer=self.motion_timer,
+                range_pct=self.range_pct,
+                selected_range=self._selected_range,
+                configured_sensors={role: tuple(sensors) for role, sensors in self._configured_sensors.items()},
+                laterals=tuple((intercept.sensor_id, self._config_merged[intercept.sensor_id]['side'])
+                               for intercept in self.lateral_sorted),
+                sensor_info={key: dict(values) for key, values in self._sensor_info.items()},
+                range_mm=self._selected_range_mm()
+            )
+        return self._snapshot
+
     @property
     def state(self):
         """
@@ -542,9 +555,9 @@ class CBBay:
             self._current_motion['mark'] = monotonic()
             # self._sensor_log = []  # Reset the sensor log to flush stale data.
             self._logger.info("Start time: {}".format(self._current_motion['mark']))
-            self._logger.info("Setting all sensors to ranging.")
-            # TODO: Convert to queue command.
-            self._q_cbsmcontrol.put((SENSTATE_RANGING, None))
+            if m_input not in self._profiles:
+                self._logger.info("Setting all sensors to ranging.")
+                self._q_cbsmcontrol.put((SENSTATE_RANGING, None))
         # When requesting to leave a motion state.
         elif m_input not in SYSSTATE_MOTION and self.state in SYSSTATE_MOTION:
             self._logger.info("Entering state: {} (Previously '{}')".format(m_input, self.state))
@@ -552,95 +565,56 @@ class CBBay:
             # Make the mark none to be sure there's not a stale value in here.
             self._current_motion['mark'] = 0
             # self._sensor_log = []
+        # Send the profile for the new state to the sensor manager, if there is one.
+        if m_input in self._profiles:
+            self._send_profile(m_input)
         # Now store the state.
         self._state = m_input
+        self._snapshot = None
 
     @property
     def vector(self):
         """
-        The vector from the bay's selected range detector.
+        The vector from the bay's selected range detector. Estimated by a least squares fit over the recent good
+        readings, and cached until the sensor history changes.
 
         :return:
         :rtype: namedtuple
         """
-        # When performing a verify, always report no motion, since we're not collecting enough data, any
-        # values will be noise.
-        # TODO: Rework vector calculation. Need to bring this inboard since detectors are gone.
-        # return Vector(speed=Quantity('0kph'), direction='still')
-        # Return variable for unknown movement.
-        self._logger.debug("Sensor log is: {}".format(self._cbcore.sensor_log))
-        vector_unknown = Vector(timestamp=datetime64('now','ns'), speed=GEN_UNKNOWN, direction=GEN_UNKNOWN)
-
-        # Have to have at least two elements. If we don't, what they are doesn't matter, return right away.
-        if len(self._cbcore.sensor_log) < 2:
-            self._logger.debug("Vector - Not enough sensor readings to calculate vector.")
-            return vector_unknown
-
-        # If we haven't had a motion reading recently enough, vector can't be determined.
-        # 100ms is 100000000ns, will make this static.
-        timediff = (datetime64('now', 'ns') - self._cbcore.sensor_log[0].timestamp).astype(np_int32)
-        self._logger.debug("Vector - Time difference is '{}' ({})".format(timediff, type(timediff)))
-
-        if timediff < timedelta64(750000000, 'ns').astype(np_int32):
-            # TODO: Make this interval be based on the actual sensor timing interval. OR, can keep, good enough?
-            self._logger.info("Vector - Most recent longitudinal reading over 750ms ago, can't determine vector.")
+        history = self._cbcore.sensor_history
+        now = time.time_ns()
+        window_ns = int(VECTOR_WINDOW / timedelta64(1, 'ns'))
+        if self._vector_cache is not None and self._vector_cache[0] == history.generation:
+            vector, newest = self._vector_cache[1:]
+            # Still have to age out a cached vector if the readings stop.
+            if newest is None or now - newest <= window_ns:
+                return vector
+        vector_unknown = Vector(timestamp=datetime64(now, 'ns'), speed=GEN_UNKNOWN, direction=GEN_UNKNOWN)
+
+        # Fit the recent readings from the selected range sensor.
+        trend = history.trend(self._selected_range, count=VECTOR_SAMPLES, since=now - window_ns)
+        self._logger.debug("Vector - Have trend {}".format(trend))
+
+        # Have to have at least two recent readings. If we don't, what they are doesn't matter.
+        if trend is None:
+            self._logger.debug("Vector - Not enough recent sensor readings to calculate vector.")
+            self._vector_cache = (history.generation, vector_unknown, None)
             return vector_unknown
 
-        # sensor_log_filtered = []
-        # for item in self.cb_core.sensor_log:
-        #     self._logger.debug("Filtering item: {}".format(item))
-        #     if item.response_type == SENSOR_RESP_OK:
-        #         sensor_log_filtered.append(item)
-
-        # If we haven't returned yet, we can calculate.
-        i = 1
-        while i < len(self._cbcore.sensor_log):
-            # Find the element in the log where the selected range sense returned a Quantity, and is either
-            # 250ms (0.25s) ago OR is the last reading (good enough)
-            self._logger.debug("Bay: Sensor log has {} elements".format(len(self._cbcore.sensor_log)))
-            self._logger.debug("Bay: Will try log element {} - {}".format(i, self._cbcore.sensor_log[i]))
-            if self._selected_range not in self._cbcore.sensor_log[i].sensors:
-                self._logger.debug("Bay: Selected range not in this sensor response. Skipping.")
-                break
-            elif self._cbcore.sensor_log[i].sensors[self._selected_range].response_type == SENSOR_RESP_OK:
-                #TODO: Update to find the first element that isn't none and then work from there.
-                spread_time = (self._cbcore.sensor_log[0].timestamp - self._cbcore.sensor_log[i].timestamp).astype(
-                    np_int32)
-                self._logger.debug("Vector - Sensor reading time spread is {}".format(spread_time))
-                try:
-                    spread_distance = (self._cbcore.sensor_log[0].sensors[self._selected_range].range
-                                   - self._cbcore.sensor_log[i].sensors[self._selected_range].range)
-                except pint.errors.DimensionalityError:
-                    self._logger.warning("Dimensionality error when evaluating vector. SensorReading 0 had selected "
-                                         "range {} ({}) while {} had selected range {} ({})".format(
-                        self._cbcore.sensor_log[0].sensors[self._selected_range].range,
-                        type(self._cbcore.sensor_log[0].sensors[self._selected_range].range),
-                        i, self._cbcore.sensor_log[i].sensors[self._selected_range].range,
-                        type(self._cbcore.sensor_log[i].sensors[self._selected_range].range)
-                    ))
-                    return vector_unknown
-                self._logger.debug("Vector - Sensor reading distance spread is {}".format(spread_distance))
-                speed = abs(spread_distance) / Quantity(spread_time, "ns")
-                if spread_distance == 0:
-                    direction = DIR_STILL
-                elif spread_distance > 0:
-                    direction = DIR_REV
-                elif spread_distance < 0:
-                    direction = DIR_FWD
-                else:
-                    self._logger.warning(
-                        "Vector - Direction spread has unhandled value '{}'".format(spread_distance))
-                    return vector_unknown
-                # Convert the value.
-                self._logger.debug("Vector - Raw speed is '{}'".format(speed))
-                speed = speed.to("kph")
-                self._logger.debug("Vector - Converted speed '{}'".format(speed))
-                return Vector(timestamp=datetime64('now', 'ns'), speed=speed, direction=direction)
-            else:
-                self._logger.debug("Bay: Sensor response is not usable. Skipping.")
-            # Increment
-            i += 1
-        return vector_unknown
+        rate, stderr, r_squared, samples, newest = trend
+        # Only call it motion if the rate is distinguishable from the noise in the readings.
+        if rate == 0 or (stderr is not None and abs(rate) < 2 * stderr):
+            direction = DIR_STILL
+        elif rate > 0:
+            direction = DIR_REV
+        else:
+            direction = DIR_FWD
+        speed = Quantity(abs(rate), 'mm/s').to("kph")
+        self._logger.debug("Vector - Speed '{}', direction '{}' from {} readings.".format(speed, direction, samples))
+        vector = Vector(timestamp=datetime64(newest, 'ns'), speed=speed, direction=direction,
+                        confidence=r_squared if samples > 2 else None)
+        self._vector_cache = (history.generation, vector, newest)
+        return vector
 
     ## Private Methods
 
@@ -655,17 +629,42 @@ class CBBay:
         self._logger.debug("Merged sensor config by name: {}".format(merged_config))
         return merged_config
 
-    def _most_recent_reading(self, sensor_id):
-        """Get the most recent reading from the sensor log for a given sensor_id"""
+    def _send_profile(self, profile_name):
+        """
+        Send a sensor profile for this bay's sensors to the sensor manager.
+
+        :param profile_name: Name of the profile. This is the bay state it's used for.
+        :type profile_name: str
+        """
+        profile = self._profiles[profile_name]
+        command = SensorProfile(
+            profile=profile_name,
+            state=SENSTATE_RANGING if profile.get('ranging', True) else SENSTATE_ENABLED,
+            sensors=self._configured_sensors['long'] + self._configured_sensors['lat'],
+            timing=profile.get('timing', None),
+            distance_mode=profile.get('distance_mode', None))
+        self._logger.info("Sending sensor profile: {}".format(command))
+        self._q_cbsmcontrol.put(command)
+
+    def _most_recent_range(self, sensor_id):
+        """Get the most recent raw range from the sensor history for a given sensor_id"""
         # TODO: Make this more robust or with more options to deal with edge cases.
-        for entry in self._cbcore.sensor_log:
-            try:
-                if entry.sensors[sensor_id].response_type == SENSOR_RESP_OK:
-                    return entry.sensors[sensor_id].range
-                elif entry.sensors[sensor_id].response_type == SENSOR_RESP_INR:
-                    continue
-            except KeyError:
-                pass
+        try:
+            last = self._cbcore.sensor_history.last(sensor_id)
+        except KeyError:
+            return None
+        if last is None:
+            return None
+        return last[1]
+
+    def _most_recent_reading(self, sensor_id):
+        """
+        Get the most recent reading for a given sensor_id, adjusted by its zero point like a fresh reading is.
+        """
+        last_range = self._most_recent_range(sensor_id)
+        if last_range is None:
+            return None
+        return last_range - self._config_merged[sensor_id]['zero_point']
 
 
     # Old _make_range implementation...
@@ -707,6 +706,82 @@ class CBBay:
     #             "Calculated ranges for lateral sensor '{}': {}".format(sensor_config['name'], pformat(lat_ranges)))
     #         self._ranges['lat'][sensor_config['name']] = lat_ranges
 
+    def _calculate_occupancy(self):
+        """
+        Determine occupancy from the current sensor info.
+
+        :return: str
+        """
+        # TODO: Rework all this logic. Should probably be a rolling monitor of values?
+
+        self._logger.debug("Checking for occupancy.")
+        # Status variable for occupancy. Start at unknown.
+        occ = GEN_UNKNOWN
+
+        # Must be actively ranging to determine occupancy. Check for that, return unknown otherwise.
+        if self._selected_range not in self._sensor_info['status']:
+            self._logger.info("Cannot calculate occupancy, selected longitudinal sensor does not have a known status. "
+                              "This is fine on startup.")
+            self._logger.info("Current sensor_info: {}".format(self._sensor_info))
+            return GEN_UNKNOWN
+
+        if self._sensor_info['status'][self._selected_range] != SENSOR_RESP_OK:
+            self._logger.debug("Selected longitudinal sensor not ranging. Occupancy 'unknown'")
+            return GEN_UNKNOWN
+
+        range_quality = self._sensor_info['quality'][self._selected_range]
+        if range_quality in (SENSOR_QUALITY_NOOBJ, SENSOR_QUALITY_DOOROPEN, SENSOR_QUALITY_BEYOND):
+            # Cases where there's no vehicle longitudinally means we jump straight to unoccupied.
+            self._logger.debug("Longitudinal quality is '{}', not occupied.".format(range_quality))
+            occ = "false"
+        elif range_quality in (SENSOR_QUALITY_EMERG, SENSOR_QUALITY_BACKUP, SENSOR_QUALITY_PARK,
+                               SENSOR_QUALITY_FINAL, SENSOR_QUALITY_BASE, SENSOR_QUALITY_OK):
+            self._logger.debug("Matched longitudinal quality: {}".format(range_quality))
+            # If the detector is giving us any of the 'close enough' qualities, there's something being found that
+            # could be a vehicle. Check the lateral sensors to be sure that's what it is, rather than somebody blocking
+            # the sensors or whatnot
+            occ_score = 1
+            for sensor_id in self._configured_sensors['lat']:
+                self._logger.debug("Checking quality for lateral sensor '{}'.".format(sensor_id))
+                if self._sensor_info['quality'][sensor_id] in (SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN,
+                                                               SENSOR_QUALITY_CRIT):
+                    # No matter how badly parked the vehicle is, it's still *there*
+                    occ_score += 1
+            self._logger.debug("Achieved lateral score {} of {}".format(occ_score, self._occupancy_score))
+            if occ_score >= self._occupancy_score:
+                # All sensors have found something more or less in the right place, so yes, we're occupied!
+                occ = 'true'
+            else:
+                occ = 'false'
+        else:
+            self._logger.warning(
+                "Occupancy cannot be calculated, longitudinal sensor had quality '{}'".format(range_quality))
+            occ = 'error'
+        if occ != self._occupancy:
+            self._logger.info("Occupancy has changed from '{}' to '{}'".format(self._occupancy, occ))
+        self._occupancy = occ
+        return occ
+
+    def _calculate_range_pct(self):
+        """
+        Determine the range percentage from the current sensor info.
+
+        :return: float
+        """
+        range_reading = self._sensor_info['reading'].get(self._selected_range)
+        adjusted_depth = self.depth_abs - self._config_merged[self._selected_range]['zero_point']
+        self._logger.debug("Calculating range percentage")
+        self._logger.debug("Range value: {} ({})".format(range_reading, type(range_reading)))
+        self._logger.debug("Adjusted depth: {}".format(adjusted_depth))
+        # If it's not a Quantity, just return zero.
+        if isinstance(range_reading, Quantity):
+            range_pct = range_reading.to('cm') / adjusted_depth.to('cm')
+            # Singe this is dimensionless, just take the value and make it a Python scalar.
+            range_pct = range_pct.magnitude
+            return range_pct
+        else:
+            return 0
+
     def _calculate_quality_ranges(self, longitudinal, lateral):
         """ Calculate ranges for each sensor."""
         # Output dictionary.
@@ -752,6 +827,10 @@ class CBBay:
             self._quality_ranges[sensor_config['name']][SENSOR_QUALITY_BEYOND] = [self.depth_abs, Quantity('1ly')]
             self._logger.debug("Calculated quality ranges --")
             self._logger.debug(pformat(self._quality_ranges[sensor_config['name']]))
+            self._quality_tables[sensor_config['name']] = self._compile_quality_ranges(
+                self._quality_ranges[sensor_config['name']],
+                (SENSOR_QUALITY_EMERG, SENSOR_QUALITY_BACKUP, SENSOR_QUALITY_PARK, SENSOR_QUALITY_FINAL,
+                 SENSOR_QUALITY_BASE, SENSOR_QUALITY_OK, SENSOR_QUALITY_BEYOND))
 
         for sensor_config in lateral['sensors']:
             # Merge the defaults with the specific sensor.
@@ -779,6 +858,30 @@ class CBBay:
 
             self._logger.debug("Calculated quality ranges --")
             self._logger.debug(pformat(self._quality_ranges[sensor_config['name']]))
+            self._quality_tables[sensor_config['name']] = self._compile_quality_ranges(
+                self._quality_ranges[sensor_config['name']],
+                (SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN, SENSOR_QUALITY_CRIT))
+
+    @staticmethod
+    def _compile_quality_ranges(quality_ranges, priority):
+        """
+        Compile quality ranges into a lookup table. The range bounds are split into elementary intervals, each labeled
+        with the first quality, by priority, whose range covers it. A reading's quality is then a single bisect.
+
+        :param quality_ranges: Start and end Quantities of each quality's range. Start is inclusive, end is exclusive.
+        :type quality_ranges: dict
+        :param priority: Qualities in the order they should be matched.
+        :type priority: tuple
+        :return: tuple of sorted bounds in mm and the quality for each interval between them.
+        """
+        ranges = {quality: (quality_ranges[quality][0].m_as('mm'), quality_ranges[quality][1].m_as('mm'))
+                  for quality in priority}
+        bounds = sorted({bound for quality_range in ranges.values() for bound in quality_range})
+        labels = []
+        for start, end in zip(bounds, bounds[1:]):
+            labels.append(next((quality for quality in priority
+                                if ranges[quality][0] <= start and end <= ranges[quality][1]), GEN_UNKNOWN))
+        return bounds, labels
 
     # def _quality(self, sensor_id):
     #     # Pull the current value for evaluation.
@@ -802,23 +905,31 @@ class CBBay:
     #                 self._sensor_info['reading'][sensor_id])
     #             ))
 
+    def _selected_range_mm(self):
+        """
+        Reading of the selected range sensor as a plain number, so the display doesn't have to convert it every frame.
+
+        :return: float, or None if there's no reading.
+        """
+        reading = self._sensor_info['reading'].get(self._selected_range)
+        if isinstance(reading, Quantity):
+            return reading.m_as('mm')
+        return None
+
     def _sensor_intercepted(self, sensor_id):
         self._logger.debug("Lateral Intercept - Checking interception status for '{}'".format(sensor_id))
 
-        intercept = next(item for item in self.lateral_sorted if item.sensor_id == sensor_id)
-        self._logger.debug("Lateral Intercept - Using intercept {}".format(intercept))
-        try:
-            if self._sensor_info['reading'][self.selected_range] <= intercept.intercept:
-                self._logger.info("Lateral Intercept - Lateral '{}' is intercepted.".format(sensor_id))
-                return True
-            else:
-                self._logger.info("Lateral Intercept - Lateral '{}' is not intercepted.".format(sensor_id))
-                return False
-        except ValueError as e:
-            self._logger.warning("Lateral Intercept - Selected range threw ValueError exception with '{}' ({})".
-                                 format(self._sensor_info['reading'][self.selected_range],
-                                        type(self._sensor_info['reading'][self.selected_range])))
-            self._logger.exception(e)
+        range_reading = self._sensor_info['reading'][self.selected_range]
+        if not isinstance(range_reading, Quantity):
+            self._logger.warning("Lateral Intercept - Selected range has non-distance value '{}' ({})".
+                                 format(range_reading, type(range_reading)))
+            return False
+        # Laterals are sorted by intercept, so everything from the first intercept at or past the range is intercepted.
+        if self._intercept_index[sensor_id] >= bisect_left(self._intercepts_mm, range_reading.m_as('mm')):
+            self._logger.info("Lateral Intercept - Lateral '{}' is intercepted.".format(sensor_id))
+            return True
+        else:
+            self._logger.info("Lateral Intercept - Lateral '{}' is not intercepted.".format(sensor_id))
             return False
 
     def _sensor_motion(self, sensor_id):
@@ -833,19 +944,16 @@ class CBBay:
             raise ValueError("Sensor ID '{}' is not a configure Longitudinal sensor. Cannot compute motion.".
                              format(sensor_id))
         # TODO: Finish the motion logic.
-        filtered_log = []
-        self._logger.debug("Sensor log: {} ({})".format(self._cbcore.sensor_log, type(self._cbcore.sensor_log)))
-        for response in self._cbcore.sensor_log:
-            if response.sensors[sensor_id].response_type == SENSOR_RESP_OK:
-                filtered_log.append(response)
-        self._logger.debug("Filtered history has {} entries, of {} available".format(len(filtered_log),
-                                                                                     len(self._cbcore.sensor_log)))
+        # Good readings from the history, newest first.
+        timestamps, ranges = self._cbcore.sensor_history.window(sensor_id)
+        self._logger.debug("Filtered history has {} entries, of {} available".format(len(timestamps),
+                                                                                     len(self._cbcore.sensor_history)))
 
         # Can't compute motion from fewer than two values.
-        if len(filtered_log) < 2:
+        if len(timestamps) < 2:
             return GEN_UNKNOWN
-        # Calculate the time difference in seconds.
-        timediff = (filtered_log[0].timestamp - filtered_log[-1].timestamp)
+        # Calculate the time difference.
+        timediff = timedelta64(int(timestamps[0] - timestamps[-1]), 'ns')
         self._logger.debug("Timediff is: {} ({})".format(timediff, type(timediff)))
 
         # Only take entries at least 250ms apart.
@@ -854,11 +962,8 @@ class CBBay:
                 "First and last readings are {} ns apart. Less than 250ms, can't calculate.".format(timediff))
             return GEN_UNKNOWN
 
-        self._logger.debug("First log: {}".format(filtered_log[0]))
-        self._logger.debug("Last log: {}".format(filtered_log[-1]))
-
-        net_dist = filtered_log[-1].sensors[sensor_id].range - filtered_log[0].sensors[sensor_id].range
-        net_time = filtered_log[0].timestamp - filtered_log[-1].timestamp
+        net_dist = Quantity(float(ranges[-1] - ranges[0]), 'mm')
+        net_time = timediff
         self._logger.info("Traveled '{}' in '{}'".format(net_dist, net_time))
 
     def _sensor_quality_lat(self, sensor_id):
@@ -868,40 +973,19 @@ class CBBay:
         :param sensor_id:
         :return:
         """
-        sensor_reading = self._most_recent_reading(sensor_id)
+        sensor_reading = self._most_recent_range(sensor_id)
         self._logger.debug(
             "Evaluating lateral raw value '{}' for quality".format(sensor_reading))
-        self._logger.debug("Sensor quality definitions: {}".format(self._quality_ranges[sensor_id]))
-        # Is this a longitudinal or lateral sensor? We can tell by which sensor list it's on.
-        quality_ranges = (SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN, SENSOR_QUALITY_CRIT)
 
         # Is the sensor intercepted? If not, nothing else to do.
         if not self._sensor_info['intercepted'][sensor_id]:
             return SENSOR_QUALITY_NOTINTERCEPTED
 
-        for quality in quality_ranges:
-            self._logger.debug("Checking quality '{}'".format(quality))
-            # try:
-            if (self._quality_ranges[sensor_id][quality][0] <=
-                    sensor_reading < self._quality_ranges[sensor_id][quality][1]):
-                self._logger.debug("In quality range '{}' ({} <= {} < {})".
-                                   format(quality,
-                                          self._quality_ranges[sensor_id][quality][0],
-                                          sensor_reading,
-                                          self._quality_ranges[sensor_id][quality][1]))
-                return quality
-            # except ValueError:
-                # self._logger.error(
-                #     "Received ValueError when finding quality. Range start {} ({}), end {} ({}), read "
-                #     "value {}".format(
-                #         self._quality_ranges[sensor_id][quality][0], type(self._quality_ranges[sensor_id][quality][0]),
-                #         self._quality_ranges[sensor_id][quality][1], type(self._quality_ranges[sensor_id][quality][1]),
-                #         self._sensor_info['reading'][sensor_id]
-                #     ))
+        # Escape hatch for when the sensor didn't return a reading. In case of a strange failure, return Unknown.
+        if sensor_reading is None:
+            return GEN_UNKNOWN
 
-        self._logger.debug("Did not otherwise match quality, marking 'unknown'")
-        # In case of a strange failure, return Unknown.
-        return GEN_UNKNOWN
+        return self._lookup_quality(sensor_id, sensor_reading)
 
     def _sensor_quality_long(self, sensor_id):
         """
@@ -910,43 +994,64 @@ class CBBay:
         :param sensor_id:
         :return:
         """
-
-
-        sensor_reading = self._most_recent_reading(sensor_id)
+        sensor_reading = self._most_recent_range(sensor_id)
         self._logger.debug(
             "Evaluating longitudinal raw value '{}' for quality".format(sensor_reading))
-        self._logger.debug("Available qualities: {}".format(self._quality_ranges[sensor_id].keys()))
-        quality_ranges = (SENSOR_QUALITY_EMERG, SENSOR_QUALITY_BACKUP, SENSOR_QUALITY_PARK, SENSOR_QUALITY_FINAL,
-                          SENSOR_QUALITY_BASE, SENSOR_QUALITY_OK, SENSOR_QUALITY_BEYOND)
 
         # Escape hatch for when the sensor didn't return a reading.
         #TODO: Better contextual logic to return an inferred status.
         if sensor_reading is None:
             return SENSOR_QUALITY_NOREADING
 
-        for quality in quality_ranges:
-            self._logger.debug("Checking quality '{}' for value {}".format(
-                quality, self._quality_ranges[sensor_id][quality][1]))
-            # try:
-            if (self._quality_ranges[sensor_id][quality][0] <=
-                    sensor_reading < self._quality_ranges[sensor_id][quality][1]):
-                self._logger.debug("In quality range '{}' ({} <= {} < {})".
-                                   format(quality,
-                                          self._quality_ranges[sensor_id][quality][0],
-                                          self._sensor_info['reading'][sensor_id],
-                                          self._quality_ranges[sensor_id][quality][1]))
-                return quality
-            # except ValueError:
-            #     self._logger.error(
-            #         "Received ValueError when finding quality. Range start {} ({}), end {} ({}), read "
-            #         "value {}".format(
-            #             self._quality_ranges[sensor_id][quality][0], type(self._quality_ranges[sensor_id][quality][0]),
-            #             self._quality_ranges[sensor_id][quality][1], type(self._quality_ranges[sensor_id][quality][1]),
-            #             self._sensor_info['reading'][sensor_id]
-            #         ))
+        return self._lookup_quality(sensor_id, sensor_reading)
+
+    def _lookup_quality(self, sensor_id, sensor_reading):
+        """
+        Find the quality of a reading in the sensor's compiled quality table.
+
+        :param sensor_id: Sensor the reading is from.
+        :param sensor_reading: Reading to evaluate.
+        :type sensor_reading: Quantity
+        :return: str
+        """
+        bounds, labels = self._quality_tables[sensor_id]
+        position = bisect_right(bounds, sensor_reading.m_as('mm')) - 1
+        if 0 <= position < len(labels):
+            self._logger.debug("In quality range '{}' ({} <= {} < {})".
+                               format(labels[position], bounds[position], sensor_reading, bounds[position + 1]))
+            return labels[position]
         # If we get here, quality is unknown.
+        self._logger.debug("Did not otherwise match quality, marking 'unknown'")
         return GEN_UNKNOWN
 
+    def _tracked_reading(self, sensor_id, scan):
+        """
+        Feed a scan to a sensor's tracker and get the tracked reading, projected to now.
+
+        :param sensor_id: Longitudinal sensor with a tracker.
+        :param scan: Latest scan from the sensor manager.
+        :type scan: SensorResponse
+        :return: Quantity or GEN_UNKNOWN
+        """
+        tracker = self._trackers[sensor_id]
+        reading = scan.sensors[sensor_id]
+        if reading.response_type == SENSOR_RESP_OK:
+            tracker.update(int(scan.timestamp.astype('datetime64[ns]').astype('int64')), reading.range.m_as('mm'))
+        elif reading.response_type != SENSOR_RESP_INR:
+            # Sensor isn't giving readings, so the track is no good.
+            tracker.reset()
+        if tracker.error is None:
+            self._sensor_info['tracking'].pop(sensor_id, None)
+        else:
+            self._sensor_info['tracking'][sensor_id] = {
+                'error': Quantity(tracker.error, 'mm'),
+                'error_rms': Quantity(tracker.error_rms, 'mm')
+            }
+        predicted = tracker.predict(time.time_ns())
+        if predicted is None:
+            return GEN_UNKNOWN
+        return Quantity(predicted, 'mm').to('cm') - self._config_merged[sensor_id]['zero_point']
+
     def _select_range(self, longitudinal):
         """
         Select a primary longitudinal sensor to use for range from among those presented.
@@ -0,0 +1,241 @@
+"""
+Cobra Bay - Compositor
+
+Assembles display frames from pre-made layers in a single reused buffer.
+"""
+
+import numpy as np
+from PIL import Image
+
+
+class CBSprite:
+    """
+    A layer cropped to the pixels it uses, and sorted by how it has to be drawn. Sprites that are fully opaque are
+    copied straight onto the frame, sprites whose pixels are either opaque or clear are copied through a mask, and
+    only sprites with partly transparent pixels, such as antialiased text, are blended. For blending, color is stored
+    premultiplied by alpha, along with how much of the background shows through, so a blend is one multiply and one
+    add.
+
+    Text in a single color can also be kept as coverage alone, made with from_alpha(). Tinting it gives a sprite in
+    any color that shares the coverage, so one copy serves every color.
+    """
+    __slots__ = ('x', 'y', 'color', 'mask', 'transmit', 'tint')
+
+    def __init__(self, x, y, color, mask=None, transmit=None, tint=None):
+        """
+        :param x: Column of the sprite's left edge on the frame.
+        :type x: int
+        :param y: Row of the sprite's top edge on the frame.
+        :type y: int
+        :param color: For copied sprites, RGBX pixels packed into uint32, shaped (height, width). For blended
+        sprites, RGBX premultiplied by alpha, shaped (height, width, 4).
+        :type color: numpy.ndarray
+        :param mask: Pixels to copy, shaped (height, width). None to copy all of them.
+        :type mask: numpy.ndarray
+        :param transmit: How much of the background shows through each pixel, 0-255, shaped (height, width, 1). Set
+        only for blended and coverage sprites.
+        :type transmit: numpy.ndarray
+        :param tint: For coverage sprites, RGBX color to draw in, as float32. Color is None for these.
+        :type tint: numpy.ndarray
+        """
+        self.x = x
+        self.y = y
+        self.color = color
+        self.mask = mask
+        self.transmit = transmit
+        self.tint = tint
+
+    def __getstate__(self):
+        return self.x, self.y, self.color, self.mask, self.transmit, self.tint
+
+    def __setstate__(self, state):
+        self.x, self.y, self.color, self.mask, self.transmit, self.tint = state
+
+    @classmethod
+    def from_alpha(cls, image, offset=(0, 0)):
+        """
+        Make a coverage sprite from the alpha of an RGBA image, cropped to its visible pixels. The image's color is
+        dropped, so it should be one color throughout, as text is. Use tinted() to get a sprite that can be drawn.
+
+        :param image: Image to take the alpha of.
+        :type image: PIL.Image.Image
+        :param offset: Position of the image's top left corner on the frame.
+        :type offset: tuple
+        :return: CBSprite
+        """
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        bbox = image.getbbox() or (0, 0, 1, 1)
+        alpha = np.asarray(image.crop(bbox))[:, :, 3:4]
+        return cls(offset[0] + bbox[0], offset[1] + bbox[1], None, transmit=255 - alpha)
+
+    @classmethod
+    def from_image(cls, image, offset=(0, 0)):
+        """
+        Make a sprite from an RGBA image, cropped to its visible pixels.
+
+        :param image: Image to convert.
+        :type image: PIL.Image.Image
+        :param offset: Position of the image's top left corner on the frame.
+        :type offset: tuple
+        :return: CBSprite
+        """
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        bbox = image.getbbox()
+        if bbox is None:
+            # Nothing visible. Keep one clear pixel so blitting is still valid.
+            return cls(offset[0], offset[1], np.zeros((1, 1), dtype=np.uint32), mask=np.zeros((1, 1), dtype=bool))
+        x = offset[0] + bbox[0]
+        y = offset[1] + bbox[1]
+        pixels = np.array(image.crop(bbox))
+        alpha = pixels[:, :, 3:4]
+        if np.all((alpha == 0) | (alpha == 255)):
+            mask = alpha[:, :, 0] == 255
+            # Copied pixels go straight into the RGBX frame, so pack them the same way, with the padding byte set.
+            pixels[:, :, 3] = 255
+            packed = pixels.view(np.uint32)[:, :, 0]
+            return cls(x, y, packed, mask=None if mask.all() else mask)
+        # Blends run over all four bytes of the frame, since that's faster than skipping the padding. The padding is
+        # given the alpha as its color, so it stays at 255. Both are kept as bytes, as sprites for every range
+        # placard add up, and widened to float only when blended.
+        color = np.empty(pixels.shape, dtype=np.uint8)
+        color[:, :, :3] = (pixels[:, :, :3].astype(np.float32) * alpha / 255 + 0.5).astype(np.uint8)
+        color[:, :, 3:4] = alpha
+        return cls(x, y, color, transmit=255 - alpha)
+
+    @property
+    def nbytes(self):
+        """ Memory used by the sprite's pixels, in bytes. """
+        return sum(array.nbytes for array in (self.color, self.mask, self.transmit) if array is not None)
+
+    @property
+    def size(self):
+        """ Width and height of the sprite. """
+        shape = (self.transmit if self.color is None else self.color).shape
+        return shape[1], shape[0]
+
+    def tinted(self, color):
+        """
+        A coverage sprite in a color. The new sprite shares this one's coverage, so it adds no pixel memory.
+
+        :param color: RGB color, 0-255.
+        :type color: tuple
+        :return: CBSprite
+        """
+        return CBSprite(self.x, self.y, None, transmit=self.transmit,
+                        tint=np.array([*color[:3], 255], dtype=np.float32))
+
+
+class CBCompositor:
+    """
+    Composites sprites over a black background into one frame buffer. The buffer is made once and shared with the
+    output image, and each sprite only touches its own area, so assembling a frame doesn't allocate any image memory.
+    """
+
+    def __init__(self, width, height):
+        """
+        :param width: Width of the frame, in pixels.
+        :type width: int
+        :param height: Height of the frame, in pixels.
+        :type height: int
+        """
+        self._width = width
+        self._height = height
+        # The buffer is RGBX, so the image can share its memory rather than copying it. Copies and fills go through a
+        # view with each pixel as one uint32, which is much faster than working on the bytes.
+        self._buffer = np.full((height, width, 4), 255, dtype=np.uint8)
+        self._pixels = self._buffer.view(np.uint32)[:, :, 0]
+        self._scratch = np.empty(height * width * 4, dtype=np.float32)
+        self._operand = np.empty(height * width * 4, dtype=np.float32)
+        self._tint = np.empty(height * width * 4, dtype=np.float32)
+        self._black = _pack((0, 0, 0))
+        self._image = Image.frombuffer('RGBX', (width, height), self._buffer, 'raw', 'RGBX', 0, 1)
+
+    # Public Methods
+    def blit(self, sprite):
+        """
+        Draw a sprite onto the frame.
+
+        :param sprite: Sprite to draw. Must be within the frame.
+        :type sprite: CBSprite
+        """
+        width, height = sprite.size
+        rows = slice(sprite.y, sprite.y + height)
+        cols = slice(sprite.x, sprite.x + width)
+        if sprite.tint is not None:
+            # Move the frame towards the tint by the coverage. This is the same blend as for a premultiplied sprite,
+            # with the color worked out here.
+            region = self._buffer[rows, cols]
+            blended = self._scratch[:region.size].reshape(region.shape)
+            operand = self._operand[:region.size].reshape(region.shape)
+            # The tint is spread over the whole area first, as NumPy buffers arithmetic that broadcasts it.
+            tint = self._tint[:region.size].reshape(region.shape)
+            np.copyto(tint, sprite.tint)
+            np.copyto(blended, region)
+            blended -= tint
+            np.copyto(operand, sprite.transmit)
+            blended *= operand
+            blended *= 1 / 255
+            blended += tint
+            blended += 0.5
+            np.copyto(region, blended, casting='unsafe')
+        elif sprite.transmit is not None:
+            region = self._buffer[rows, cols]
+            # Scratch is taken from the front of flat buffers, so it's contiguous whatever the sprite's size. Widening
+            # into it with copies, rather than in the arithmetic, saves NumPy making buffers of its own.
+            blended = self._scratch[:region.size].reshape(region.shape)
+            operand = self._operand[:region.size].reshape(region.shape)
+            np.copyto(blended, region)
+            np.copyto(operand, sprite.transmit)
+            blended *= operand
+            blended *= 1 / 255
+            np.copyto(operand, sprite.color)
+            blended += operand
+            blended += 0.5
+            np.copyto(region, blended, casting='unsafe')
+        elif sprite.mask is not None:
+            np.copyto(self._pixels[rows, cols], sprite.color, where=sprite.mask)
+        else:
+            self._pixels[rows, cols] = sprite.color
+
+    def clear(self):
+        """
+        Start a new frame, all black.
+        """
+        self._pixels.fill(self._black)
+
+    def fill(self, x0, y0, x1, y1, color):
+        """
+        Fill a rectangle with a solid color. Corners are inclusive, like PIL's drawing.
+
+        :param x0: Left column.
+        :param y0: Top row.
+        :param x1: Right column.
+        :param y1: Bottom row.
+        :param color: RGB color, 0-255.
+        :type color: tuple
+        """
+        self._pixels[max(y0, 0):y1 + 1, max(x0, 0):x1 + 1] = _pack(color)
+
+    # Public Properties
+    @property
+    def image(self):
+        """
+        The frame as an image. The image shares the frame buffer, so it changes with the next frame. Copy it to keep
+        it.
+
+        :return: PIL.Image.Image, RGBX.
+        """
+        return self._image
+
+
+def _pack(color):
+    """
+    Pack an RGB color into an RGBX pixel, as one uint32.
+
+    :param color: RGB color, 0-255.
+    :type color: tuple
+    :return: numpy.uint32
+    """
+    return np.array([*color[:3], 255], dtype=np.uint8).view(np.uint32)[0]
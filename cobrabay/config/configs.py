@@ -366,6 +366,20 @@ class CBCoreConfig(CBConfig):
         """
         return self._config['system']['i2c']
 
+    def sensormgr_config(self):
+        """
+        Retrieve configuration for the sensor manager
+        :return: dict
+        """
+        return self._config['system']['sensor_manager']
+
+    def scheduler_config(self):
+        """
+        Retrieve configuration for the main loop scheduler
+        :return: dict
+        """
+        return self._config['system']['scheduler']
+
     def log_handlers(self):
         include_items = ['console', 'file', 'file_path', 'log_format']
         return dict(
@@ -22,6 +22,8 @@ SCHEMA_SENSOR_VL53L1X = {**SCHEMA_SENSOR_COMMON,
     'i2c_address': {'type': 'integer', 'required': True},
     'enable_board': {'type': 'integer', 'required': True},
     'enable_pin': {'type': 'integer', 'required': True},
+    'interrupt_board': {'type': 'integer', 'dependencies': 'interrupt_pin'},
+    'interrupt_pin': {'type': 'integer', 'dependencies': 'interrupt_board'},
     'distance_mode': {'type': 'string', 'allowed': ['long', 'short'], 'default': 'long'},
     #TODO: Fix type coercion.
     # Ideally this would get coerced to pint_ms, but this raises complications because of the subvalidation.
@@ -35,7 +37,16 @@ SCHEMA_SENSOR_TFMINI = {
     'port': {'type': 'string', 'required': True},
     'baud': {'type': 'integer', 'default': 115200,
              'allowed': [9600, 14400, 19200, 56000, 115200, 460800, 921600]},
-    'clustering': {'type': 'integer', 'default': 1, 'min': 1, 'max': 5}
+    'clustering': {'type': 'integer', 'default': 1, 'min': 1, 'max': 5},
+    'read_mode': {'type': 'string', 'allowed': ['inline', 'thread'], 'default': 'inline'},
+    'ring_size': {'type': 'integer', 'default': 1000, 'min': 1},
+    'acquisition': {'type': 'string', 'allowed': ['continuous', 'trigger', 'adaptive'], 'default': 'continuous'},
+    'frame_rate': {'type': 'integer', 'default': 100,
+                   'allowed': [1, 2, 5, 10, 20, 25, 50, 100, 125, 200, 250, 500, 1000]},
+    'idle_frame_rate': {'type': 'integer', 'default': 10,
+                        'allowed': [1, 2, 5, 10, 20, 25, 50, 100, 125, 200, 250, 500, 1000]},
+    'idle_timeout': {'type': 'string', 'default': '30s'},
+    'read_budget': {'type': 'string', 'default': '50ms'}
 }
 
 
@@ -100,6 +111,37 @@ CB_CORE = {
                     'wait_reset': {'type': 'integer', 'default': 10}
                 }
             },
+            'sensor_manager': {
+                'type': 'dict',
+                'schema': {
+                    'scheduling': {'type': 'string', 'allowed': ['staggered', 'sequential'], 'default': 'staggered'},
+                    'retry_delay': {'type': 'integer', 'min': 1, 'default': 2},
+                    'bus_workers': {'type': 'boolean', 'default': False},
+                    'execution_mode': {'type': 'string', 'allowed': ['inline', 'thread', 'process'],
+                                       'default': 'inline'}
+                },
+                'default': {
+                    'scheduling': 'staggered',
+                    'retry_delay': 2,
+                    'bus_workers': False,
+                    'execution_mode': 'inline'
+                }
+            },
+            'scheduler': {
+                'type': 'dict',
+                'schema': {
+                    'display_rate': {'type': 'number', 'min': 1, 'default': 10},
+                    'idle_rate': {'type': 'number', 'min': 0.1, 'default': 1},
+                    'network_rate': {'type': 'number', 'min': 0.1, 'default': 4},
+                    'sensor_rate': {'type': 'number', 'min': 1, 'default': 50}
+                },
+                'default': {
+                    'display_rate': 10,
+                    'idle_rate': 1,
+                    'network_rate': 4,
+                    'sensor_rate': 50
+                }
+            },
             'logging': {
                 'type': 'dict',
                 'required': True,
@@ -179,6 +221,9 @@ CB_CORE = {
             'font_size_clock': {'type': 'integer'},
             'font_size_range': {'type': 'integer'},
             'strobe_speed': {'type': 'quantity', 'coerce': 'pint_seconds'},
+            'placard_cache_size': {'type': 'integer', 'min': 1, 'default': 64},
+            'range_table': {'type': 'string', 'allowed': ['off', 'startup', 'background'], 'default': 'background'},
+            'cache_dir': {'type': 'string'},
             'icons': {
                 'type': 'dict',
                 'required': True,
@@ -261,6 +306,22 @@ CB_CORE = {
                 },
                 'depth': {'type': 'quantity', 'coerce': 'pint_cm'},
                 'report_adjusted': {'type': 'boolean', 'default': True},
+                'profiles': {
+                    'type': 'dict',
+                    'keysrules': {
+                        'type': 'string',
+                        'allowed': ['ready', 'not_ready', 'docking', 'undocking', 'verify', 'postroll']
+                    },
+                    'valuesrules': {
+                        'type': 'dict',
+                        'schema': {
+                            'ranging': {'type': 'boolean', 'default': True},
+                            'timing': {'type': 'string'},
+                            'distance_mode': {'type': 'string', 'allowed': ['long', 'short']}
+                        }
+                    },
+                    'default': {}
+                },
                 'longitudinal': {
                     'type': 'dict',
                     'schema': {
@@ -270,7 +331,10 @@ CB_CORE = {
                                 'spread_park': {'type': 'quantity', 'coerce': 'pint_cm', 'default': '2 in'},
                                 'zero_point': {'type': 'quantity', 'coerce': 'pint_cm', 'default': '0 in'},
                                 'pct_warn': {'type': 'number', 'coerce': 'percent', 'min': 0, 'max': 100, 'default': 30},
-                                'pct_crit': {'type': 'number', 'coerce': 'percent', 'min': 0, 'max': 100, 'default': 10}
+                                'pct_crit': {'type': 'number', 'coerce': 'percent', 'min': 0, 'max': 100, 'default': 10},
+                                'tracking': {'type': 'boolean', 'default': False},
+                                'tracking_alpha': {'type': 'number', 'min_exclusive': 0, 'max': 1, 'default': 0.5},
+                                'tracking_beta': {'type': 'number', 'min': 0, 'max_exclusive': 2, 'default': 0.1}
                             }
                         },
                         'sensors': {
@@ -282,7 +346,10 @@ CB_CORE = {
                                     'spread_park': {'type': 'quantity', 'coerce': 'pint_cm'},
                                     'zero_point': {'type': 'quantity', 'coerce': 'pint_cm'},
                                     'pct_warn': {'type': 'number', 'min': 0, 'max': 100},
-                                    'pct_crit': {'type': 'number', 'min': 0, 'max': 100}
+                                    'pct_crit': {'type': 'number', 'min': 0, 'max': 100},
+                                    'tracking': {'type': 'boolean'},
+                                    'tracking_alpha': {'type': 'number', 'min_exclusive': 0, 'max': 1},
+                                    'tracking_beta': {'type': 'number', 'min': 0, 'max_exclusive': 2}
                                 }
                             }
                         }
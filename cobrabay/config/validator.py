@@ -16,7 +16,8 @@ class CBValidator(cerberus.Validator):
     """
     Cerberus Validator with custom rules and types.
 
-    Supports the 'quantity' type, constraining on dimensionality and coercing values to 'seconds' or 'cm'.
+    Supports the 'quantity' type, constraining on dimensionality and coercing values to 'seconds' or 'cm', and
+    exclusive bounds on numbers.
     """
     types_mapping = cerberus.Validator.types_mapping.copy()
     types_mapping['quantity'] = cerberus.TypeDefinition('quantity', (pint.Quantity,), ())
@@ -29,6 +30,21 @@ class CBValidator(cerberus.Validator):
         if str(value.dimensionality) != constraint:
             self._error(field, "Not in proper dimension {}".format(constraint))
 
+    # Bounds that exclude the limit itself, for values where the limit is invalid.
+    def _validate_max_exclusive(self, constraint, field, value):
+        """
+        {'type': 'number'}
+        """
+        if value >= constraint:
+            self._error(field, "Must be less than {}".format(constraint))
+
+    def _validate_min_exclusive(self, constraint, field, value):
+        """
+        {'type': 'number'}
+        """
+        if value <= constraint:
+            self._error(field, "Must be greater than {}".format(constraint))
+
     # Coercers. Apparently you can't pass parameters, so each unit needs its own.
     @staticmethod
     def _normalize_coerce_pint_seconds(value):
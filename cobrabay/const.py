@@ -50,6 +50,12 @@ SENSOR_RESP_FLOOD = 'flood'
 SENSOR_RESP_TOOCLOSE = 'tooclose'
 SENSOR_RESP_TOOFAR = 'toofar'
 
+# Codes for sensor states and response types, for passing them as numbers, ie: through shared memory. The code is the
+# position in the tuple.
+SENSTATE_CODES = (SENSTATE_FAULT, SENSTATE_DISABLED, SENSTATE_ENABLED, SENSTATE_RANGING, SENSTATE_NOTRANGING)
+SENSOR_RESP_CODES = (SENSOR_RESP_OK, SENSOR_RESP_NOTRANGING, SENSOR_RESP_INR, SENSOR_RESP_WEAK, SENSOR_RESP_STRONG,
+                     SENSOR_RESP_FLOOD, SENSOR_RESP_TOOCLOSE, SENSOR_RESP_TOOFAR, SENSTATE_FAULT)
+
 # Detector quality values.
 SENSOR_QUALITY_OK = 'ok'
 SENSOR_QUALITY_WARN = 'warning'
@@ -72,3 +78,16 @@ DIR_STILL = 'still'
 
 # Time intervals
 TIME_MOTION_EVAL = timedelta64(250,'ms')
+TIME_DISPLAY_ROTATE = 3  # Seconds to show each bay when more than one is in motion.
+
+# Vector estimation
+VECTOR_SAMPLES = 10  # Most range readings to fit the vector over.
+VECTOR_WINDOW = timedelta64(750,'ms')  # Readings older than this aren't used for the vector.
+
+# Display range tables
+RANGE_TABLE_COLORS = ('green', 'yellow', 'red')  # Text colors range placards are tinted in.
+RANGE_TABLE_VERSION = 4  # Change when the table format changes, so cached tables are rebuilt.
+
+# Display font sizing
+FONT_SIZE_REFERENCE = 100  # Font size strings are measured at to find the widest.
+FONT_SIZE_CACHE_FILE = 'font_sizes.json'  # File in the display cache directory font sizes are saved to.
@@ -2,11 +2,12 @@
 Cobra Bay Core
 """
 
-import copy
+import multiprocessing
 import queue
 import sys
 import signal
 import logging
+import threading
 import time
 from logging.handlers import WatchedFileHandler
 from pprint import pformat
@@ -30,8 +31,20 @@ class CBCore:
         self._bays = {}
         self._network = None
         self._sensor_latest_data = {}
-        self.sensor_log = []
+        self.sensor_history = None  # History of scans from the sensor manager, created with the sensor manager.
+        self._mailbox = None  # Mailbox the sensor manager puts scans in.
+        self._mailbox_sequence = 0  # Sequence of the last scan taken from the mailbox.
         self._sensormgr = None
+        self._motions = []  # Bays in a motion state, in the order they started.
+        self._undock_waiting = set()  # Undocking bays which haven't started moving yet.
+        self._display_bay = None  # Bay currently on the display.
+        self._display_mark = 0  # When the display switched to the current bay.
+        self._schedule = None  # Rates for the main loop scheduler, from the config.
+        # Times something other than a scan has woken the main loop, and the count it last handled. A count can't lose
+        # a wake that lands while the loop is checking it, as clearing a flag could.
+        self._wakes = 0
+        self._wakes_seen = 0
+        self._wake_lock = threading.Lock()
         # Network data dict. This collects data from subscriptions as well as interface and MQTT status.
         # At start, we assume interface is down, and MQTT by definition can't be connected.
         self._net_data = {
@@ -76,28 +89,46 @@ class CBCore:
         """
         # Register the signal handlers.
         self._setup_signal_handlers()
+        # Next time each part of the system is due, on the monotonic clock.
+        due = {'sensors': 0, 'display': 0, 'network': 0}
         # Start the run loop.
         try:
             # Main run loop. Keep running as long as the exit code isn't set.
             while self._exit_code < 0:
-                # Update the local sensor variable.
-                self._sensor_update()
-                # Call Bay update to have them update their data state.
-                for bay_id in self._bays:
-                    self._bays[bay_id].update()
+                woken = self._woken()
+                now = time.monotonic()
+                # Update the local sensor variable. In thread and process mode, a new scan in the mailbox wakes us.
+                if now >= due['sensors'] or self._mailbox.sequence != self._mailbox_sequence:
+                    if self._sensor_update():
+                        # Call Bay update to have them update their data state.
+                        for bay_id in self._bays:
+                            self._bays[bay_id].update()
+                    due['sensors'] = now + self._sensor_wait()
+                # Check triggers and execute actions if needed. Trigger messages wake the loop.
+                if woken or now >= due['network']:
+                    self._trigger_check()
+                    # A bay starting a motion shouldn't have to wait out the idle display rate.
+                    if len(self._motions) == 0 and any(self._bays[bay_id].state in cobrabay.const.BAYSTATE_MOTION
+                                                       for bay_id in self._bays):
+                        due['display'] = now
+                # Service any bays in motion. If there are none, show the clock.
+                if now >= due['display']:
+                    for bay_id in self._bays:
+                        self._bays[bay_id].update()
+                    if self._motion():
+                        due['display'] = now + 1 / self._schedule['display_rate']
+                    else:
+                        self._display.show("clock")
+                        due['display'] = now + 1 / self._schedule['idle_rate']
                 # Poll the network
-                self._network.poll()
-                # Check triggers and execute actions if needed.
-                self._trigger_check()
-                # See if any of the bays checked to a motion state.
-                for bay_id in self._bays:
-                    if self._bays[bay_id].state in cobrabay.const.BAYSTATE_MOTION:
-                        # Set the overall system state.
-                        self.system_state = self._bays[bay_id].state
-                        # Go into the motion loop.
-                        self._motion(bay_id)
-                        break
-                self._display.show("clock")
+                if now >= due['network']:
+                    self._network.poll()
+                    due['network'] = now + 1 / self._schedule['network_rate']
+                # Sleep until the next deadline, a new scan, or until woken. A wake since the top of the loop is held
+                # by the mailbox, so the wait returns at once rather than missing it.
+                wait = min(due.values()) - time.monotonic()
+                if wait > 0:
+                    self._mailbox.wait(after=self._mailbox_sequence, timeout=wait)
         except BaseException as e:
             # Exit due to failure.
             self._logger.critical("Unexpected exception encountered!")
@@ -117,10 +148,22 @@ class CBCore:
         # Shut off the sensors.
         # This must be done first, otherwise the I2C bus will get cut out from underneath the sensors.
         # Set all sensors to disable. This won't actually disable the TFMini, but meh.
+        # Stop the scanning thread first, if there is one, so it isn't reading the sensors as they're shut off.
+        self._sensormgr.loop_stop()
         self._sensormgr.set_sensor_state(cobrabay.const.SENSTATE_DISABLED)
         self._logger.critical("Terminated.")
         sys.exit(exit_code)
 
+    def wake(self):
+        """
+        Wake the main loop to handle an event, such as an incoming trigger message, without waiting for the next
+        deadline. Safe to call from other threads.
+        """
+        with self._wake_lock:
+            self._wakes += 1
+        if self._mailbox is not None:
+            self._mailbox.notify()
+
     # Public Properties
 
     @property
@@ -154,55 +197,55 @@ class CBCore:
         self._logger.info("Core command received: {}".format(cmd))
         self._logger.info("Core command handling not yet implemented. Nothing to do.")
 
-    def _motion(self, bay_id):
-        self._logger.info('Beginning {} on bay {}.'.format(self._bays[bay_id].state, bay_id))
-
-        # If the bay is in UNDOCKING, show 'UNDOCKING' on the display until there is motion. If there is no motion by
-        # the undock timeout, return to READY.
-        if self._bays[bay_id].state == cobrabay.const.BAYSTATE_UNDOCKING:
-            self._logger.debug("{} ({})".format(self._bays[bay_id].vector, type(self._bays[bay_id].vector)))
-            while (self._bays[bay_id].vector.direction in (cobrabay.const.DIR_STILL, cobrabay.const.GEN_UNKNOWN) and
-                   self._bays[bay_id].state == cobrabay.const.BAYSTATE_UNDOCKING):
-                # Update local sensor variable.
-                self._sensor_update()
-                # Update bays with sensor data.
-                for bay_id in self._bays:
-                    try:
-                        self._bays[bay_id].update()
-                    except IndexError as e:
-                        self._logger.error("Bay {} threw index error. Trace details...".format(bay_id))
-                        self._logger.exception(e)
-                        self._logger.debug("Sensor log at time of exception: {}".format(self.sensor_log))
-                self._display.show(mode='message', message="UNDOCK", color="orange", icons=False)
-                # Timeout and go back to ready if the vehicle hasn't moved by the timeout.
-                # Kids are probably running around.
-                #self._bays[bay_id].check_timer()
-                # If the bay state has returned to ready, break.
-                # Check the network
-                self._network_handler()
-                # Check triggers for changes.
-                self._trigger_check()
-
-        # As long as the bay is in the desired state, keep running.
-        while self._bays[bay_id].state in cobrabay.const.BAYSTATE_MOTION:
-            self._logger.debug("{} motion - Displaying".format(cobrabay.const.BAYSTATE_MOTION))
-            # Send the bay object reference to the display method.
-            #TODO: Redo how the display gets its data.
-            self._display.show_motion(cobrabay.const.BAYSTATE_MOTION, self._bays[bay_id])
-            # Update local sensor variable.
-            self._logger.debug("{} motion - Updating local sensor values.".format(cobrabay.const.BAYSTATE_MOTION))
-            self._sensor_update()
-            # Update bays with sensor data.
-            for bay_id in self._bays:
-                self._bays[bay_id].update()
-            # Poll the network.
-            self._logger.debug("{} motion - Polling network.".format(cobrabay.const.BAYSTATE_MOTION))
-            self._network_handler()
-            # Check for completion
-            #self._bays[bay_id].check_timer()
-            # Check the triggers. This lets an abort be called or an underlying system command be called.
-            self._trigger_check()
-        self._logger.info("Bay state changed to {}. Returning to idle.".format(self._bays[bay_id].state))
+    def _motion(self):
+        """
+        Service every bay in a motion state. Doesn't block, so any number of bays can be in motion at once, each
+        updated on every pass of the main loop. When more than one bay is in motion, the display rotates between them.
+        """
+        moving = [bay_id for bay_id in self._bays if self._bays[bay_id].state in cobrabay.const.BAYSTATE_MOTION]
+
+        # Log bays starting and finishing motions.
+        for bay_id in moving:
+            if bay_id not in self._motions:
+                self._logger.info('Beginning {} on bay {}.'.format(self._bays[bay_id].state, bay_id))
+                self._motions.append(bay_id)
+                # Undocking bays show 'UNDOCK' until there is motion.
+                if self._bays[bay_id].state == cobrabay.const.BAYSTATE_UNDOCKING:
+                    self._undock_waiting.add(bay_id)
+        for bay_id in [bay_id for bay_id in self._motions if bay_id not in moving]:
+            self._logger.info("Bay {} state changed to {}.".format(bay_id, self._bays[bay_id].state))
+            self._motions.remove(bay_id)
+            self._undock_waiting.discard(bay_id)
+
+        if len(self._motions) == 0:
+            if self.system_state in cobrabay.const.BAYSTATE_MOTION:
+                self._logger.info("No bays in motion. Returning to idle.")
+                self.system_state = 'running'
+            return False
+        # Set the overall system state from the bay which has been in motion the longest.
+        self.system_state = self._bays[self._motions[0]].state
+
+        # Pick the bay to display, moving on to the next one when its time is up.
+        now = time.monotonic()
+        if self._display_bay not in self._motions:
+            self._display_bay = self._motions[0]
+            self._display_mark = now
+        elif len(self._motions) > 1 and now - self._display_mark >= cobrabay.const.TIME_DISPLAY_ROTATE:
+            self._display_bay = self._motions[(self._motions.index(self._display_bay) + 1) % len(self._motions)]
+            self._display_mark = now
+            self._logger.debug("Rotating display to bay {}.".format(self._display_bay))
+
+        # Once an undocking bay shows movement, switch it to the motion display.
+        for bay_id in list(self._undock_waiting):
+            if self._bays[bay_id].vector.direction not in (cobrabay.const.DIR_STILL, cobrabay.const.GEN_UNKNOWN):
+                self._undock_waiting.discard(bay_id)
+
+        if self._display_bay in self._undock_waiting:
+            self._display.show(mode='message', message="UNDOCK", color="orange", icons=False)
+        else:
+            # Send a snapshot of the bay to the display.
+            self._display.show_motion(cobrabay.const.BAYSTATE_MOTION, self._bays[self._display_bay].snapshot)
+        return True
 
     def _network_handler(self):
         """ Common network handlers. Pushes data to the network, polls the MQTT connection and handles inbound
@@ -215,53 +258,66 @@ class CBCore:
 
     def _sensor_update(self):
         """
-        Update local latest sensor variable from the data queue.
-        :return:
+        Update local latest sensor variable from the mailbox.
+        :return: bool, True if there was new data.
         """
-        # Loop the sensors.
-        #TODO: Make this conditional on execution mode (single/async/threaded/process)
-        self._sensormgr.loop()
+        # Loop the sensors. In thread and process mode, the sensor manager scans on its own and we only pick up the
+        # newest data.
+        if self._sensormgr.execution_mode == 'inline':
+            self._sensormgr.loop()
+        elif not self._sensormgr.loop_running:
+            raise RuntimeError("Sensor manager {} has stopped.".format(self._sensormgr.execution_mode))
         # Pull the sensor data into the latest data holding variable. This should ease threading.
-        if self._q_cbsmdata.empty():
-            self._logger.debug("No data available in sensor queue.")
-        else:
-            latest_data = self._q_cbsmdata.get_nowait()
-            self._logger.debug("Fetched sensor data from queue: {}".format(latest_data))
-            self._q_cbsmdata.task_done()
-            # latest_status = self._q_cbsmstatus.get_nowait()
-            # self._q_cbsmstatus.task_done()
-            if len(self.sensor_log) > 0:
-                if latest_data.timestamp != self.sensor_log[0].timestamp:
-                    # If timestamps are different, sensor manager has updated the data, and it's new to fetch.
-                    self._sensor_log_add(latest_data)
-                else:
-                    self._logger.debug("No change to latest sensor data, nothing to update.")
-                    return
+        if self._mailbox.sequence == self._mailbox_sequence:
+            self._logger.debug("No new data in sensor mailbox.")
+            return False
+        self._mailbox_sequence, latest_data = self._mailbox.get()
+        if self._sensormgr.execution_mode == 'process':
+            # The mailbox only signals across processes. Read the scan from the board.
+            latest_data = self._sensormgr.board.read()
+        self._logger.debug("Fetched sensor data: {}".format(latest_data))
+        if self.sensor_history.latest is not None:
+            if latest_data.generation != self.sensor_history.latest.generation:
+                # If generations are different, sensor manager has updated the data, and it's new to fetch.
+                self._sensor_history_add(latest_data)
             else:
-                # If there's no data in the log, we're at startup and go ahead and add.
-                self._sensor_log_add(latest_data)
+                self._logger.debug("No change to latest sensor data, nothing to update.")
+                return False
+        else:
+            # If there's no data in the history, we're at startup and go ahead and add.
+            self._sensor_history_add(latest_data)
+        return True
+
+    def _sensor_wait(self):
+        """
+        Time until the sensors should next be checked. Inline, this is when the sensor manager next has a sensor due.
+        In thread and process mode, scans wake the main loop, so this is only to check the sensor manager is running.
+
+        :return: float, seconds.
+        """
+        if self._sensormgr.execution_mode != 'inline':
+            return 1 / self._schedule['idle_rate']
+        if self._sensormgr.next_due is not None:
+            return max(0, (self._sensormgr.next_due - time.monotonic_ns()) / 1000000000)
+        return 1 / self._schedule['sensor_rate']
 
-    def _sensor_log_add(self, sensor_response):
+    def _sensor_history_add(self, sensor_response):
         """
-        Add a SensorResponse from the sensor manager to the log.
+        Add a SensorResponse from the sensor manager to the history.
 
         :param sensor_response: Sensor Response record to add
         :type sensor_response: namedtuple
         :return:
         """
-        self.sensor_log = [copy.deepcopy(sensor_response)] + self.sensor_log[0:99]
-        self._logger.debug("Sensor log now has {} entries.".format(len(self.sensor_log)))
-        if len(self.sensor_log) == 0:
-            # If we're just starting to get data, we can pull the data over directly.
-            self._logger.debug("No data marked as latest, considering all data in sensor log as latest.")
-            self._sensor_latest_data = self.sensor_log[0].sensors
+        self.sensor_history.append(sensor_response)
+        self._logger.debug("Sensor history now has {} entries.".format(len(self.sensor_history)))
         # Pull out the most recent data and put it in the sensor_most_recent dict.
-        for sensor_id in self.sensor_log[0].sensors:
+        for sensor_id in sensor_response.sensors:
             # Don't update when waiting for an interrupt.
-            if self.sensor_log[0].sensors[sensor_id].response_type == cobrabay.const.SENSOR_RESP_INR:
+            if sensor_response.sensors[sensor_id].response_type == cobrabay.const.SENSOR_RESP_INR:
                 self._logger.debug("Sensor '{}' is waiting for interrupt. Keeping previous latest value.".format(sensor_id))
             else:
-                self._sensor_latest_data[sensor_id] = self.sensor_log[0].sensors[sensor_id]
+                self._sensor_latest_data[sensor_id] = sensor_response.sensors[sensor_id]
                 self._logger.debug("Adding to sensor data as latest. Latest data now has: {}".format(
                     self._sensor_latest_data))
 
@@ -437,14 +493,32 @@ class CBCore:
         sensor_config = self._active_config.sensors_config()
         self._logger.debug("Using Sensor config:\n{}".format(pformat(sensor_config)))
         self._logger.debug("Using I2C config:\n{}".format(pformat(self._active_config.i2c_config())))
-        # Create the queues needed for the sensor manager.
-        self._q_cbsmdata = queue.Queue(maxsize=1)
-        self._q_cbsmstatus = queue.Queue(maxsize=1)
-        self._q_cbsmcontrol = queue.Queue(maxsize=1)
-        self._sensormgr = cobrabay.CBSensorMgr(sensor_config=sensor_config, i2c_config=self._active_config.i2c_config(),
-                                               log_level=self._active_config.get_loglevel('sensors'),
-                                               q_cbsmdata=self._q_cbsmdata, q_cbsmstatus=self._q_cbsmstatus,
-                                               q_cbsmcontrol=self._q_cbsmcontrol)
+        sensormgr_config = self._active_config.sensormgr_config()
+        self._schedule = self._active_config.scheduler_config()
+        self._logger.debug("Using scheduler config:\n{}".format(pformat(self._schedule)))
+        self._logger.debug("Using Sensor Manager config:\n{}".format(pformat(sensormgr_config)))
+        if sensormgr_config['execution_mode'] == 'process':
+            # Scans come back through the shared memory board, signalled by the process' mailbox, so only a control
+            # queue is needed, and it has to work across processes.
+            self._q_cbsmcontrol = multiprocessing.JoinableQueue()
+            self._sensormgr = cobrabay.CBSensorMgrProcess(sensor_config=sensor_config,
+                                                          i2c_config=self._active_config.i2c_config(),
+                                                          log_level=self._active_config.get_loglevel('sensors'),
+                                                          q_cbsmcontrol=self._q_cbsmcontrol,
+                                                          **sensormgr_config)
+            self._mailbox = self._sensormgr.mailbox
+        else:
+            # Scans come back through the mailbox, which wakes the main loop in thread mode.
+            self._mailbox = cobrabay.CBMailbox()
+            # Control is unbounded, so bays changing state at the same time don't block on each other.
+            self._q_cbsmcontrol = queue.Queue()
+            self._sensormgr = cobrabay.CBSensorMgr(sensor_config=sensor_config,
+                                                   i2c_config=self._active_config.i2c_config(),
+                                                   log_level=self._active_config.get_loglevel('sensors'),
+                                                   q_cbsmcontrol=self._q_cbsmcontrol, mailbox=self._mailbox,
+                                                   **sensormgr_config)
+        # Create the history to hold scans from the sensor manager.
+        self.sensor_history = cobrabay.CBSensorHistory(sensor_ids=list(sensor_config.keys()))
         # Register the sensor manager with the network handler, now that it exists.
         self._logger.debug("Registering sensor manager with the network module.")
         self._network.register_sensormgr(self._sensormgr)
@@ -454,14 +528,15 @@ class CBCore:
             (cobrabay.const.SENSTATE_RANGING,None)
         )
         #self._sensormgr.set_sensor_state(target_state=cobrabay.const.SENSTATE_RANGING)
-        # Loop once and get initial latest data.
-        #TODO: Add config option for threading vs. not and make conditional.
+        # Loop once and get initial latest data. This is done inline even in thread mode, so there's data before the
+        # bays are created.
         self._sensormgr.loop()
+        if self._sensormgr.execution_mode == 'thread':
+            self._logger.info("Starting sensor manager thread.")
+            self._sensormgr.loop_start()
 
         # Initial sensor update.
         self._sensor_update()
-        # self._sensor_latest_data = self._q_cbsmdata.get_nowait()
-        # self._logger.debug("Initial data from sensor manager: {}".format(self._sensor_latest_data))
 
         # Create master bay object for defined docking bay
         # Master list to store all the bays.
@@ -599,3 +674,15 @@ class CBCore:
         else:
             self._logger.critical("Unexpected signal received. Cleaning up and exiting.")
             self._exit_code = signalNumber+128
+
+    def _woken(self):
+        """
+        Check if the main loop has been woken since it last checked. Only the main loop should call this.
+
+        :return: bool
+        """
+        # Read the count once, so a wake after the read is still unseen on the next check.
+        wakes = self._wakes
+        woken = wakes != self._wakes_seen
+        self._wakes_seen = wakes
+        return woken
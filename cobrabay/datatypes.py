@@ -32,12 +32,13 @@ Intercept = namedtuple_untyped('Intercept', ['sensor_id', 'intercept'])
 # TFMP_data = namedtuple_untyped("TFMP_Data", ["status", "distance", "flux", "temperature"])
 class TFMPData(namedtuple_typed):
     """"
-    Response from the TFMini Plus
+    Response from the TFMini Plus. Timestamp is the monotonic time in nanoseconds the frame was received, when known.
     """
     status: str
     distance: float
     flux: float
     temperature: float
+    timestamp: int or None = None
 
 
 class SensorReading(namedtuple_typed):
@@ -46,6 +47,8 @@ class SensorReading(namedtuple_typed):
     response_type will be as defined in const.SENOR_VALUE_*. Only SENOR_VALUE_OK should be considered readable.
     All other response codes can be considered failures to read. They may be lumped together or parsed out as
     appropriate.
+    Sensors which filter their readings may also report the confidence of the reading, from 0 to 1, and the number of
+    samples that went into it.
     """
     state: str
     status: str
@@ -54,25 +57,65 @@ class SensorReading(namedtuple_typed):
     range: Quantity or None
     temp: Quantity or None
     fault_reason: str or None
+    confidence: float or None = None
+    samples: int or None = None
 
 
 class SensorResponse(namedtuple_typed):
     """
     Contains a single set of sensor responses from the sensor manager at a given moment in time. Every sensor should
     always have a SensorReading returned. Those without a new reading ready should use the most recent values with the
-    SENSOR_RESP_INR (Interrupt Not Ready) response type.
+    SENSOR_RESP_INR (Interrupt Not Ready) response type. Generation increases by one with each scan the sensor manager
+    publishes.
     """
     timestamp: datetime64
     sensors: dict
     scan_time: float
+    generation: int = 0
+
+
+class SensorProfile(namedtuple_typed):
+    """
+    Command to the sensor manager to apply an operating profile to a set of sensors, sent through the control queue.
+    Profiles are named for the bay state they're used in. Sensors are put into the given state, and sensors which
+    support them have the timing budget and distance mode changed. A None value leaves that setting as it is.
+    """
+    profile: str
+    state: str
+    sensors: list or None
+    timing: str or None = None
+    distance_mode: str or None = None
 
 
 # Vector = namedtuple_untyped('Vector', ['speed', 'direction'])
 class Vector(namedtuple_typed):
     """
-    Vector of longitudinal movement
+    Vector of longitudinal movement. Confidence is how well the speed fits the readings it was estimated from, from 0
+    to 1, if known.
     """
     timestamp: datetime64
     speed: float
     direction: str
+    confidence: float or None = None
 
+
+class BaySnapshot(namedtuple_typed):
+    """
+    State of a bay as of one update, with all derived values already computed. Consumers like the display and network
+    read this instead of the bay, so they all see the same values and nothing is recomputed on access. The sensor info
+    is a copy, not shared with the bay, and should be treated as read only. Laterals are (sensor_id, side) pairs in
+    intercept order. The selected range reading is also given in mm, or None if there isn't one.
+    """
+    id: str
+    name: str
+    state: str
+    generation: int or None
+    occupied: str
+    vector: Vector
+    motion_timer: Quantity
+    range_pct: float
+    selected_range: str
+    configured_sensors: dict
+    laterals: tuple
+    sensor_info: dict
+    range_mm: float or None = None
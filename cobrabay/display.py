@@ -4,16 +4,24 @@
 # Displays statuses on an RGB Matrix
 ####
 
+import hashlib
+import json
 import logging
+import os
+import threading
+import zipfile
 from base64 import b64encode
+from collections import OrderedDict
 from datetime import datetime
 from io import BytesIO
+from math import ceil, floor
+import numpy as np
 from pint import UnitRegistry, Quantity
 from PIL import Image, ImageDraw, ImageFont, ImageColor
 from rgbmatrix import RGBMatrix, RGBMatrixOptions
-import rgbmultitool
 from rgbmultitool import graphics
 from time import monotonic_ns
+from cobrabay.compositor import CBCompositor, CBSprite
 from cobrabay.const import *
 
 
@@ -32,6 +40,9 @@ class CBDisplay:
                  strobe_speed=None,
                  icons=None,
                  unit_system="metric",
+                 placard_cache_size=64,
+                 range_table='background',
+                 cache_dir=None,
                  log_level="WARNING"):
         """
         Cobrabay Display Object
@@ -44,9 +55,11 @@ class CBDisplay:
         :type gpio_slowdown: int
         :param font: Path to the font to use for text. Must be a TTF.
         :type font: Path
-        :param font_size_clock: Font size to use for the clock. If not provided will be auto-scaled, which takes time.
+        :param font_size_clock: Font size to use for the clock. If not provided will be auto-scaled, and saved to the
+        cache directory if there is one.
         :type font_size_clock: int
-        :param font_size_range: Font size to use for range display. If not provided will be auto-scaled, which takes time.
+        :param font_size_range: Font size to use for range display. If not provided will be auto-scaled, and saved to the
+        cache directory if there is one.
         :type font_size_clock: int
         :param cbcore: Reference to the Core object.
         :param bottom_box: For motions, bottom box to use. May be 'off', 'strobe', or 'progress'
@@ -57,6 +70,14 @@ class CBDisplay:
         :type icons: dict
         :param unit_system: Unit system to display in. May be 'imperial' or 'metric'
         :type unit_system: str
+        :param placard_cache_size: Number of rendered text placards to keep for reuse.
+        :type placard_cache_size: int
+        :param range_table: When registering a bay, pre-render a placard for every range it can show. May be 'off',
+        'startup' to build it before registration returns, or 'background' to build it in its own thread.
+        :type range_table: str
+        :param cache_dir: Directory to save pre-rendered placards and auto-scaled font sizes in, so they don't need to be
+        worked out again on the next start. Not saved if None.
+        :type cache_dir: str
         :param log_level: Logging level for the display sub-logger. Defaults to 'Warning'
         :type log_level: str
         """
@@ -80,6 +101,17 @@ class CBDisplay:
         self._icons = icons
         self._logger.info("Icon settings: {}".format(self._icons))
 
+        # Caches for rendered text. These have to exist before any text is drawn, including finding font sizes.
+        self._font_cache = {}  # Loaded fonts, by size.
+        self._placard_cache = OrderedDict()  # Rendered placards, least recently used first.
+        self._placard_cache_size = placard_cache_size
+        self._cache_stats = {'placard_hits': 0, 'placard_misses': 0}
+        if range_table not in ('off', 'startup', 'background'):
+            raise ValueError("Range table must be 'off', 'startup' or 'background', not '{}'".format(range_table))
+        self._range_table_mode = range_table
+        self._cache_dir = cache_dir
+        self._font_digest_value = None  # Hash of the font file, for naming cache files.
+
         # Default the bottom box appropriately.
         if bottom_box is None:
             bottom_box = 'strobe'
@@ -94,11 +126,10 @@ class CBDisplay:
 
         # Find font sizes if necessary.
         if font_size_clock is None:
-            self._logger.warning("No clock font size provided. Auto-calculating, this may take a while...")
+            self._logger.info("No clock font size provided. Auto-calculating.")
             self._font_size_clock = self._find_font_size_clock(width=(self._matrix_width - 6),
                                                                height=(self._matrix_height - 6))
-            self._logger.warning("Determined clock font size to be '{}'. Recommend putting this in the config!".
-                                 format(self._font_size_clock))
+            self._logger.info("Determined clock font size to be '{}'.".format(self._font_size_clock))
         else:
             self._font_size_clock = font_size_clock
         # Can't calculate the font size for the range now, so just save the flag.
@@ -106,10 +137,14 @@ class CBDisplay:
 
         # Initialize instance variables.
         self._current_image = None
+        self._current_rgb = None  # Last image sent to the matrix.
+        self._compositor = CBCompositor(self._matrix_width, self._matrix_height)  # Assembles motion frames.
+        self._shown = None  # What show() last drew, so an unchanged message isn't redrawn.
         # Operating settings. These get reset on every start.
         self._running = {'strobe_offset': 0, 'strobe_timer': monotonic_ns()}
         # Layers dict.
         self._layers = {'lateral': {}}
+        self._bay_ids = []  # Bays registered with the display.
 
         # Report the matrix size.
         self._logger.info("Matrix is {}x{}".format(self._matrix_width, self._matrix_height))
@@ -125,7 +160,8 @@ class CBDisplay:
     ## Public Methods
     def register_bay(self, bay_obj):
         '''
-        Register a bay with the display. This pre-creates all the needed images for display.
+        Register a bay with the display. This pre-creates all the needed images for display, as sprites for the
+        compositor.
 
         :param bay_obj: The bay object being registered.
         :type bay_obj: CBBay
@@ -135,15 +171,21 @@ class CBDisplay:
         self._logger.debug("Setting up for laterals: {}".format(bay_obj.lateral_sorted))
         # Initialize a dict for this bay.
         self._layers[bay_obj.id] = {}
+        if bay_obj.id not in self._bay_ids:
+            self._bay_ids.append(bay_obj.id)
 
         # Determine the proper range font size for this bay.
-        if self._font_size_range is None:
-            self._logger.warning("Range font size not pre-set. Auto-scaling, this may take some time")
-            self._font_size_range = self._find_font_size_range(bay_obj.depth, bay_obj.depth - bay_obj.depth_abs)
-            self._logger.warning("Found range font size: {}".format(self._font_size_range))
+        if self._font_size_range is None and bay_obj.range_span is not None:
+            self._logger.info("Range font size not pre-set. Auto-scaling.")
+            self._font_size_range = self._find_font_size_range(*bay_obj.range_span)
+            self._logger.info("Found range font size: {}".format(self._font_size_range))
         else:
             self._logger.info("Using range font size '{}'".format(self._font_size_range))
 
+        # Pre-render the range placards.
+        if self._range_table_mode != 'off':
+            self._range_table_start(bay_obj)
+
         # If no lateral detectors are defined, do nothing else.
         if len(bay_obj.lateral_sorted) == 0:
             return
@@ -181,43 +223,48 @@ class CBDisplay:
                 else:
                     raise ValueError("Not a valid side option, this should never happen!")
 
+                # Each layer is drawn on an image just big enough for its bar, and placed on the frame as a sprite.
+                # Full-matrix images would be almost entirely transparent.
+                bar_top = 1 + accumulated_height
+                bar_size = (3, pixel_lengths[i] + 1)
+
                 # Make an image for the 'fault' status.
-                img = Image.new('RGBA', (self._matrix_width, self._matrix_height), (0, 0, 0, 0))
+                img = Image.new('RGBA', bar_size, (0, 0, 0, 0))
                 # Make a striped box for fault.
                 img = self._rectangle_striped(
                     img,
-                    (line_w, 1 + accumulated_height),
-                    (line_w + 2, 1 + accumulated_height + pixel_lengths[i]),
+                    (0, 0),
+                    (2, pixel_lengths[i]),
                     pricolor='red',
                     seccolor='yellow'
                 )
-                self._layers[bay_obj.id][sensor_id][side]['fault'] = img
+                self._layers[bay_obj.id][sensor_id][side]['fault'] = CBSprite.from_image(img, (line_w, bar_top))
                 del (img)
 
                 # Make an image for no_object
-                img = Image.new('RGBA', (self._matrix_width, self._matrix_height), (0, 0, 0, 0))
+                img = Image.new('RGBA', (1, pixel_lengths[i] + 1), (0, 0, 0, 0))
                 # Draw white lines up the section.
                 draw = ImageDraw.Draw(img)
-                draw.line(
-                    [nointercept_x, 1 + accumulated_height, nointercept_x, 1 + accumulated_height + pixel_lengths[i]],
-                    fill='white', width=1)
-                self._layers[bay_obj.id][sensor_id][side][SENSOR_QUALITY_NOTINTERCEPTED] = img
+                draw.line([0, 0, 0, pixel_lengths[i]], fill='white', width=1)
+                self._layers[bay_obj.id][sensor_id][side][SENSOR_QUALITY_NOTINTERCEPTED] = \
+                    CBSprite.from_image(img, (nointercept_x, bar_top))
                 del (img)
 
                 for item in status_lookup:
                     self._logger.debug("Creating layer for side {}, status {} with border {}, fill {}."
                                        .format(side, item['status'], item['border'], item['fill']))
                     # Make the image.
-                    img = Image.new('RGBA', (self._matrix_width, self._matrix_height), (0, 0, 0, 0))
+                    img = Image.new('RGBA', bar_size, (0, 0, 0, 0))
                     draw = ImageDraw.Draw(img)
                     # Draw the rectangle
                     draw.rectangle(
-                        [line_w, 1 + accumulated_height, line_w + 2, 1 + accumulated_height + pixel_lengths[i]],
+                        [0, 0, 2, pixel_lengths[i]],
                         fill=item['fill'],
                         outline=item['border'],
                         width=1)
                     # Put this in the right place in the lookup.
-                    self._layers[bay_obj.id][sensor_id][side][item['status']] = img
+                    self._layers[bay_obj.id][sensor_id][side][item['status']] = \
+                        CBSprite.from_image(img, (line_w, bar_top))
                     # Write for debugging
                     # img.save("/tmp/cobrabay-{}-{}-{}.png".format(lateral,side,status[0]), format='PNG')
                     del (draw)
@@ -259,6 +306,13 @@ class CBDisplay:
         else:
             raise ValueError("Show mode '{}' is not valid. Must be 'clock' or 'message'.".format(mode))
 
+        # If nothing has changed since the last draw, there's nothing to do.
+        shown = (string, color, font_size, icons, tuple(value[1] for value in self._cbcore.net_data.values())
+                 if icons else None)
+        if shown == self._shown:
+            return
+        self._shown = shown
+
         placard_h = 0
 
         # Make a base layer.
@@ -305,108 +359,100 @@ class CBDisplay:
         else:
             placard_h = 0
 
-        # Placard with the text.
-        placard = self._placard(string, color, font_size=font_size, w_adjust=0, h_adjust=placard_h)
-        img = Image.alpha_composite(img, placard)
+        # Placard with the text, over the icons.
+        compositor = self._compositor
+        compositor.clear()
+        compositor.blit(CBSprite.from_image(img))
+        compositor.blit(self._placard(string, color, font_size=font_size, w_adjust=0, h_adjust=placard_h))
         # Send it to the display!
-        self.current = img
+        self.current = compositor.image
 
-    def show_motion(self, direction, bay_obj):
+    def show_motion(self, direction, bay_snapshot):
         #TODO: Maybe remove direction, not sure we need that anymore.
-        """Show motion placard based on bay object's sensor info.
+        """Show motion placard based on a bay snapshot's sensor info.
 
-        :param bay_obj: Bay object to display.
-        :type bay_obj: CBBay
+        :param bay_snapshot: Snapshot of the bay to display.
+        :type bay_snapshot: cobrabay.datatypes.BaySnapshot
         """
-        self._logger.debug("Show Motion received bay '{}'".format(bay_obj.name))
+        self._logger.debug("Show Motion received bay '{}'".format(bay_snapshot.name))
 
         # Don't do motion display if the bay isn't in a motion state.
-        if bay_obj.state not in ('docking', 'undocking'):
+        if bay_snapshot.state not in ('docking', 'undocking'):
             self._logger.error("Asked to show motion for bay that isn't performing a motion. Will not do!")
             return
 
-        self._logger.debug("Bay has sensor info: {}".format(bay_obj.sensor_info))
+        self._logger.debug("Bay has sensor info: {}".format(bay_snapshot.sensor_info))
+        # The display is about to change, so show() has to draw next time.
+        self._shown = None
 
-        # For easy reference.
-        w = self._matrix_width
-        h = self._matrix_height
-        # Make a base image, black background.
-        final_image = Image.new("RGBA", (self._matrix_width, self._matrix_height), (0, 0, 0, 255))
+        # Start a new frame, black background.
+        compositor = self._compositor
+        compositor.clear()
 
         ## Center area, the range number.
         self._logger.debug("Compositing range placard...")
 
         # Get the range value from the bay.
-        range_reading = bay_obj.sensor_info['reading'][bay_obj.selected_range]
-        range_quality = bay_obj.sensor_info['quality'][bay_obj.selected_range]
+        range_reading = bay_snapshot.sensor_info['reading'][bay_snapshot.selected_range]
+        range_quality = bay_snapshot.sensor_info['quality'][bay_snapshot.selected_range]
 
-        range_layer = self._placard_range(
+        compositor.blit(self._placard_range(
             range_reading,
             range_quality,
-            bay_obj.state
-        )
-        final_image = Image.alpha_composite(final_image, range_layer)
+            bay_snapshot.state,
+            bay_id=bay_snapshot.id,
+            range_mm=bay_snapshot.range_mm
+        ))
 
         # ## Bottom strobe box.
         self._logger.debug("Compositing strobe...")
         try:
             if self._bottom_box.lower() == 'strobe':
-                final_image = Image.alpha_composite(final_image,
-                                                    self._strobe(
-                                                        range_quality=range_quality,
-                                                        range_pct=bay_obj.range_pct))
+                compositor.blit(self._strobe(range_quality=range_quality, range_pct=bay_snapshot.range_pct))
             elif self._bottom_box.lower() == 'progress':
                 self._logger.debug("Compositing in progress for bottom box.")
-                final_image = Image.alpha_composite(final_image,
-                                                    self._progress_bar(range_pct=bay_obj.range_pct))
+                self._progress_bar(range_pct=bay_snapshot.range_pct)
         except AttributeError:
             self._logger.debug("Bottom box disabled.")
             pass
 
         self._logger.debug("Compositing laterals.")
-        for intercept in bay_obj.lateral_sorted:
-            self._logger.debug("Lateral: {}".format(intercept.sensor_id))
-            sensor_quality = bay_obj.sensor_info['quality'][intercept.sensor_id]
-            sensor_reading = bay_obj.sensor_info['reading'][intercept.sensor_id]
+        for sensor_id, side in bay_snapshot.laterals:
+            self._logger.debug("Lateral: {}".format(sensor_id))
+            sensor_quality = bay_snapshot.sensor_info['quality'][sensor_id]
+            sensor_reading = bay_snapshot.sensor_info['reading'][sensor_id]
+            sensor_layers = self._layers[bay_snapshot.id][sensor_id]
 
             if sensor_quality in (SENSOR_QUALITY_NOTINTERCEPTED, SENSOR_QUALITY_NOOBJ):
                 # No intercept shows on both sides.
-                combined_layers = Image.alpha_composite(
-                    self._layers[bay_obj.id][intercept.sensor_id]['L'][sensor_quality],
-                    self._layers[bay_obj.id][intercept.sensor_id]['R'][sensor_quality]
-                )
-                final_image = Image.alpha_composite(final_image, combined_layers)
+                compositor.blit(sensor_layers['L'][sensor_quality])
+                compositor.blit(sensor_layers['R'][sensor_quality])
             elif sensor_quality in (SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN, SENSOR_QUALITY_CRIT):
-                self._logger.debug("Bay's merged config is: {}".format(bay_obj.config_merged))
                 # Pick which side the vehicle is offset towards.
                 try:
                     if sensor_reading == 0:
                         skew = ('L', 'R')  # In the rare case the value is exactly zero, show both sides.
-                    elif bay_obj.config_merged[intercept.sensor_id]['side'] == 'R' and sensor_reading > 0:
+                    elif side == 'R' and sensor_reading > 0:
                         skew = ('R')
-                    elif bay_obj.config_merged[intercept.sensor_id]['side'] == 'R' and sensor_reading < 0:
+                    elif side == 'R' and sensor_reading < 0:
                         skew = ('L')
-                    elif bay_obj.config_merged[intercept.sensor_id]['side'] == 'L' and sensor_reading > 0:
+                    elif side == 'L' and sensor_reading > 0:
                         skew = ('L')
-                    elif bay_obj.config_merged[intercept.sensor_id]['side'] == 'L' and sensor_reading < 0:
+                    elif side == 'L' and sensor_reading < 0:
                         skew = ('R')
                 except TypeError:
                     self._logger.warning("Sensor reading had unexpected value '{}' and type '{}'".
                                          format(sensor_reading, type(sensor_reading)))
                 else:
                     self._logger.debug(
-                        "Compositing in lateral indicator layer for {} {} {}".format(bay_obj.config_merged[intercept.sensor_id]['name'], skew, sensor_quality))
+                        "Compositing in lateral indicator layer for {} {} {}".format(sensor_id, skew, sensor_quality))
                     for item in skew:
-                        selected_layer = self._layers[bay_obj.id][intercept.sensor_id][item][sensor_quality]
-                        final_image = Image.alpha_composite(final_image, selected_layer)
+                        compositor.blit(sensor_layers[item][sensor_quality])
             else:
-                combined_layers = Image.alpha_composite(
-                    self._layers[bay_obj.id][intercept.sensor_id]['L']['fault'],
-                    self._layers[bay_obj.id][intercept.sensor_id]['R']['fault']
-                )
-                final_image = Image.alpha_composite(final_image, combined_layers)
+                compositor.blit(sensor_layers['L']['fault'])
+                compositor.blit(sensor_layers['R']['fault'])
         self._logger.debug("Returning final image.")
-        self.current = final_image
+        self.current = compositor.image
 
     ## Public Properties
     @property
@@ -416,6 +462,11 @@ class CBDisplay:
 
         :return:
         """
+        if self._current_image is None and self._current_rgb is not None:
+            # Convert to Base64 and save.
+            image_buffer = BytesIO()
+            self._current_rgb.save(image_buffer, format='PNG')
+            self._current_image = b64encode(image_buffer.getvalue())
         return self._current_image
 
     @current.setter
@@ -428,13 +479,31 @@ class CBDisplay:
         :return:
         """
 
-        # Send to the matrix
-        self._matrix.SetImage(image.convert('RGB'))
-        # Convert to Base64 and save.
-        image_buffer = BytesIO()
-        # Put in the staging variable for pickup, base64 encoded.
-        image.save(image_buffer, format='PNG')
-        self._current_image = b64encode(image_buffer.getvalue())
+        # Send to the matrix. The conversion also copies the image, so it's safe to keep if the original is reused.
+        self._current_rgb = image.convert('RGB')
+        self._matrix.SetImage(self._current_rgb)
+        # Encoding for MQTT waits until it's picked up, which is less often than frames are drawn.
+        self._current_image = None
+
+    @property
+    def diagnostics(self):
+        """
+        Display performance information, for debugging.
+
+        :return: dict
+        """
+        return {
+            'placard_cache': {
+                'hits': self._cache_stats['placard_hits'],
+                'misses': self._cache_stats['placard_misses'],
+                'size': len(self._placard_cache),
+                'max_size': self._placard_cache_size
+            },
+            'font_cache': {
+                'size': len(self._font_cache)
+            },
+            'memory': self._memory()
+        }
 
     @property
     def unit_system(self):
@@ -456,6 +525,8 @@ class CBDisplay:
             raise ValueError("Unit system must be one of 'imperial' or 'metric'. Instead got '{}' ({})".
                              format(the_input, type(the_input)))
         self._unit_system = the_input.lower()
+        # Range placards rendered in the old units no longer apply.
+        self._range_tables = {}
 
     ## Private Methods
     def _create_matrix(self, width, height, gpio_slowdown):
@@ -482,43 +553,140 @@ class CBDisplay:
         return RGBMatrix(options=matrix_options)
 
     def _find_font_size_clock(self, width, height):
-        # Clock size can always be
-        font_size = None
-        for hour in range(0, 24):
-            hour = str(hour).zfill(2)
-            for minute in range(0, 60):
-                minute = str(minute).zfill(2)
-                time_string = hour + ":" + minute
-                # time_size = self._scale_font(str(time_string), width, height)
-                time_size = rgbmultitool.util.scale_font(str(time_string), self._font, width, height)
-                if font_size is None:
-                    font_size = time_size
-                else:
-                    if time_size < font_size:
-                        font_size = time_size
+        """
+        Largest font size the clock fits in at any time of day. Sized to the widest and tallest times, rather than
+        trying them all.
+
+        :param width: Width available, in pixels.
+        :type width: int
+        :param height: Height available, in pixels.
+        :type height: int
+        :return: int
+        """
+        key = ('clock', width, height)
+        font_size = self._font_size_cache_get(key)
+        if font_size is None:
+            # The clock is hours without padding and two digit minutes. Any hour can go with any minute, so put the
+            # widest of each together.
+            hours = [str(hour) for hour in range(1, 13)]
+            minutes = [str(minute).zfill(2) for minute in range(0, 60)]
+            font_size = self._scale_font_all(
+                [hour + ":" + minute for hour in self._widest(hours) for minute in self._widest(minutes)],
+                width, height)
+            self._font_size_cache_put(key, font_size)
         return font_size
 
-    def _find_font_size_range(self, depth, min_depth, w=None, h=None):
+    def _find_font_size_range(self, low, high, w=None, h=None):
+        """
+        Largest font size any range between two ranges fits in.
+
+        :param low: Lowest range.
+        :type low: Quantity
+        :param high: Highest range.
+        :type high: Quantity
+        :param w: Width available, in pixels. Defaults to the whole matrix.
+        :type w: int
+        :param h: Height available, in pixels. Defaults to the whole matrix.
+        :type h: int
+        :return: int
+        """
         # Default the width to the whole matrix
         if w is None:
             w = self._matrix_width
         # Default the height to the whole matrix
         if h is None:
             h = self._matrix_height
-        font_size = None
-        while depth >= min_depth:
-            depth_string = self._range_string(depth)
-            print("Trying depth string '{}'".format(depth_string))
-            # depth_size = self._scale_font(depth_string, w, h)
-            depth_size = rgbmultitool.util.scale_font(depth_string, self._font, w, h)
-            if font_size is None:
-                font_size = depth_size
-            else:
-                if depth_size < font_size:
-                    font_size = depth_size
-            depth = (depth.magnitude - 1) * depth.units
+        low_mm = floor(low.m_as('mm'))
+        high_mm = ceil(high.m_as('mm'))
+        key = ('range', w, h, self.unit_system, low_mm, high_mm)
+        font_size = self._font_size_cache_get(key)
+        if font_size is None:
+            # Only the strings that actually show up, not every mm.
+            strings = list(dict.fromkeys(self._range_string_mm(range_mm) for range_mm in range(low_mm, high_mm + 1)))
+            font_size = self._scale_font_all(strings, w, h)
+            self._font_size_cache_put(key, font_size)
         return font_size
 
+    def _font_digest(self):
+        """
+        Hash of the font file, so cached renders can tell if the font has changed.
+
+        :return: str
+        """
+        if self._font_digest_value is None:
+            with open(self._font, 'rb') as f:
+                self._font_digest_value = hashlib.sha256(f.read()).hexdigest()
+        return self._font_digest_value
+
+    def _font_size_cache_get(self, key):
+        """
+        Font size found by a previous run.
+
+        :param key: What the size was found for. Combined with the font file and matrix size.
+        :type key: tuple
+        :return: int, or None if it's not in the cache.
+        """
+        if self._cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self._cache_dir, FONT_SIZE_CACHE_FILE), 'r') as f:
+                font_size = json.load(f).get(self._font_size_cache_key(key))
+        except (OSError, ValueError):
+            return None
+        if font_size is not None:
+            self._logger.info("Using saved font size {} for {}.".format(font_size, key))
+        return font_size
+
+    def _font_size_cache_key(self, key):
+        return repr((self._font_digest(), self._matrix_width, self._matrix_height) + tuple(key))
+
+    def _font_size_cache_put(self, key, font_size):
+        """
+        Save a font size for the next run. Failures are logged, the size can always be found again.
+
+        :param key: What the size was found for.
+        :type key: tuple
+        :param font_size: Font size.
+        :type font_size: int
+        """
+        if self._cache_dir is None:
+            return
+        cache_file = os.path.join(self._cache_dir, FONT_SIZE_CACHE_FILE)
+        try:
+            with open(cache_file, 'r') as f:
+                font_sizes = json.load(f)
+        except (OSError, ValueError):
+            font_sizes = {}
+        font_sizes[self._font_size_cache_key(key)] = font_size
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            # Write to a temporary file and move it into place, so a partly written file is never loaded.
+            with open(cache_file + '.tmp', 'w') as f:
+                json.dump(font_sizes, f, indent=2)
+            os.replace(cache_file + '.tmp', cache_file)
+        except OSError as e:
+            self._logger.warning("Could not save font sizes to '{}'. ({})".format(cache_file, e))
+
+    def _font_sized(self, size, fonts=None):
+        """
+        The display font at a given size. Fonts are loaded once per size and reused.
+
+        :param size: Font size.
+        :type size: int
+        :param fonts: Cache of fonts to use. Defaults to the display's own, which should only be used from the main
+        thread.
+        :type fonts: dict
+        :return: ImageFont.FreeTypeFont
+        """
+        if fonts is None:
+            fonts = self._font_cache
+        try:
+            return fonts[size]
+        except KeyError:
+            font = ImageFont.truetype(font=self._font, size=size)
+            fonts[size] = font
+            return font
+
     @staticmethod
     def _frame_lateral(width, height):
         """
@@ -536,6 +704,22 @@ class CBDisplay:
         draw.rectangle([(width - 3, 0), (width - 1, height - 5)], width=1)
         return img
 
+    @staticmethod
+    def _frame_progress(width, height):
+        """
+        Draws the border box for the progress bar, around the whole display.
+
+        :param width: Width of the matrix
+        :type width: int
+        :param height: Height of the matrix
+        :type height: int
+        :return: Image
+        """
+        img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle((0, 0, width - 1, height - 1), fill=None, outline='white', width=1)
+        return img
+
     @staticmethod
     def _frame_strobe(width, height):
         """
@@ -639,6 +823,30 @@ class CBDisplay:
     #     image.save(image_buffer, format='PNG')
     #     self.current = b64encode(image_buffer.getvalue())
 
+    def _memory(self):
+        """
+        Memory used by pre-made sprites, in bytes. Static layers are shared by all bays, the rest is broken out by bay.
+
+        :return: dict
+        """
+        bays = {}
+        for bay_id in self._bay_ids:
+            try:
+                placards = self._range_tables[bay_id]['placards']
+            except KeyError:
+                placards = {}
+            bays[bay_id] = {
+                'layers': self._sprite_bytes(self._layers.get(bay_id, {})),
+                'range_table': self._sprite_bytes(placards)
+            }
+            bays[bay_id]['total'] = bays[bay_id]['layers'] + bays[bay_id]['range_table']
+        static = sum(layer.nbytes for layer in self._layers.values() if isinstance(layer, CBSprite))
+        return {
+            'static': static,
+            'bays': bays,
+            'total': static + sum(bay['total'] for bay in bays.values())
+        }
+
     # Divide into roughly equal parts. Found this here:
     # https://stackoverflow.com/questions/52697875/split-number-into-rounded-numbers
     @staticmethod
@@ -660,33 +868,53 @@ class CBDisplay:
         :type w_adjust: int
         :param h_adjust: Margin for the height. Shifts upward from the bottom of the display.
         :type h_adjust: int
-        :return: Image
+        :return: CBSprite. Placards are cached as sprites, so a repeat is ready to blit without converting it again.
         """
-        img = Image.new("RGBA", (self._matrix_width, self._matrix_height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        # If no font size was specified, dynamically size the text to fit the space we have.
-        if font_size is None:
-            font_size = self._scale_font(text, self._matrix_width - w_adjust, self._matrix_height - h_adjust)
-            # self._logger.debug("Calling RGBMT scale_font with font: {} ({})".format(self._font, type(self._font)))
-            # font_size = rgbmultitool.util.scale_font(text, self._font, self._matrix_width - w_adjust, self._matrix_height - h_adjust)
-        font = ImageFont.truetype(font=self._font, size=font_size)
-        # Make the text. Center it in the middle of the area, using the derived font size.
-        draw.text((self._matrix_width / 2, (self._matrix_height - 4) / 2), text,
-                  fill=ImageColor.getrgb(color), font=font, anchor="mm")
-        return img
+        # Reuse the placard if it's been drawn recently.
+        key = (text, color, font_size, w_adjust, h_adjust)
+        try:
+            sprite = self._placard_cache[key]
+        except KeyError:
+            self._cache_stats['placard_misses'] += 1
+        else:
+            self._cache_stats['placard_hits'] += 1
+            self._placard_cache.move_to_end(key)
+            return sprite
+
+        sprite = CBSprite.from_image(
+            self._render_placard(text, color, font_size=font_size, w_adjust=w_adjust, h_adjust=h_adjust))
 
-    def _placard_range(self, input_range, range_quality, bay_state):
+        # Save it, dropping the least recently used placard if the cache is full.
+        self._placard_cache[key] = sprite
+        if len(self._placard_cache) > self._placard_cache_size:
+            self._placard_cache.popitem(last=False)
+        return sprite
+
+    def _placard_range(self, input_range, range_quality, bay_state, bay_id=None, range_mm=None):
         """
 
         :param input_range: Range to display
         :param range_quality: Range quality, used to color-code the text.
         :param bay_state: Operating state of the bay. Used to determine which
-        :return:
+        :param bay_id: Bay the range is from. If the bay's range table is ready, the placard is taken from it.
+        :type bay_id: str
+        :param range_mm: Range to display, in mm, to look up in the range table.
+        :type range_mm: float
+        :return: CBSprite
         """
         self._logger.debug("Creating range placard with range {} and quality {}".format(input_range, range_quality))
         # Define a default range string. This should never show up.
         range_string = "NOVAL"
-        text_color = 'white'
+
+        # Determine a color based on quality
+        if range_quality in ('critical', 'back_up'):
+            text_color = 'red'
+        elif range_quality == 'warning':
+            text_color = 'yellow'
+        elif range_quality == 'door_open':
+            text_color = 'white'
+        else:
+            text_color = 'green'
 
         # Override string states. If the range quality has these values, we go ahead and show the string rather than the
         # measurement.
@@ -704,24 +932,17 @@ class CBDisplay:
         elif input_range == 'unknown':
             return self._layers['noval']
         else:
+            # Use the pre-rendered placard, if there is one.
+            sprite = self._range_table_get(bay_id, range_mm, text_color)
+            if sprite is not None:
+                return sprite
             try:
-                range_converted = input_range.to(self._target_unit)
+                range_string = self._range_string_mm(input_range.m_as('mm'))
             except AttributeError:
                 self._logger.warning("Placard input range was '{}' ({}), cannot convert. Using raw input".
                                      format(input_range, type(input_range)))
                 range_string = input_range
-            else:
-                range_string = self._range_string(range_converted)
 
-        # Determine a color based on quality
-        if range_quality in ('critical', 'back_up'):
-            text_color = 'red'
-        elif range_quality == 'warning':
-            text_color = 'yellow'
-        elif range_quality == 'door_open':
-            text_color = 'white'
-        else:
-            text_color = 'green'
         # Now we can get it formatted and return it.
         self._logger.debug("Requesting placard with range string {} in color {}".format(range_string, text_color))
         return self._placard(range_string, text_color)
@@ -744,44 +965,241 @@ class CBDisplay:
 
     def _progress_bar(self, range_pct):
         """
-        Draw a progress bar based on percentage of range covered.
+        Draw a progress bar based on percentage of range covered onto the current frame.
 
         :param range_pct:
-        :return: Image
+        :return:
         """
-        img = Image.new("RGBA", (self._matrix_width, self._matrix_height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-        draw.rectangle((0, 0, self._matrix_width - 1, self._matrix_height - 1), fill=None, outline='white', width=1)
+        self._compositor.blit(self._layers['frame_progress'])
         self._logger.debug("Total matrix width: {}".format(self._matrix_width))
         self._logger.debug("Range percentage: {}".format(range_pct))
         progress_pixels = int((self._matrix_width - 2) * range_pct)
         self._logger.debug("Progress bar pixels: {}".format(progress_pixels))
-        draw.line((1, self._matrix_height - 2, 1 + progress_pixels, self._matrix_height - 2), fill='green', width=1)
-        return img
+        self._compositor.fill(1, self._matrix_height - 2, 1 + progress_pixels, self._matrix_height - 2,
+                              ImageColor.getrgb('green'))
 
     def _range_string(self, input_range):
         """
         Format a given range into a string for display.
 
         :param input_range:
-        :param unit_system:
+        :type input_range: Quantity
+        :return: str
+        """
+        return self._range_string_mm(input_range.m_as('mm'))
+
+    def _range_string_mm(self, range_mm):
+        """
+        Format a range in mm into a string for display, in the display's unit system.
+
+        :param range_mm: Range, in mm.
+        :type range_mm: float
         :return: str
         """
         if self.unit_system == 'imperial':
-            if abs(input_range.magnitude) < 12:
-                range_string = "{}\"".format(round(input_range.magnitude, 1))
+            range_inches = range_mm / 25.4
+            if abs(range_inches) < 12:
+                range_string = "{}\"".format(round(range_inches, 1))
             else:
-                feet = int(input_range.to("in").magnitude // 12)
-                inches = round(input_range.to("in").magnitude % 12)
+                feet = int(range_inches // 12)
+                inches = round(range_inches % 12)
                 range_string = "{}'{}\"".format(feet, inches)
         else:
-            range_meters = input_range.to("m").magnitude
+            range_meters = range_mm / 1000
             if range_meters <= 0.5:
-                range_string = "{} cm".format(round(range_meters / 100, 2))
+                range_string = "{} cm".format(round(range_mm / 10))
             else:
                 range_string = "{} m".format(round(range_meters, 2))
         return range_string
 
+    def _range_table_build(self, bay_id, low_mm, high_mm):
+        """
+        Load or render the range table for a bay, and put it in place for show_motion to use. Until then, range placards
+        are rendered as needed.
+
+        :param bay_id: Bay the table is for.
+        :type bay_id: str
+        :param low_mm: Lowest range in the table, in mm.
+        :type low_mm: int
+        :param high_mm: Highest range in the table, in mm.
+        :type high_mm: int
+        :return:
+        """
+        start = monotonic_ns()
+        try:
+            cache_file = self._range_table_file(low_mm, high_mm)
+            table = self._range_table_load(cache_file)
+            if table is None:
+                table = self._range_table_render(low_mm, high_mm)
+                self._range_table_save(cache_file, table)
+            table['tinted'] = self._range_table_tint(table['placards'])
+        except Exception as e:
+            self._logger.error("Could not build range table for bay '{}'. Range placards will be rendered as needed.".
+                               format(bay_id))
+            self._logger.exception(e)
+            return
+        self._range_tables[bay_id] = table
+        self._logger.info("Range table for bay '{}' ready in {:.1f}s.".format(bay_id, (monotonic_ns() - start) / 1e9))
+
+    def _range_table_file(self, low_mm, high_mm):
+        """
+        File to save a range table in. Named for everything that goes into the table, so a change to any of them makes
+        a new table.
+
+        :return: str, or None if there's no cache directory.
+        """
+        if self._cache_dir is None:
+            return None
+        key = repr((RANGE_TABLE_VERSION, self._font_digest(), self._matrix_width, self._matrix_height,
+                    self.unit_system, low_mm, high_mm))
+        return os.path.join(self._cache_dir, "range-{}.npz".format(hashlib.sha256(key.encode()).hexdigest()[:16]))
+
+    def _range_table_get(self, bay_id, range_mm, color):
+        """
+        Pre-rendered placard for a range, if there is one.
+
+        :param bay_id: Bay to use the table of.
+        :type bay_id: str
+        :param range_mm: Range, in mm.
+        :type range_mm: float
+        :param color: Color of the text.
+        :type color: str
+        :return: CBSprite, or None.
+        """
+        try:
+            table = self._range_tables[bay_id]
+            i = round(range_mm) - table['low']
+            if i < 0:
+                return None
+            return table['tinted'][color][table['index'][i]]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    def _range_table_load(self, cache_file):
+        """
+        Load a range table saved by a previous run. Tables are saved as plain arrays and loaded without unpickling, so
+        nothing in the cache directory can run code.
+
+        :return: dict, or None if there's no usable saved table.
+        """
+        if cache_file is None or not os.path.exists(cache_file):
+            return None
+        try:
+            with np.load(cache_file, allow_pickle=False) as saved:
+                positions = saved['positions']
+                sizes = saved['sizes']
+                coverage = saved['coverage']
+                table = {'low': int(saved['low']), 'index': saved['index']}
+            # Each placard's coverage is a view on the one array, in the order they were saved.
+            ends = np.cumsum(sizes[:, 0] * sizes[:, 1])
+            if len(ends) > 0 and ends[-1] != len(coverage):
+                raise ValueError("Placard sizes don't match the saved coverage.")
+            table['placards'] = [CBSprite(int(x), int(y), None, transmit=coverage[end - w * h:end].reshape(h, w, 1))
+                                 for (x, y), (w, h), end in zip(positions, sizes, ends)]
+        except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            self._logger.warning("Could not load range table from '{}', will render it again. ({})".
+                                 format(cache_file, e))
+            return None
+        self._logger.info("Loaded range table from '{}'".format(cache_file))
+        return table
+
+    def _range_table_render(self, low_mm, high_mm):
+        """
+        Render the placard for every range string between two ranges. Placards are kept as coverage sprites, cropped
+        to the text since most of each is empty, and tinted for each of the range colors when the table is put in
+        place.
+
+        :param low_mm: Lowest range, in mm.
+        :type low_mm: int
+        :param high_mm: Highest range, in mm.
+        :type high_mm: int
+        :return: dict
+        """
+        # This may be run in its own thread. Fonts can't be shared between threads, so it gets its own.
+        fonts = {}
+        # Many ranges format to the same string. Map each mm to its string's position, and only render each string once.
+        strings = {}
+        index = np.empty(high_mm - low_mm + 1, dtype=np.int32)
+        for i, range_mm in enumerate(range(low_mm, high_mm + 1)):
+            index[i] = strings.setdefault(self._range_string_mm(range_mm), len(strings))
+        placards = [CBSprite.from_alpha(self._render_placard(string, 'white', fonts=fonts)) for string in strings]
+        self._logger.debug("Rendered {} range strings from {}mm to {}mm.".format(len(strings), low_mm, high_mm))
+        return {'low': low_mm, 'index': index, 'placards': placards}
+
+    def _range_table_save(self, cache_file, table):
+        """
+        Save a range table for the next run. Failures are logged, the table can always be rendered again.
+        """
+        if cache_file is None:
+            return
+        placards = table['placards']
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            # Write to a temporary file and move it into place, so a partly written file is never loaded.
+            with open(cache_file + '.tmp', 'wb') as f:
+                np.savez(f,
+                         low=np.int64(table['low']),
+                         index=table['index'],
+                         positions=np.array([(placard.x, placard.y) for placard in placards], dtype=np.int32),
+                         sizes=np.array([placard.size for placard in placards], dtype=np.int32),
+                         coverage=np.concatenate([placard.transmit.ravel() for placard in placards]))
+            os.replace(cache_file + '.tmp', cache_file)
+        except OSError as e:
+            self._logger.warning("Could not save range table to '{}'. ({})".format(cache_file, e))
+
+    def _range_table_start(self, bay_obj):
+        """
+        Start building the range table for a bay, covering every reading its longitudinal sensors can give.
+
+        :param bay_obj: The bay object being registered.
+        :type bay_obj: CBBay
+        :return:
+        """
+        span = bay_obj.range_span
+        if span is None:
+            return
+        low_mm = floor(span[0].m_as('mm'))
+        high_mm = ceil(span[1].m_as('mm'))
+        if self._range_table_mode == 'background':
+            self._logger.info("Building range table for bay '{}' in the background.".format(bay_obj.id))
+            threading.Thread(target=self._range_table_build, args=(bay_obj.id, low_mm, high_mm),
+                             name="cbdisplay-range-{}".format(bay_obj.id), daemon=True).start()
+        else:
+            self._logger.info("Building range table for bay '{}'.".format(bay_obj.id))
+            self._range_table_build(bay_obj.id, low_mm, high_mm)
+
+    @staticmethod
+    def _range_table_tint(placards):
+        """
+        Tint a table's placards in each of the range colors. The tinted sprites share the placards' coverage.
+
+        :param placards: Coverage sprites for each range string.
+        :type placards: list
+        :return: dict of lists of CBSprite, by color.
+        """
+        return {color: [placard.tinted(ImageColor.getrgb(color)) for placard in placards]
+                for color in RANGE_TABLE_COLORS}
+
+    def _render_placard(self, text, color, font_size=None, w_adjust=8, h_adjust=4, fonts=None):
+        """
+        Render text on a full size image. Takes the same options as _placard, which caches the result.
+
+        :param fonts: Cache of fonts to use. See _font_sized.
+        :type fonts: dict
+        :return: Image
+        """
+        img = Image.new("RGBA", (self._matrix_width, self._matrix_height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        # If no font size was specified, dynamically size the text to fit the space we have.
+        if font_size is None:
+            font_size = self._scale_font(text, self._matrix_width - w_adjust, self._matrix_height - h_adjust,
+                                         fonts=fonts)
+        font = self._font_sized(font_size, fonts=fonts)
+        # Make the text. Center it in the middle of the area, using the derived font size.
+        draw.text((self._matrix_width / 2, (self._matrix_height - 4) / 2), text,
+                  fill=ImageColor.getrgb(color), font=font, anchor="mm")
+        return img
+
     @staticmethod
     def _rectangle_striped(input_image, start, end, pricolor='red', seccolor='yellow'):
         """
@@ -836,36 +1254,96 @@ class CBDisplay:
             current_x += 1
         return input_image
 
-    def _scale_font(self, text, w, h):
-        # Start at font size 1.
-        fontsize = 1
-        while True:
-            font = ImageFont.truetype(font=self._font, size=fontsize)
-            bbox = font.getbbox(text)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            if text_width < w and text_height < h:
-                fontsize += 1
+    def _scale_font(self, text, w, h, fonts=None):
+        """
+        Font size for text to fill a space. This is the first size, counting up from 1, that the text no longer fits
+        within, found by bisection.
+
+        :param text: Text to size.
+        :type text: str
+        :param w: Width of the space, in pixels.
+        :type w: int
+        :param h: Height of the space, in pixels.
+        :type h: int
+        :param fonts: Cache of fonts to use. See _font_sized.
+        :type fonts: dict
+        :return: int
+        """
+        def fits(fontsize):
+            bbox = self._font_sized(fontsize, fonts=fonts).getbbox(text)
+            return bbox[2] - bbox[0] < w and bbox[3] - bbox[1] < h
+
+        if not fits(1):
+            return 1
+        # Double until the text doesn't fit, then narrow down between the last size that did and the first that didn't.
+        low, high = 1, 2
+        while fits(high):
+            low, high = high, high * 2
+        while high - low > 1:
+            mid = (low + high) // 2
+            if fits(mid):
+                low = mid
             else:
-                break
-        return fontsize
+                high = mid
+        return high
+
+    def _scale_font_all(self, strings, w, h):
+        """
+        Font size that fits all of a set of strings. Only the widest and tallest strings are sized.
+
+        :param strings: Strings that need to fit.
+        :type strings: list
+        :param w: Width of the space, in pixels.
+        :type w: int
+        :param h: Height of the space, in pixels.
+        :type h: int
+        :return: int
+        """
+        font = self._font_sized(FONT_SIZE_REFERENCE)
+        widest = max(strings, key=font.getlength)
+        tallest = max(strings, key=lambda string: font.getbbox(string)[3] - font.getbbox(string)[1])
+        return min(self._scale_font(widest, w, h), self._scale_font(tallest, w, h))
 
     def _setup_layers(self):
         """
-        Create static layers that can be composited as needed.
+        Create static layers that can be composited as needed. Layers are kept as sprites for the compositor.
 
         :return:
         """
         # Initialize the layers.
-        self._layers['frame_approach'] = self._frame_strobe(self._matrix_width, self._matrix_height)
-        self._layers['frame_lateral'] = self._frame_lateral(self._matrix_width, self._matrix_height)
-        self._layers['approach'] = self._placard('APPROACH', 'blue')
-        self._layers['clear'] = self._placard('CLEAR!', 'white')
-        self._layers['backup'] = self._placard('BACK UP!', 'red')
-        self._layers['noval'] = self._placard('NOVAL', 'red')
-        self._layers['error'] = self._placard('ERROR', 'red')
-        self._layers['offline'] = self._placard('OFFLINE', 'white')
-        self._layers['pm_indicator'] = self._pm_indicator(self._matrix_width, self._matrix_height)
+        layers = {
+            'frame_approach': self._frame_strobe(self._matrix_width, self._matrix_height),
+            'frame_lateral': self._frame_lateral(self._matrix_width, self._matrix_height),
+            'frame_progress': self._frame_progress(self._matrix_width, self._matrix_height),
+            'pm_indicator': self._pm_indicator(self._matrix_width, self._matrix_height)
+        }
+        for name, img in layers.items():
+            self._layers[name] = CBSprite.from_image(img)
+        # Placards already come as sprites.
+        placards = {
+            'approach': ('APPROACH', 'blue'),
+            'clear': ('CLEAR!', 'white'),
+            'backup': ('BACK UP!', 'red'),
+            'noval': ('NOVAL', 'red'),
+            'error': ('ERROR', 'red'),
+            'offline': ('OFFLINE', 'white')
+        }
+        for name, (text, color) in placards.items():
+            self._layers[name] = self._placard(text, color)
+
+    @staticmethod
+    def _sprite_bytes(layers):
+        """
+        Total memory used by sprites, nested in dicts and lists as the layers are.
+
+        :param layers: A sprite, or a dict or list of them.
+        :return: int
+        """
+        if isinstance(layers, CBSprite):
+            return layers.nbytes
+        if isinstance(layers, dict):
+            layers = layers.values()
+        return sum(CBDisplay._sprite_bytes(layer) for layer in layers)
 
     def _status_color(self, status):
         """
@@ -886,6 +1364,19 @@ class CBDisplay:
             # Since red is used for 'critical', blue is the 'error' color.
             return {'border': (0, 255, 255, 0), 'fill': (0, 255, 255, 0)}
 
+    def _widest(self, strings):
+        """
+        Strings from a set that are the widest in the display font. Ties are all returned.
+
+        :param strings: Strings to compare.
+        :type strings: list
+        :return: list
+        """
+        font = self._font_sized(FONT_SIZE_REFERENCE)
+        widths = {string: font.getlength(string) for string in strings}
+        widest = max(widths.values())
+        return [string for string in strings if widths[string] == widest]
+
     ## Private Properties
     @property
     def _target_unit(self):
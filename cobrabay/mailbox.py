@@ -0,0 +1,131 @@
+"""
+Cobra Bay - Mailbox
+
+Latest-value handoff between a producer and a consumer, so the consumer can sleep until there's something new.
+"""
+
+import threading
+
+
+class CBMailbox:
+    """
+    Holds the latest item put to it and a sequence number that increases with each put. New items overwrite old ones,
+    so a slow consumer only ever sees the newest. Consumers can block until the sequence passes one they've seen.
+
+    By default, the mailbox works between threads. Given a multiprocessing context, the sequence and its condition are
+    shared, and the mailbox can be passed to a new process when it's started. Items aren't shared between processes,
+    so across processes the mailbox only signals that there's new data, which is read from somewhere both sides can
+    see, such as a sensor board.
+    """
+
+    def __init__(self, context=None):
+        """
+        :param context: Multiprocessing context to share the mailbox across processes with. None for threads only.
+        :type context: multiprocessing.context.BaseContext
+        """
+        self._item = None
+        if context is None:
+            self._shared = None
+            self._shared_notified = None
+            self._sequence = 0
+            self._notified = False
+            self._condition = threading.Condition()
+        else:
+            # The condition's lock guards the sequence and the notify flag, so the values don't need their own.
+            self._shared = context.Value('Q', 0, lock=False)
+            self._shared_notified = context.Value('b', 0, lock=False)
+            self._condition = context.Condition()
+
+    def __getstate__(self):
+        # Only the shared parts go to another process. The item stays behind.
+        if self._shared is None:
+            raise TypeError("Only a mailbox with a multiprocessing context can be passed to another process.")
+        return {'shared': self._shared, 'shared_notified': self._shared_notified, 'condition': self._condition}
+
+    def __setstate__(self, state):
+        self._item = None
+        self._shared = state['shared']
+        self._shared_notified = state['shared_notified']
+        self._condition = state['condition']
+
+    # Public Methods
+    def get(self):
+        """
+        Latest item and its sequence number. Doesn't block.
+
+        :return: tuple of (int, object). Sequence is 0 and the item None if nothing has been put. The item is always
+        None across processes.
+        """
+        with self._condition:
+            return self._get_sequence(), self._item
+
+    def notify(self):
+        """
+        Wake anything waiting on the mailbox, without putting a new item. If nothing is waiting yet, the next wait
+        returns at once, so a notify just before a wait isn't lost.
+        """
+        with self._condition:
+            self._set_notified(True)
+            self._condition.notify_all()
+
+    def put(self, item=None):
+        """
+        Replace the item in the mailbox and wake anything waiting on it.
+
+        :param item: Item to put. Not passed between processes.
+        :return: int, sequence number of the new item.
+        """
+        with self._condition:
+            self._item = item
+            sequence = self._get_sequence() + 1
+            self._set_sequence(sequence)
+            self._condition.notify_all()
+        return sequence
+
+    def wait(self, after=0, timeout=None):
+        """
+        Wait for an item newer than a given sequence number. Also returns early if notify() is called, or has been
+        called since the last wait.
+
+        :param after: Sequence number already seen.
+        :type after: int
+        :param timeout: Longest time to wait, in seconds. None waits until woken.
+        :type timeout: float
+        :return: bool, True if there's a newer item.
+        """
+        with self._condition:
+            if self._get_sequence() > after:
+                return True
+            if not self._get_notified():
+                self._condition.wait(timeout)
+            self._set_notified(False)
+            return self._get_sequence() > after
+
+    # Public Properties
+    @property
+    def sequence(self):
+        """ Sequence number of the latest item. 0 if nothing has been put. """
+        return self._get_sequence()
+
+    # Private Methods
+    def _get_notified(self):
+        if self._shared_notified is None:
+            return self._notified
+        return bool(self._shared_notified.value)
+
+    def _get_sequence(self):
+        if self._shared is None:
+            return self._sequence
+        return self._shared.value
+
+    def _set_notified(self, notified):
+        if self._shared_notified is None:
+            self._notified = notified
+        else:
+            self._shared_notified.value = notified
+
+    def _set_sequence(self, sequence):
+        if self._shared is None:
+            self._sequence = sequence
+        else:
+            self._shared.value = sequence
@@ -5,6 +5,7 @@
 ####
 
 import logging
+from functools import partial
 from json import dumps as json_dumps
 from json import loads as json_loads
 import time
@@ -220,7 +221,7 @@ class CBNetwork:
         self._logger.debug("Deregistering Trigger ID '{}'".format(trigger_id))
         try:
             # Remove the callback
-            self._mqtt_client.message_callback_remove(self._trigger_registry[trigger_id].callback)
+            self._mqtt_client.message_callback_remove(self._trigger_registry[trigger_id].topic)
             # Unsubscribe from the MQTT topic.
             self._mqtt_client.unsubscribe(self._trigger_registry[trigger_id].topic)
             # Remove the trigger from the registry.
@@ -237,7 +238,12 @@ class CBNetwork:
         self._logger.debug("Subscribing to '{}'".format(trigger_obj.topic))
         self._mqtt_client.subscribe(trigger_obj.topic)
         self._logger.debug("Connecting callback...'{}'".format(trigger_obj.callback))
-        self._mqtt_client.message_callback_add(trigger_obj.topic, trigger_obj.callback)
+        self._mqtt_client.message_callback_add(trigger_obj.topic, partial(self._on_trigger_message, trigger_obj))
+
+    def _on_trigger_message(self, trigger_obj, client, userdata, message):
+        """ Pass a message to its trigger, then wake the core so the trigger is acted on right away. """
+        trigger_obj.callback(client, userdata, message)
+        self._cbcore.wake()
 
     # Store a provided pistatus object. We can only need one, so this is easy.
     def register_pistatus(self, pistatus_obj):
@@ -628,14 +634,16 @@ class CBNetwork:
         ]
         return outbound_messages
 
-    def _mqtt_messages_bay(self, input_obj):
+    def _mqtt_messages_bay(self, bay_obj):
         """
+        Create messages for a bay, from its current snapshot.
 
-        :param input_obj:
-        :type input_obj: cobrabay.CBBay
+        :param bay_obj:
+        :type bay_obj: cobrabay.CBBay
         :return:
         """
         outbound_messages = []
+        input_obj = bay_obj.snapshot
         # Topic base for convenience.
         topic_base = f"{self._mqtt_base}/{self._client_id}/{input_obj.id}/"
         # Bay state
@@ -654,7 +662,8 @@ class CBNetwork:
         outbound_messages.append(
             {'topic': topic_base + 'vector',
              'payload':
-                 {'speed': input_obj.vector.speed, 'direction': input_obj.vector.direction},
+                 {'speed': input_obj.vector.speed, 'direction': input_obj.vector.direction,
+                  'confidence': input_obj.vector.confidence},
              'repeat': False})
         # Bay motion timer
         outbound_messages.append(
@@ -695,6 +704,13 @@ class CBNetwork:
                         {'topic': topic_base + 'sensors/' + sensor_id + '/reading',
                          'payload': GEN_UNKNOWN, 'repeat': self._chattiness['sensors_always_send']})
 
+            # Tracking error, for longitudinal sensors being tracked.
+            for sensor_id in input_obj.sensor_info['tracking']:
+                outbound_messages.append(
+                    {'topic': topic_base + 'sensors/' + sensor_id + '/tracking',
+                     'payload': input_obj.sensor_info['tracking'][sensor_id],
+                     'repeat': self._chattiness['sensors_always_send']})
+
             # Lateral-Only values.
             for sensor_id in input_obj.configured_sensors['lat']:
                 self._logger.debug("Sending lateral-specific for '{}'".format(sensor_id))
@@ -711,7 +727,7 @@ class CBNetwork:
 
         # If performing a VERIFY on the bay, we now have all the messages, set bay back to ready.
         if input_obj.state == BAYSTATE_VERIFY:
-            input_obj.state = BAYSTATE_READY
+            bay_obj.state = BAYSTATE_READY
         return outbound_messages
 
     # def publish_bay_detectors(self, bay_id, publish=False):
@@ -0,0 +1,196 @@
+"""
+Cobra Bay - Sensor Board
+
+Latest sensor readings in a fixed-layout shared memory segment, so a sensor manager in another process can publish
+scans without pickling them through a queue.
+"""
+
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+from numpy import datetime64
+from pint import Quantity
+
+from cobrabay.const import SENSTATE_CODES, SENSOR_RESP_CODES, SENSOR_RESP_INR
+from cobrabay.datatypes import SensorReading, SensorResponse
+
+# Longest fault reason kept on the board, in bytes. Reasons cross as text, so exceptions arrive as their message.
+BOARD_FAULT_REASON_LENGTH = 120
+
+# Layout of the board. The header is followed by one row per sensor, in sensor ID order.
+BOARD_HEADER = np.dtype([
+    ('sequence', np.uint64),  # Seqlock counter. Odd while a scan is being written.
+    ('timestamp', np.int64),  # Time of the scan, in ns since the epoch.
+    ('scan_time', np.int64),  # Time the scan took, in ns.
+    ('generation', np.uint64)  # Generation of the scan from the sensor manager.
+])
+BOARD_ROW = np.dtype([
+    ('range_mm', np.float64),  # NaN when there's no range.
+    ('temp_c', np.float64),  # NaN when there's no temperature.
+    ('confidence', np.float64),  # NaN when not reported.
+    ('samples', np.int32),  # -1 when not reported.
+    ('state', np.int8),  # Position in SENSTATE_CODES, -1 if unknown.
+    ('status', np.int8),  # Position in SENSTATE_CODES, -1 if unknown.
+    ('response', np.int8),  # Position in SENSOR_RESP_CODES, -1 if unknown.
+    ('fault', np.bool_),
+    ('fault_reason', 'S{}'.format(BOARD_FAULT_REASON_LENGTH)),  # UTF-8, truncated. Empty when there's no reason.
+    ('timestamp', np.int64)  # Time of the last fresh (not Interrupt Not Ready) reading, in ns since the epoch.
+])
+
+
+class CBSensorBoard:
+    """
+    Shared memory board of the latest reading from each sensor. One process writes, any number read. Readers never
+    block the writer. A sequence counter lets readers detect and retry a read that overlapped a write.
+    """
+
+    def __init__(self, sensor_ids, name=None, create=True):
+        """
+        :param sensor_ids: IDs of the sensors on the board. Must be the same, in the same order, for all users.
+        :type sensor_ids: list
+        :param name: Name of the shared memory segment. Required when attaching to an existing board.
+        :type name: str
+        :param create: Create a new segment, or attach to an existing one.
+        :type create: bool
+        """
+        self._sensor_ids = list(sensor_ids)
+        self._index = {sensor_id: i for i, sensor_id in enumerate(self._sensor_ids)}
+        self._owner = create
+        size = BOARD_HEADER.itemsize + BOARD_ROW.itemsize * max(len(self._sensor_ids), 1)
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self._header = np.ndarray((), dtype=BOARD_HEADER, buffer=self._shm.buf)
+        self._rows = np.ndarray((len(self._sensor_ids),), dtype=BOARD_ROW, buffer=self._shm.buf,
+                                offset=BOARD_HEADER.itemsize)
+        if create:
+            self._header['sequence'] = 0
+            self._rows['timestamp'] = 0
+
+    def __getstate__(self):
+        # Pickle as a reference to the segment, so a spawned process attaches to the same memory.
+        return {'sensor_ids': self._sensor_ids, 'name': self._shm.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['sensor_ids'], name=state['name'], create=False)
+
+    # Public Methods
+    def close(self):
+        """
+        Detach from the shared memory. The creator also frees it.
+        """
+        # Drop the views before closing, or the buffer can't be released.
+        self._header = None
+        self._rows = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def read(self):
+        """
+        Read the latest scan from the board.
+
+        :return: SensorResponse, or None if nothing has been written yet.
+        """
+        while True:
+            start = int(self._header['sequence'])
+            if start % 2 == 1:
+                # Write in progress.
+                time.sleep(0)
+                continue
+            header = self._header.copy()
+            rows = self._rows.copy()
+            if int(self._header['sequence']) == start:
+                break
+        if start == 0:
+            return None
+        sensors = {}
+        for sensor_id, row in zip(self._sensor_ids, rows):
+            sensors[sensor_id] = SensorReading(
+                state=self._decode(SENSTATE_CODES, row['state']),
+                status=self._decode(SENSTATE_CODES, row['status']),
+                fault=bool(row['fault']),
+                response_type=self._decode(SENSOR_RESP_CODES, row['response']),
+                range=None if np.isnan(row['range_mm']) else Quantity(float(row['range_mm']) / 10, 'cm'),
+                temp=None if np.isnan(row['temp_c']) else Quantity(float(row['temp_c']), 'degC'),
+                fault_reason=self._decode_reason(row['fault_reason']),
+                confidence=None if np.isnan(row['confidence']) else float(row['confidence']),
+                samples=None if row['samples'] < 0 else int(row['samples'])
+            )
+        return SensorResponse(timestamp=datetime64(int(header['timestamp']), 'ns'), sensors=sensors,
+                              scan_time=int(header['scan_time']), generation=int(header['generation']))
+
+    def write(self, sensor_response):
+        """
+        Write a scan to the board. Only one process may write.
+
+        :param sensor_response: Scan to write.
+        :type sensor_response: SensorResponse
+        """
+        sequence = int(self._header['sequence'])
+        # Odd sequence marks the write as in progress.
+        self._header['sequence'] = sequence + 1
+        timestamp = sensor_response.timestamp.astype('datetime64[ns]').astype(np.int64)
+        self._header['timestamp'] = timestamp
+        self._header['scan_time'] = sensor_response.scan_time
+        self._header['generation'] = sensor_response.generation
+        for sensor_id, reading in sensor_response.sensors.items():
+            try:
+                row = self._rows[self._index[sensor_id]]
+            except KeyError:
+                continue
+            row['range_mm'] = reading.range.m_as('mm') if isinstance(reading.range, Quantity) else np.nan
+            row['temp_c'] = reading.temp.m_as('degC') if isinstance(reading.temp, Quantity) else np.nan
+            row['confidence'] = np.nan if reading.confidence is None else reading.confidence
+            row['samples'] = -1 if reading.samples is None else reading.samples
+            row['state'] = self._encode(SENSTATE_CODES, reading.state)
+            row['status'] = self._encode(SENSTATE_CODES, reading.status)
+            row['response'] = self._encode(SENSOR_RESP_CODES, reading.response_type)
+            row['fault'] = bool(reading.fault)
+            row['fault_reason'] = self._encode_reason(reading.fault_reason)
+            if reading.response_type != SENSOR_RESP_INR:
+                row['timestamp'] = timestamp
+        # Back to even, the write is complete.
+        self._header['sequence'] = sequence + 2
+
+    # Public Properties
+    @property
+    def name(self):
+        """ Name of the shared memory segment. """
+        return self._shm.name
+
+    @property
+    def sensor_ids(self):
+        """ Sensors on the board, in board order. """
+        return self._sensor_ids
+
+    @property
+    def sequence(self):
+        """ Sequence number of the latest scan. Increases by two for each scan, 0 if nothing has been written. """
+        return int(self._header['sequence'])
+
+    # Private Methods
+    @staticmethod
+    def _decode(codes, code):
+        if 0 <= code < len(codes):
+            return codes[code]
+        return None
+
+    @staticmethod
+    def _decode_reason(reason):
+        if len(reason) == 0:
+            return None
+        # Truncation may have split a character, so drop any partial one at the end.
+        return reason.decode('utf-8', errors='ignore')
+
+    @staticmethod
+    def _encode(codes, value):
+        try:
+            return codes.index(value)
+        except ValueError:
+            return -1
+
+    @staticmethod
+    def _encode_reason(reason):
+        if reason is None:
+            return b''
+        return str(reason).encode('utf-8')[:BOARD_FAULT_REASON_LENGTH]
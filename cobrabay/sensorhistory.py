@@ -0,0 +1,182 @@
+"""
+Cobra Bay - Sensor History
+
+Recent sensor readings, kept in preallocated numpy arrays.
+"""
+
+import numpy as np
+from numpy import datetime64
+from pint import Quantity
+
+from cobrabay.const import SENSOR_RESP_CODES, SENSOR_RESP_OK
+
+
+class CBSensorHistory:
+    """
+    Ring buffer of recent scans from the sensor manager. Each sensor has its own row of timestamps, ranges and response
+    codes. Appending is constant time, and queries over a sensor's history are done on whole arrays.
+    """
+
+    def __init__(self, sensor_ids, size=100):
+        """
+        :param sensor_ids: IDs of the sensors to keep history for. Readings for other sensors are ignored.
+        :type sensor_ids: list
+        :param size: Number of scans to keep.
+        :type size: int
+        """
+        if size < 1:
+            raise ValueError("History size must be at least 1.")
+        self._sensor_ids = list(sensor_ids)
+        self._index = {sensor_id: i for i, sensor_id in enumerate(self._sensor_ids)}
+        self._size = size
+        self._head = 0  # Position the next scan will be written to.
+        self._count = 0  # Number of scans stored.
+        self._generation = 0  # Increases whenever the contents change.
+        self._latest = None  # Most recent SensorResponse, as received.
+        # Columns, one row per sensor.
+        self._timestamp = np.zeros((len(self._sensor_ids), size), dtype=np.int64)  # ns since the epoch.
+        self._range_mm = np.full((len(self._sensor_ids), size), np.nan, dtype=np.float64)
+        self._response = np.full((len(self._sensor_ids), size), -1, dtype=np.int8)  # Position in SENSOR_RESP_CODES.
+
+    def __len__(self):
+        return self._count
+
+    # Public Methods
+    def append(self, sensor_response):
+        """
+        Add a scan to the history, replacing the oldest if full.
+
+        :param sensor_response: Scan from the sensor manager.
+        :type sensor_response: SensorResponse
+        """
+        timestamp = sensor_response.timestamp.astype('datetime64[ns]').astype(np.int64)
+        head = self._head
+        # Sensors missing from the scan are recorded as unknown.
+        self._timestamp[:, head] = timestamp
+        self._range_mm[:, head] = np.nan
+        self._response[:, head] = -1
+        for sensor_id, reading in sensor_response.sensors.items():
+            try:
+                row = self._index[sensor_id]
+            except KeyError:
+                continue
+            if isinstance(reading.range, Quantity):
+                self._range_mm[row, head] = reading.range.m_as('mm')
+            try:
+                self._response[row, head] = SENSOR_RESP_CODES.index(reading.response_type)
+            except ValueError:
+                pass
+        self._head = (head + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+        self._latest = sensor_response
+        self._generation += 1
+
+    def clear(self):
+        """
+        Remove all scans from the history.
+        """
+        self._head = 0
+        self._count = 0
+        self._latest = None
+        self._generation += 1
+
+    def last(self, sensor_id, response_type=SENSOR_RESP_OK):
+        """
+        Most recent reading of a sensor with a given response type.
+
+        :param sensor_id: Sensor to get.
+        :param response_type: Response type to look for.
+        :type response_type: str
+        :return: tuple of timestamp in ns and range as a Quantity, or None if there isn't one.
+        """
+        timestamps, ranges = self.window(sensor_id, count=1, response_type=response_type)
+        if len(timestamps) == 0:
+            return None
+        return int(timestamps[0]), Quantity(float(ranges[0]) / 10, 'cm')
+
+    def trend(self, sensor_id, count=None, since=None):
+        """
+        Least squares fit of a sensor's good readings against time.
+
+        :param sensor_id: Sensor to fit.
+        :param count: Fit at most this many of the most recent readings.
+        :type count: int
+        :param since: Only fit readings at or after this time, in ns since the epoch, or as a datetime64.
+        :type since: int or datetime64
+        :return: tuple of rate in mm/s, standard error of the rate in mm/s (None with only two readings), coefficient of
+        determination, number of readings and timestamp of the newest reading in ns. None if there are fewer than two
+        readings or they're all at the same time.
+        """
+        timestamps, ranges = self.window(sensor_id, count=count, since=since)
+        samples = len(timestamps)
+        if samples < 2:
+            return None
+        # Seconds relative to the newest reading, to keep the fit well conditioned.
+        t = (timestamps - timestamps[0]) / 1e9
+        t_dev = t - t.mean()
+        r_dev = ranges - ranges.mean()
+        sxx = np.dot(t_dev, t_dev)
+        if sxx == 0:
+            return None
+        rate = np.dot(t_dev, r_dev) / sxx
+        ss_res = np.dot(r_dev - rate * t_dev, r_dev - rate * t_dev)
+        ss_tot = np.dot(r_dev, r_dev)
+        r_squared = 1.0 if ss_tot == 0 else max(0.0, 1 - ss_res / ss_tot)
+        stderr = None if samples < 3 else float(np.sqrt(ss_res / (samples - 2) / sxx))
+        return float(rate), stderr, float(r_squared), samples, int(timestamps[0])
+
+    def window(self, sensor_id, count=None, since=None, response_type=SENSOR_RESP_OK):
+        """
+        Readings of a sensor, newest first.
+
+        :param sensor_id: Sensor to get.
+        :param count: Return at most this many readings.
+        :type count: int
+        :param since: Only return readings at or after this time, in ns since the epoch, or as a datetime64.
+        :type since: int or datetime64
+        :param response_type: Only return readings with this response type. None returns all.
+        :type response_type: str or None
+        :return: tuple of arrays of timestamps in ns and ranges in mm.
+        """
+        row = self._index[sensor_id]
+        positions = (self._head - 1 - np.arange(self._count)) % self._size
+        timestamps = self._timestamp[row, positions]
+        ranges = self._range_mm[row, positions]
+        mask = np.ones(self._count, dtype=bool)
+        if response_type is not None:
+            mask &= self._response[row, positions] == SENSOR_RESP_CODES.index(response_type)
+        if since is not None:
+            if isinstance(since, datetime64):
+                since = since.astype('datetime64[ns]').astype(np.int64)
+            mask &= timestamps >= since
+        timestamps = timestamps[mask]
+        ranges = ranges[mask]
+        if count is not None:
+            timestamps = timestamps[:count]
+            ranges = ranges[:count]
+        return timestamps, ranges
+
+    # Public Properties
+    @property
+    def generation(self):
+        """ Counter which increases each time a scan is added or the history is cleared. """
+        return self._generation
+
+    @property
+    def latest(self):
+        """
+        Most recent scan, as received from the sensor manager.
+
+        :return: SensorResponse or None
+        """
+        return self._latest
+
+    @property
+    def sensor_ids(self):
+        """ Sensors history is kept for. """
+        return self._sensor_ids
+
+    @property
+    def size(self):
+        """ Number of scans the history can hold. """
+        return self._size
@@ -4,6 +4,8 @@ Cobra Bay - Sensor Manager
 from __future__ import annotations
 
 import pprint
+import signal
+import types
 
 from adafruit_aw9523 import AW9523
 import atexit
@@ -12,10 +14,13 @@ import busio
 import logging
 import time
 import digitalio
+import cobrabay.mailbox
+import cobrabay.sensorboard
 import cobrabay.sensors
 from cobrabay.const import *
-from cobrabay.datatypes import SensorResponse, SensorReading
+from cobrabay.datatypes import SensorResponse, SensorReading, SensorProfile
 from numpy import datetime64
+import concurrent.futures
 import threading
 import multiprocessing
 import queue
@@ -30,7 +35,10 @@ class CBSensorMgr:
     """
 
     def __init__(self, sensor_config, i2c_config=None, generous_recovery=True, name=None, parent_logger=None,
-                 log_level="WARNING", q_cbsmdata=None, q_cbsmstatus=None, q_cbsmcontrol=None):
+                 log_level="WARNING", q_cbsmdata=None, q_cbsmstatus=None, q_cbsmcontrol=None,
+                 scheduling='staggered', retry_delay=2, bus_workers=False, execution_mode='inline',
+                 sensor_board=None,
+                 mailbox=None):
         """
         Create a Sensor Manager instance.
 
@@ -52,29 +60,69 @@ class CBSensorMgr:
         :type q_cbsmstatus: queue.Queue or multiprocessing.Queue
         :param q_cbsmcontrol: Takes incoming commands from parent thread/process.
         :type q_cbsmcontrol:queue.Queue or multiprocessing.Queue
+        :param scheduling: How to schedule reads of I2C sensors. 'staggered' phase-offsets the ranging starts of the
+        sensors on each bus and only reads each sensor when its timing budget has elapsed. 'sequential' checks every
+        sensor on every scan.
+        :type scheduling: str
+        :param retry_delay: When staggered, time in ms to wait before checking a sensor again if it wasn't ready when
+        it was due.
+        :type retry_delay: int
+        :param bus_workers: Read each transport, ie: each I2C bus and each serial port, in its own worker thread, so a
+        scan only takes as long as the slowest transport.
+        :type bus_workers: bool
+        :param execution_mode: How the sensors are scanned. 'inline' scans once each time loop() is called. 'thread'
+        scans continuously in a background thread once loop_start() is called. For 'process', use CBSensorMgrProcess,
+        which runs an inline manager in its own process.
+        :type execution_mode: str
+        :param sensor_board: Shared memory board to publish each scan to, in addition to the data queue.
+        :type sensor_board: cobrabay.sensorboard.CBSensorBoard
+        :param mailbox: Mailbox to put each scan in, so a receiver can wait for new scans instead of polling the data
+        queue.
+        :type mailbox: cobrabay.mailbox.CBMailbox
 
         """
         # Initialize variables.
         self._sensors = {}  # Dictionary for sensor objects.
         self._latest_state = {}  # Rolling current state of the sensors.
         self._scan_speed_log = []  # List to store scan performance data.
+        self._scan_cpu_log = []  # CPU time used by each scan, to compare against the scan time.
+        self._scan_seq_log = []  # Time each scan would have taken reading every transport one after another.
         self._scan_avg_speed = 0
+        self._generation = 0  # Number of scans published. Lets receivers tell a new scan from one they've seen.
         self._wait_ready = 30
         self._wait_reset = 30
         self._i2c_bus = None
         self._i2c_available = True
         self._ioexpanders = {}
+        self._budgets = {}  # Timing budget of each scheduled sensor, in ns.
+        self._bus_groups = {}  # Scheduled sensor IDs on each I2C bus, keyed by id() of the bus object.
+        self._next_due = {}  # Monotonic time, in ns, when each ranging sensor should next have data.
+        self._start_at = {}  # Monotonic time, in ns, when deferred ranging starts should be applied.
+        self._transport_groups = {}  # Sensor IDs grouped by the transport they're read over.
+        self._executor = None  # Worker pool for reading transport groups in parallel.
 
-        # self._thread: threading.Thread | None = None
-        # self._thread_terminate = False
+        self._thread: threading.Thread | None = None
+        self._thread_terminate = False
+        self._thread_wake = threading.Event()  # Set to interrupt the thread's wait between scans.
+        self._thread_max_wait = 0.05  # Longest the thread waits between scans, so commands are picked up promptly.
+        self._thread_min_wait = 0.001  # Wait between scans when no sensor is scheduled.
 
         # Save input parameters.
         self._name = name
         self._sensor_config = sensor_config
         self._i2c_config = i2c_config
         self._gr = generous_recovery
+        if execution_mode not in ('inline', 'thread'):
+            raise ValueError("Execution mode must be 'inline' or 'thread', not '{}'".format(execution_mode))
+        self._execution_mode = execution_mode
+        if scheduling not in ('staggered', 'sequential'):
+            raise ValueError("Scheduling must be 'staggered' or 'sequential', not '{}'".format(scheduling))
+        self._scheduling = scheduling
+        self._retry_delay = retry_delay * 1000000
 
-        # Save the queues.
+        # Save the queues, the board and the mailbox.
+        self._sensor_board = sensor_board
+        self._mailbox = mailbox
         self._q_cbsmdata = q_cbsmdata
         self._q_cbsmstatus = q_cbsmstatus
         self._q_cbsmcontrol = q_cbsmcontrol
@@ -137,12 +185,22 @@ class CBSensorMgr:
 
         # Pass the sensor config to the setup method to see if it works!
         self._sensors = self._create_sensor_multiple(sensor_config)
+        # Work out which sensors share a bus, so their reads can be staggered.
+        if self._scheduling == 'staggered':
+            self._build_schedule()
+        # Group the sensors by transport, and if requested, start a worker for each.
+        self._transport_groups = self._group_by_transport()
+        if bus_workers and len(self._transport_groups) > 1:
+            self._logger.info("Starting {} transport workers.".format(len(self._transport_groups)))
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(self._transport_groups), thread_name_prefix="cbsensormgr-{}".format(self._name))
 
         # self._q_cbsmdata = queue.Queue(maxsize=1)
 
     # Cleanup
     def cleanup(self):
-        """ Shut off all sensors when exiting. """
+        """ Stop the scanning thread, if any, and shut off all sensors when exiting. """
+        self.loop_stop()
         # Disable all sensors when shutting down.
         self._logger.debug("Disabling all sensors before deletion.")
         for sensor_id in self._sensors:
@@ -151,8 +209,49 @@ class CBSensorMgr:
             if isinstance(self._sensors[sensor_id],cobrabay.sensors.BaseSensor):
                 self._logger.debug("Disabling '{}'".format(sensor_id))
                 self._sensors[sensor_id].status = SENSTATE_DISABLED
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
 
     # Public Methods
+    def apply_profile(self, profile):
+        """
+        Apply an operating profile to sensors. Timing budget and distance mode are changed on sensors that support
+        them, then the sensors are set to the profile's state.
+
+        :param profile: Profile to apply.
+        :type profile: SensorProfile
+        :return: None
+        """
+        self._logger.info("Applying profile '{}' to sensors {}".format(
+            profile.profile, 'all' if profile.sensors is None else profile.sensors))
+        for sensor_id in self._sensors:
+            if profile.sensors is not None and sensor_id not in profile.sensors:
+                continue
+            sensor_obj = self._sensors[sensor_id]
+            if not isinstance(sensor_obj, cobrabay.sensors.BaseSensor):
+                self._logger.warning("Cannot apply profile to sensor '{}' before it is initialized.".format(sensor_id))
+                continue
+            if isinstance(sensor_obj, cobrabay.sensors.CBVL53L1X) and \
+                    (profile.timing is not None or profile.distance_mode is not None):
+                # Stop staggered sensors through the scheduler, so ranging restarts at their slot on the bus.
+                if sensor_id in self._budgets and sensor_obj.status == SENSTATE_RANGING:
+                    self._set_scheduled_state(sensor_id, SENSTATE_ENABLED)
+                try:
+                    if profile.distance_mode is not None:
+                        sensor_obj.distance_mode = profile.distance_mode
+                    if profile.timing is not None:
+                        sensor_obj.timing_budget = profile.timing
+                except (ValueError, OSError) as e:
+                    self._logger.error("Could not apply profile '{}' to sensor '{}'".format(profile.profile, sensor_id))
+                    self._logger.exception(e)
+                if sensor_id in self._budgets:
+                    self._budgets[sensor_id] = round(sensor_obj.timing_budget.m_as('ns'))
+            self.set_sensor_state(target_state=profile.state, target_sensor=sensor_id)
+        self._logger.info("Effective sensor rates after profile '{}': {}".format(
+            profile.profile, {sensor_id: "{} Hz".format(rate if rate is None else round(rate, 1))
+                              for sensor_id, rate in self.sensor_rates.items()}))
+
     def get_sensor(self, sensor_id):
         """
         Return a given sensor object by ID. Should only be used in rare cases, usually let the manager do it's thing.
@@ -170,7 +269,7 @@ class CBSensorMgr:
         self._logger.debug("Beginning action loop.")
 
         # Check for commands in the command queue.
-        while not self._q_cbsmcontrol.empty():
+        while self._q_cbsmcontrol is not None and not self._q_cbsmcontrol.empty():
             self._logger.debug("Processing commands in queue...")
             # Get the command from the queue.
             try:
@@ -179,26 +278,43 @@ class CBSensorMgr:
                 self._logger.warning("Command disappeared before it could be fetched.")
                 continue
             try:
-                self._logger.debug("Setting state based on command '{}'".format(command))
-                self.set_sensor_state(target_state=command[0], target_sensor=command[1])
+                if isinstance(command, SensorProfile):
+                    self._logger.debug("Applying profile based on command '{}'".format(command))
+                    self.apply_profile(command)
+                else:
+                    self._logger.debug("Setting state based on command '{}'".format(command))
+                    self.set_sensor_state(target_state=command[0], target_sensor=command[1])
             except BaseException as e:
                 self._logger.error("Could not process command '{}".format(command))
                 self._logger.exception(e)
             self._q_cbsmcontrol.task_done()
 
         # Flush the Data and Status queues.
-        self._flush_queue(self._q_cbsmdata)
-        self._flush_queue(self._q_cbsmstatus)
+        if self._q_cbsmdata is not None:
+            self._flush_queue(self._q_cbsmdata)
+        if self._q_cbsmstatus is not None:
+            self._flush_queue(self._q_cbsmstatus)
 
         # Scan the sensors and collect data.
         self._logger.debug("Scanning sensors.")
         start_time = time.monotonic_ns()
+        start_cpu = time.thread_time_ns()
+        # Start any deferred ranging that's come due, then find which sensors are due to be read.
+        self._apply_starts(start_time)
+        due = [sensor_id for sensor_id in self._sensors if self._is_due(sensor_id, start_time)]
+        # Read the interrupt lines wired through IO expanders, once per expander.
+        expander_inputs = self._read_interrupt_expanders(due)
+        # Read each transport group, either one after another or all at once with a worker per group.
+        if self._executor is None:
+            group_times = [self._scan_group(sensor_ids, due, expander_inputs)
+                           for sensor_ids in self._transport_groups.values()]
+        else:
+            futures = [self._executor.submit(self._scan_group, sensor_ids, due, expander_inputs)
+                       for sensor_ids in self._transport_groups.values()]
+            group_times = [future.result() for future in futures]
+        # Sensors that faulted on creation don't have a reading method, construct a fault response.
         for sensor_id in self._sensors.keys():
-            self._logger.debug("Checking sensor '{}'".format(sensor_id))
-            if isinstance(self._sensors[sensor_id], cobrabay.sensors.BaseSensor):
-                self._latest_state[sensor_id] = self._sensors[sensor_id].reading()
-            elif self._sensors[sensor_id] == cobrabay.const.SENSTATE_FAULT:
-                # If the sensor faulted on creation, it doesn't have a reading method, construct a fault response.
+            if self._sensors[sensor_id] == cobrabay.const.SENSTATE_FAULT:
                 self._latest_state[sensor_id] = SensorReading(
                     state=cobrabay.const.SENSTATE_FAULT,
                     status=cobrabay.const.SENSTATE_FAULT,
@@ -206,19 +322,44 @@ class CBSensorMgr:
                     response_type=cobrabay.const.SENSTATE_FAULT,
                     range=cobrabay.const.GEN_UNAVAILABLE, temp=cobrabay.const.GEN_UNAVAILABLE,
                     fault_reason="Did not initialize.")
-        # Calculate the run_time.
+        # Calculate the run_time, and how much of it was actually spent on the CPU, including by the workers.
         run_time = time.monotonic_ns() - start_time
+        cpu_time = time.thread_time_ns() - start_cpu + sum(group_cpu for _, group_cpu in group_times)
+        # Time the scan would have taken reading the groups one after another.
+        if self._executor is None:
+            sequential_time = run_time
+        else:
+            # The slowest group set the pace of the scan. Swap it for all the groups end to end.
+            sequential_time = (run_time - max([group_time for group_time, _ in group_times], default=0)
+                               + sum(group_time for group_time, _ in group_times))
         self._scan_speed_log.append(run_time)
-        self._scan_speed_log = self._scan_speed_log[:100]
-        scan_data = SensorResponse(timestamp=datetime64('now','ns'), sensors=self._latest_state, scan_time = run_time)
-        self._logger.debug("Enqueing scan data - {}".format(scan_data))
+        self._scan_speed_log = self._scan_speed_log[-100:]
+        self._scan_cpu_log.append(cpu_time)
+        self._scan_cpu_log = self._scan_cpu_log[-100:]
+        self._scan_seq_log.append(sequential_time)
+        self._scan_seq_log = self._scan_seq_log[-100:]
+        self._scan_avg_speed = sum(self._scan_speed_log) / len(self._scan_speed_log)
+        self._logger.debug("Scan took {:.3f}ms, {:.3f}ms if read sequentially.".format(
+            run_time / 1000000, sequential_time / 1000000))
+        # Send a copy of the state, so it isn't changed by the next scan while the receiver is using it.
+        self._generation += 1
+        scan_data = SensorResponse(timestamp=datetime64(time.time_ns(), 'ns'), sensors=dict(self._latest_state),
+                                   scan_time = run_time, generation=self._generation)
+        # Publish to the board, if there is one.
+        if self._sensor_board is not None:
+            self._sensor_board.write(scan_data)
         # Enqueue a SensorResponse.
-        self._q_cbsmdata.put(scan_data,timeout = 1)
+        if self._q_cbsmdata is not None:
+            self._logger.debug("Enqueing scan data - {}".format(scan_data))
+            self._q_cbsmdata.put(scan_data,timeout = 1)
+        # Put it in the mailbox, which wakes the receiver.
+        if self._mailbox is not None:
+            self._mailbox.put(scan_data)
         self._logger.debug("Loop complete.")
 
     def loop_forever(self):
         """
-        Read the sensors in a loop continuously.
+        Read the sensors in a loop continuously. Between scans, waits until the next sensor is due, if known.
 
         :raises OSError: if an unrecoverable error is encountered with a sensor.
         """
@@ -235,6 +376,16 @@ class CBSensorMgr:
             except OSError as e:
                 self._logger.error("Encountered unrecoverable sensor error '{}'".format(e))
                 raise e
+            except BaseException as e:
+                self._logger.critical("Unexpected exception in sensor loop.")
+                self._logger.exception(e)
+                raise e
+
+            # Wait until the next sensor is due.
+            wait = self.scan_wait()
+            if wait > 0:
+                self._thread_wake.wait(wait)
+                self._thread_wake.clear()
 
     def loop_start(self):
         """
@@ -260,9 +411,13 @@ class CBSensorMgr:
 
         :return: bool
         """
+        if self._thread is None:
+            return False
+
         self._logger.debug("Stopping sensor loop thread.")
 
         self._thread_terminate = True
+        self._thread_wake.set()
 
         if threading.current_thread() != self._thread:
             self._thread.join()
@@ -284,6 +439,18 @@ class CBSensorMgr:
         for sensor_obj in self._sensors:
             del self._sensors[sensor_obj]
 
+    def scan_wait(self):
+        """
+        How long a continuous scanner should wait before the next scan. This is until the next sensor is due, but not so
+        long that commands wait too long. If nothing is scheduled, only yield briefly.
+
+        :return: float, seconds.
+        """
+        next_due = self.next_due
+        if next_due is None:
+            return self._thread_min_wait
+        return min((next_due - time.monotonic_ns()) / 1000000000, self._thread_max_wait)
+
     def sensors_activate(self):
         """
         Set all sensors to ranging.
@@ -311,6 +478,8 @@ class CBSensorMgr:
                     if self._sensors[sensor] == cobrabay.const.SENSTATE_FAULT:
                         self._logger.warning("Cannot set state of sensor '{}' before it is initialized.".
                                              format(target_sensor))
+                    elif sensor in self._budgets:
+                        self._set_scheduled_state(sensor, target_state)
                     else:
                         self._logger.info("{} - Setting sensor {}".format(time.monotonic(), sensor))
                         self._logger.debug("Changing sensor {}".format(sensor))
@@ -320,9 +489,251 @@ class CBSensorMgr:
             raise ValueError("'{}' not a valid state for sensors.".format(target_state))
 
     # Public Properties
-    # None defined
+    @property
+    def execution_mode(self):
+        """
+        How the sensors are scanned, 'inline' or 'thread'.
+
+        :return: str
+        """
+        return self._execution_mode
+
+    @property
+    def loop_running(self):
+        """
+        Is the scanning thread running?
+
+        :return: bool
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def next_due(self):
+        """
+        Monotonic time, in ns, when the next scheduled sensor is due to be read or started. None if nothing is
+        scheduled, in which case every scan reads every sensor.
+
+        :return: int or None
+        """
+        times = list(self._next_due.values()) + list(self._start_at.values())
+        if len(times) == 0:
+            return None
+        return min(times)
+
+    @property
+    def sensor_rates(self):
+        """
+        Effective update rate of each sensor, in Hz, from its timing budget. Sensors which aren't ranging are 0, and
+        sensors without a timing budget are None.
+
+        :return: dict
+        """
+        rates = {}
+        for sensor_id, sensor_obj in self._sensors.items():
+            if not isinstance(sensor_obj, cobrabay.sensors.BaseSensor) or sensor_obj.status != SENSTATE_RANGING:
+                rates[sensor_id] = 0
+            elif sensor_id in self._budgets:
+                rates[sensor_id] = 1000000000 / self._budgets[sensor_id]
+            elif hasattr(sensor_obj, 'timing_budget'):
+                rates[sensor_id] = 1 / sensor_obj.timing_budget.m_as('s')
+            else:
+                rates[sensor_id] = None
+        return rates
+
+    @property
+    def scan_stats(self):
+        """
+        Performance of recent sensor scans, averaged over the last 100 scans. All times are in nanoseconds.
+
+        'idle_time' is the part of the scan not spent on the CPU, ie: blocked waiting for sensor I/O.
+        'sequential_time' is how long the scan would take reading every transport one after another. Without transport
+        workers, this is the scan time.
+
+        :return: dict
+        """
+        if len(self._scan_speed_log) == 0:
+            return {'scans': 0, 'scan_time': None, 'cpu_time': None, 'idle_time': None, 'sequential_time': None}
+        cpu_avg = sum(self._scan_cpu_log) / len(self._scan_cpu_log)
+        return {
+            'scans': len(self._scan_speed_log),
+            'scan_time': self._scan_avg_speed,
+            'cpu_time': cpu_avg,
+            'idle_time': max(self._scan_avg_speed - cpu_avg, 0),
+            'sequential_time': sum(self._scan_seq_log) / len(self._scan_seq_log)
+        }
 
     # Private Methods
+    def _apply_starts(self, now):
+        """
+        Start ranging on sensors whose deferred start time has arrived.
+
+        :param now: Current monotonic time, in ns.
+        :type now: int
+        """
+        for sensor_id in [sensor_id for sensor_id, start in self._start_at.items() if start <= now]:
+            del self._start_at[sensor_id]
+            self._logger.debug("Starting deferred ranging on sensor '{}'".format(sensor_id))
+            try:
+                self._sensors[sensor_id].status = SENSTATE_RANGING
+            except BaseException as e:
+                self._logger.error("Could not start ranging on sensor '{}'".format(sensor_id))
+                self._logger.exception(e)
+                continue
+            # First data is a full timing budget after the start.
+            self._next_due[sensor_id] = time.monotonic_ns() + self._budgets[sensor_id]
+
+    def _build_schedule(self):
+        """
+        Group the I2C sensors by bus and cache their timing budgets.
+        """
+        self._budgets = {}
+        self._bus_groups = {}
+        for sensor_id, sensor_obj in self._sensors.items():
+            if not isinstance(sensor_obj, cobrabay.sensors.I2CSensor):
+                continue
+            self._budgets[sensor_id] = round(sensor_obj.timing_budget.m_as('ns'))
+            self._bus_groups.setdefault(id(sensor_obj.i2c_bus), []).append(sensor_id)
+        for bus, sensor_ids in self._bus_groups.items():
+            self._logger.debug("Staggering sensors {} on shared bus.".format(sensor_ids))
+
+    def _group_by_transport(self):
+        """
+        Group sensors by the transport they're read over. I2C sensors are grouped by bus and serial sensors by port.
+        Anything else gets a group of its own. Sensors that failed to initialize aren't read, so aren't grouped.
+
+        :return: dict of lists of sensor IDs.
+        """
+        groups = {}
+        for sensor_id, sensor_obj in self._sensors.items():
+            if isinstance(sensor_obj, cobrabay.sensors.I2CSensor):
+                key = "i2c-{}".format(id(sensor_obj.i2c_bus))
+            elif isinstance(sensor_obj, cobrabay.sensors.SerialSensor):
+                key = "serial-{}".format(sensor_obj.serial_port)
+            elif isinstance(sensor_obj, cobrabay.sensors.BaseSensor):
+                key = "sensor-{}".format(sensor_id)
+            else:
+                continue
+            groups.setdefault(key, []).append(sensor_id)
+        self._logger.debug("Sensor transport groups: {}".format(groups))
+        return groups
+
+    def _is_due(self, sensor_id, now):
+        """
+        Is a sensor due to be read? Sensors that aren't scheduled are always due.
+
+        :param sensor_id: ID of the sensor.
+        :param now: Current monotonic time, in ns.
+        :type now: int
+        :return: bool
+        """
+        if sensor_id in self._start_at:
+            return False
+        return self._next_due.get(sensor_id, now) <= now
+
+    def _not_due_reading(self, sensor_id):
+        """
+        Interrupt Not Ready response for a sensor that isn't due to be read, built without touching the sensor.
+
+        :param sensor_id: ID of the sensor.
+        :return: SensorReading
+        """
+        previous = self._latest_state.get(sensor_id, None)
+        return SensorReading(
+            state=previous.state if previous is not None else SENSTATE_ENABLED,
+            status=SENSTATE_RANGING,
+            fault=previous.fault if previous is not None else False,
+            response_type=SENSOR_RESP_INR,
+            range=None, temp=None, fault_reason=None)
+
+    @staticmethod
+    def _phase_offsets(budgets):
+        """
+        Offsets for the ranging starts of sensors sharing a bus, spreading their completions evenly across the
+        longest timing budget.
+
+        :param budgets: Timing budgets of the sensors on the bus, in ns, in start order.
+        :type budgets: list
+        :return: list of offsets, in ns.
+        """
+        if len(budgets) == 0:
+            return []
+        slot = max(budgets) // len(budgets)
+        return [position * slot for position in range(len(budgets))]
+
+    def _scan_group(self, sensor_ids, due, expander_inputs):
+        """
+        Read a group of sensors sharing a transport.
+
+        :param sensor_ids: Sensors in the group.
+        :type sensor_ids: list
+        :param due: Sensors due to be read this scan.
+        :type due: list
+        :param expander_inputs: Input values read from each IO expander, keyed by id() of the expander object.
+        :type expander_inputs: dict
+        :return: tuple of the time taken and the CPU time used, in ns.
+        """
+        start_time = time.monotonic_ns()
+        start_cpu = time.thread_time_ns()
+        for sensor_id in sensor_ids:
+            self._logger.debug("Checking sensor '{}'".format(sensor_id))
+            if sensor_id not in due:
+                # Not expected to have data yet, don't touch the bus.
+                self._latest_state[sensor_id] = self._not_due_reading(sensor_id)
+                continue
+            ready = self._interrupt_ready(self._sensors[sensor_id], expander_inputs)
+            if ready is None:
+                self._latest_state[sensor_id] = self._sensors[sensor_id].reading()
+            else:
+                self._latest_state[sensor_id] = self._sensors[sensor_id].reading(ready=ready)
+            self._reschedule(sensor_id, self._latest_state[sensor_id])
+        return time.monotonic_ns() - start_time, time.thread_time_ns() - start_cpu
+
+    def _reschedule(self, sensor_id, reading):
+        """
+        Set the next due time for a scheduled sensor after it's been read.
+
+        :param sensor_id: ID of the sensor.
+        :param reading: Reading the sensor just returned.
+        :type reading: SensorReading
+        """
+        if sensor_id not in self._next_due:
+            return
+        now = time.monotonic_ns()
+        if reading.response_type == SENSOR_RESP_INR:
+            # Due, but not quite done. Check again shortly.
+            self._next_due[sensor_id] = now + self._retry_delay
+        else:
+            self._next_due[sensor_id] = now + self._budgets[sensor_id]
+
+    def _set_scheduled_state(self, sensor_id, target_state):
+        """
+        Set the state of a scheduled sensor. Starts of ranging are deferred and phase-offset from the other sensors on
+        the same bus, and applied by the loop when they come due.
+
+        :param sensor_id: ID of the sensor.
+        :param target_state: State to set the sensor to.
+        """
+        sensor_obj = self._sensors[sensor_id]
+        self._start_at.pop(sensor_id, None)
+        self._next_due.pop(sensor_id, None)
+        if target_state != SENSTATE_RANGING:
+            sensor_obj.status = target_state
+            return
+        if sensor_obj.status == SENSTATE_RANGING:
+            # Already ranging, just read it when it's next ready.
+            self._next_due[sensor_id] = time.monotonic_ns()
+            return
+        # Enable now, so it's ready to go when its start comes up.
+        if sensor_obj.status == SENSTATE_DISABLED:
+            sensor_obj.status = SENSTATE_ENABLED
+        # The budget may have changed since the schedule was built.
+        self._budgets[sensor_id] = round(sensor_obj.timing_budget.m_as('ns'))
+        group = self._bus_groups[id(sensor_obj.i2c_bus)]
+        offsets = self._phase_offsets([self._budgets[member] for member in group])
+        self._start_at[sensor_id] = time.monotonic_ns() + offsets[group.index(sensor_id)]
+        self._logger.debug("Deferring ranging start of sensor '{}' by {}ms".format(
+            sensor_id, offsets[group.index(sensor_id)] / 1000000))
+
     def _create_sensor_multiple(self, all_configs):
         """
         Create sensor objects for a given configuration.
@@ -357,6 +768,15 @@ class CBSensorMgr:
                     name=sensor_config['name'],
                     port=sensor_config['port'],
                     baud=sensor_config['baud'],
+                    # Sensor sub-schemas aren't normalized, so fall back to defaults here.
+                    clustering=sensor_config.get('clustering', 1),
+                    read_mode=sensor_config.get('read_mode', 'inline'),
+                    ring_size=sensor_config.get('ring_size', 1000),
+                    acquisition=sensor_config.get('acquisition', 'continuous'),
+                    frame_rate=sensor_config.get('frame_rate', 100),
+                    idle_frame_rate=sensor_config.get('idle_frame_rate', 10),
+                    idle_timeout=sensor_config.get('idle_timeout', '30s'),
+                    read_budget=sensor_config.get('read_budget', '50ms'),
                     parent_logger=self._logger,
                     # TODO: Use log level from config.
                     log_level="WARNING"
@@ -380,6 +800,15 @@ class CBSensorMgr:
                     self._logger.error("Cannot configure sensor '{}', requested IO expander at address '{}' does not "
                                        "exist.".format(sensor_config['name'], hex(sensor_config['enable_board'])))
                     raise ValueError("IO expander does not exist.")
+            # Interrupt line, if configured. Same rules as the enable board.
+            interrupt_board = sensor_config.get('interrupt_board', None)
+            if interrupt_board not in (None, 0):
+                try:
+                    interrupt_board = self._ioexpanders[str(sensor_config['interrupt_board'])]
+                except KeyError:
+                    self._logger.error("Cannot configure sensor '{}', requested IO expander at address '{}' does not "
+                                       "exist.".format(sensor_config['name'], hex(sensor_config['interrupt_board'])))
+                    raise ValueError("IO expander does not exist.")
             self._logger.debug("Will pass I2C Bus: {} ({})".format(self._i2c_bus, type(self._i2c_bus)))
             self._logger.debug("Will pass IO Expander: {} ({})".format(enable_board, type(enable_board)))
             # Now create the actual sensor object.
@@ -390,6 +819,10 @@ class CBSensorMgr:
                     i2c_bus=self._i2c_bus,
                     enable_board=enable_board,
                     enable_pin=sensor_config['enable_pin'],
+                    interrupt_board=interrupt_board,
+                    interrupt_pin=sensor_config.get('interrupt_pin', None),
+                    timing=sensor_config.get('timing', '200ms'),
+                    distance_mode=sensor_config.get('distance_mode', 'long'),
                     parent_logger=self._logger,
                     # TODO: Use log level from config.
                     log_level="DEBUG"
@@ -448,6 +881,48 @@ class CBSensorMgr:
                 continue
             q.task_done()
 
+    @staticmethod
+    def _interrupt_ready(sensor_obj, expander_inputs):
+        """
+        Data readiness for a sensor with its interrupt wired through an IO expander, from the expander's inputs.
+
+        :param sensor_obj: Sensor to check.
+        :param expander_inputs: Input values read from each expander, keyed by id() of the expander object.
+        :type expander_inputs: dict
+        :return: bool, or None if the sensor should check for itself.
+        """
+        if not isinstance(sensor_obj, cobrabay.sensors.CBVL53L1X):
+            return None
+        expander = sensor_obj.interrupt_expander
+        if expander is None or id(expander) not in expander_inputs:
+            return None
+        return sensor_obj.data_ready_from(expander_inputs[id(expander)])
+
+    def _read_interrupt_expanders(self, sensor_ids=None):
+        """
+        Read the inputs of every IO expander that has sensor interrupt lines wired to it.
+
+        :param sensor_ids: Only read expanders for these sensors. Defaults to all.
+        :type sensor_ids: list
+        :return: dict of input values keyed by id() of the expander object.
+        """
+        expander_inputs = {}
+        if sensor_ids is None:
+            sensor_ids = self._sensors.keys()
+        for sensor_id in sensor_ids:
+            sensor_obj = self._sensors[sensor_id]
+            if not isinstance(sensor_obj, cobrabay.sensors.CBVL53L1X):
+                continue
+            expander = sensor_obj.interrupt_expander
+            if expander is None or id(expander) in expander_inputs:
+                continue
+            try:
+                expander_inputs[id(expander)] = expander.inputs
+            except OSError:
+                # Sensors on this expander will check for themselves.
+                self._logger.warning("Could not read interrupt lines from IO expander.")
+        return expander_inputs
+
     def _reset_i2c_bus(self):
         self._logger.info("Resetting I2C bus on request.")
         self._disable_i2c_bus()
@@ -494,11 +969,13 @@ class CBSensorMgr:
         """
         aw9523_addr_list = []
         for sensor in self._sensor_config:
-            try:
-                aw9523_addr_list.append(self._sensor_config[sensor]['enable_board'])
-            except KeyError:
-                pass
-        return list(set(aw9523_addr_list))
+            for board_key in ('enable_board', 'interrupt_board'):
+                try:
+                    aw9523_addr_list.append(self._sensor_config[sensor][board_key])
+                except KeyError:
+                    pass
+        # Board 0 is the Pi itself, not an expander.
+        return [addr for addr in set(aw9523_addr_list) if addr != 0]
 
     def _get_pinobj(self, pin_id):
         if pin_id is not None:
@@ -547,3 +1024,182 @@ class CBSensorMgr:
             self.__name = 'CBSensorMgr'
         else:
             self.__name = the_input
+
+
+class CBSensorMgrProcess:
+    """
+    Runs a Cobra Bay Sensor Manager in its own process, so sensor timing isn't affected by load in the main process.
+    Scans are published to a shared memory board, with a shared mailbox to signal each one, and commands go over a
+    multiprocessing control queue. Stands in for the sensor manager in the main process.
+    """
+
+    def __init__(self, sensor_config, q_cbsmcontrol, name=None, parent_logger=None, log_level="WARNING",
+                 start_timeout=120, **kwargs):
+        """
+        Start a Sensor Manager process.
+
+        :param sensor_config: Dictionary of sensors and their settings. Presume this is validated.
+        :type sensor_config: dict
+        :param q_cbsmcontrol: Takes incoming commands from the parent process.
+        :type q_cbsmcontrol: multiprocessing.JoinableQueue
+        :param name: Name of the sensor manager instance. Defaults to 'CBSensorMgr'
+        :type name: str
+        :param parent_logger:
+        :param log_level: Logging level. Any valid python logging level is allowed. Defaults to WARNING.
+        :type log_level: str
+        :param start_timeout: Time in seconds to wait for the first scan from the new process.
+        :type start_timeout: int
+        :param kwargs: Other options to pass to the sensor manager. See CBSensorMgr.
+        """
+        self._name = 'CBSensorMgr' if name is None else name
+        if parent_logger is None:
+            self._logger = logging.getLogger(self._name)
+            self._logger.setLevel(log_level)
+        else:
+            self._logger = parent_logger.getChild(self._name)
+        self._sensor_config = sensor_config
+        self._q_cbsmcontrol = q_cbsmcontrol
+
+        # Create the board and the mailbox, and start the process.
+        self._sensor_board = cobrabay.sensorboard.CBSensorBoard(sensor_ids=list(sensor_config.keys()))
+        self._mailbox = cobrabay.mailbox.CBMailbox(context=multiprocessing.get_context())
+        self._stop = multiprocessing.Event()
+        kwargs.pop('execution_mode', None)
+        self._process = multiprocessing.Process(
+            target=_process_main, name=f"cbsensormgr-{self._name}",
+            args=(self._sensor_board.sensor_ids, self._sensor_board.name, self._mailbox, self._stop, sensor_config,
+                  q_cbsmcontrol, self._name, log_level, kwargs))
+        self._process.daemon = True
+        self._logger.info("Starting sensor manager process.")
+        self._process.start()
+        atexit.register(self.cleanup)
+
+        # Wait for the sensors to be set up and the first scan to come through.
+        deadline = time.monotonic() + start_timeout
+        while not self._mailbox.wait(timeout=max(deadline - time.monotonic(), 0)):
+            if time.monotonic() >= deadline or not self._process.is_alive():
+                break
+        if self._mailbox.sequence == 0:
+            self.cleanup()
+            raise OSError("Sensor manager process did not return data within {}s.".format(start_timeout))
+        self._logger.info("Sensor manager process is running.")
+
+    def cleanup(self):
+        """ Stop the process, which shuts off the sensors, and release the board. """
+        if self._process is None:
+            return
+        self.loop_stop()
+        self._sensor_board.close()
+        self._process = None
+
+    # Public Methods
+    def get_sensor(self, sensor_id):
+        """
+        Basic information about a sensor. The sensor objects live in the manager's process, so this only has what's
+        known from the configuration and the board.
+
+        :param sensor_id:
+        :return: SimpleNamespace with 'id' and 'name', or SENSTATE_FAULT if the sensor is faulted.
+        """
+        if sensor_id not in self._sensor_config:
+            raise KeyError(sensor_id)
+        latest = self._sensor_board.read()
+        if latest is not None and latest.sensors[sensor_id].response_type == SENSTATE_FAULT:
+            return SENSTATE_FAULT
+        return types.SimpleNamespace(id=sensor_id, name=self._sensor_config[sensor_id]['name'])
+
+    def enumerate_sensors(self):
+        """
+        List the configured sensors
+        :return: list
+        """
+        return self._sensor_config.keys()
+
+    def loop(self):
+        """ The process scans on its own. Nothing to do. """
+        return
+
+    def loop_stop(self):
+        """
+        Stop the sensor manager process. It disables the sensors as it exits.
+
+        :return: bool
+        """
+        if self._process is None or not self._process.is_alive():
+            return False
+        self._logger.debug("Stopping sensor manager process.")
+        self._stop.set()
+        self._process.join(timeout=30)
+        if self._process.is_alive():
+            self._logger.error("Sensor manager process did not stop, terminating.")
+            self._process.terminate()
+            self._process.join()
+        return True
+
+    def set_sensor_state(self, target_state, target_sensor=None):
+        """
+        Set state for one or many sensors, through the control queue.
+
+        :param target_state: State to set the sensor(s) to.
+        :param target_sensor: Sensors to set. Defaults to all.
+        :return: None
+        """
+        if not self.loop_running:
+            self._logger.warning("Sensor manager process isn't running, cannot set state.")
+            return
+        self._q_cbsmcontrol.put((target_state, target_sensor))
+
+    # Public Properties
+    @property
+    def board(self):
+        """
+        Shared memory board the process publishes scans to.
+
+        :return: cobrabay.sensorboard.CBSensorBoard
+        """
+        return self._sensor_board
+
+    @property
+    def execution_mode(self):
+        """ How the sensors are scanned. Always 'process'. """
+        return 'process'
+
+    @property
+    def mailbox(self):
+        """
+        Mailbox the process signals each scan through. Items aren't passed, read the scan from the board.
+
+        :return: cobrabay.mailbox.CBMailbox
+        """
+        return self._mailbox
+
+    @property
+    def loop_running(self):
+        """
+        Is the sensor manager process running?
+
+        :return: bool
+        """
+        return self._process is not None and self._process.is_alive()
+
+
+def _process_main(sensor_ids, board_name, mailbox, stop, sensor_config, q_cbsmcontrol, name, log_level, kwargs):
+    """
+    Entry point for the sensor manager process. Scans continuously until stopped.
+    """
+    # The parent process handles signals and stops us through the event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Attach to the parent's board. The parent owns it and will free it.
+    board = cobrabay.sensorboard.CBSensorBoard(sensor_ids, name=board_name, create=False)
+    sensormgr = CBSensorMgr(sensor_config=sensor_config, name=name, log_level=log_level,
+                            q_cbsmcontrol=q_cbsmcontrol, sensor_board=board, mailbox=mailbox, execution_mode='inline',
+                            **kwargs)
+    try:
+        while not stop.is_set():
+            sensormgr.loop()
+            wait = sensormgr.scan_wait()
+            if wait > 0:
+                stop.wait(wait)
+    finally:
+        sensormgr.cleanup()
+        board.close()
@@ -18,8 +18,11 @@ from weakref import WeakSet
 import adafruit_vl53l1x
 # IO Expander
 import adafruit_aw9523
+# Pi GPIO, for interrupts.
+from gpiozero import DigitalInputDevice
 # General libraries
 from pint import Quantity
+from threading import Event
 from time import monotonic, monotonic_ns, sleep
 from numpy import datetime64
 
@@ -32,7 +35,7 @@ class CBVL53L1X(I2CSensor):
 
     def __init__(self, name, i2c_address, enable_board, enable_pin, i2c_bus,
                  timing=200, always_range=False, distance_mode='long', max_retries=0,
-                 parent_logger=None, log_level="WARNING"):
+                 interrupt_board=None, interrupt_pin=None, parent_logger=None, log_level="WARNING"):
         """
         :param name: Name of this sensor.
         :type name: str
@@ -47,6 +50,11 @@ class CBVL53L1X(I2CSensor):
         :type timing: int or Quantity('ms')
         :param max_retries: Maximum number of retries before the sensor is marked as in fault.
         :type max_retries: int
+        :param interrupt_board: Board the sensor's GPIO1 interrupt line is wired to. 0 for a Pi GPIO pin, an AW9523
+        object for a pin on the IO expander, or None to poll the sensor over I2C.
+        :type interrupt_board: int or adafruit_aw9523.AW9523 or None
+        :param interrupt_pin: Pin the interrupt line is wired to.
+        :type interrupt_pin: int
         :param parent_logger: Parent logger to attach to.
         :type parent_logger: logger
         :param log_level: If no parent logger provided, log level of the new logger to create.
@@ -68,12 +76,20 @@ class CBVL53L1X(I2CSensor):
 
         # Save the input parameters.
         self.timing_budget = timing  # Timing budget
-        self._distance_mode = distance_mode  # Distance mode.
+        self.distance_mode = distance_mode  # Distance mode.
         self.enable_board = enable_board
         self.enable_pin = enable_pin  # Pin for enabling.
         self._logger.debug("Saved enable pin: {}".format(self._enable_pin._pin))
         self._enable_attempt_counter = 1
 
+        # Set up the interrupt line, if there is one.
+        self._interrupt_board = interrupt_board
+        self._interrupt_pin = interrupt_pin
+        self._interrupt_device = None  # Pi GPIO input.
+        self._interrupt_event = None  # Set on the interrupt edge from a Pi GPIO.
+        self._interrupt_pin_obj = None  # AW9523 input.
+        self._setup_interrupt()
+
         # Add self to instance list.
         CBVL53L1X.instances.add(self)
 
@@ -87,7 +103,6 @@ class CBVL53L1X(I2CSensor):
         self.status = 'enabled'
         # Get a test reading.
         self.status = 'ranging'  # Start ranging.
-        self.distance_mode = 'long'
         test_range = self.reading(wait=True)
         self._logger.debug("Test reading: {} ({})".format(test_range, type(test_range)))
         if not always_range:
@@ -100,13 +115,45 @@ class CBVL53L1X(I2CSensor):
     # Public Methods
     @property
     def data_ready(self):
-        """Interrupt status for data readiness of the sensor."""
+        """
+        Interrupt status for data readiness of the sensor. Read from the interrupt line if one is wired, otherwise by
+        asking the sensor over I2C.
+        """
         try:
-            return self._sensor_obj.data_ready
+            if self._interrupt_device is not None:
+                return self._interrupt_device.is_active
+            elif self._interrupt_pin_obj is not None:
+                # GPIO1 is active low.
+                return not self._interrupt_pin_obj.value
+            else:
+                return self._sensor_obj.data_ready
         except OSError:
             self._logger.warning("Received exception when checking interrupt.")
             return False
 
+    def data_ready_from(self, inputs):
+        """
+        Data readiness from a read of all the interrupt board's input pins. Lets the caller read an IO expander once
+        for every sensor wired to it.
+
+        :param inputs: Value of the AW9523 input registers, one bit per pin.
+        :type inputs: int
+        :return: bool
+        """
+        # GPIO1 is active low.
+        return not inputs & (1 << self._interrupt_pin)
+
+    @property
+    def interrupt_expander(self):
+        """
+        IO expander the interrupt line is wired to, if any.
+
+        :return: adafruit_aw9523.AW9523 or None
+        """
+        if self._interrupt_pin_obj is not None:
+            return self._interrupt_board
+        return None
+
     @property
     def clear_interrupt(self):
         """ Clear the interrupt on the sensor"""
@@ -123,11 +170,13 @@ class CBVL53L1X(I2CSensor):
             else:
                 return
 
-    def reading(self, wait=False):
+    def reading(self, wait=False, ready=None):
         """
         Get the current range reading of the sensor.
 
         :param wait: Wait for interrupt to return. Will be up to self.timing_budget milliseconds.
+        :param ready: Data readiness, if the caller already knows it. Saves checking it again.
+        :type ready: bool or None
         :return: SensorResponse(response_type, reading)
         """
         self._logger.debug("Range requested. Sensor state is: {}".format(self.state))
@@ -144,10 +193,17 @@ class CBVL53L1X(I2CSensor):
             )
         start = monotonic_ns()
         # Check the interrupt to see if the sensor has new data.
-        while not self.data_ready:
+        if ready is None or wait:
+            ready = self.data_ready
+        while not ready:
             if wait:
-                # Wait one millisecond.
-                sleep(0.001)
+                if self._interrupt_event is not None:
+                    # Sleep until the interrupt edge, checking the line again at least once per timing budget.
+                    self._interrupt_event.wait(self.timing_budget.m_as('s'))
+                else:
+                    # Wait one millisecond.
+                    sleep(0.001)
+                ready = self.data_ready
             else:
                 # If waiting for the sensor, return Interrupt Not Ready immediately.
                 return cobrabay.datatypes.SensorReading(
@@ -196,7 +252,9 @@ class CBVL53L1X(I2CSensor):
             response_type=cobrabay.const.SENSOR_RESP_OK
             range=Quantity(sensor_response, 'cm')
             fault_reason=None
-        # Clear the interrupt.
+        # Clear the interrupt. Reset the edge flag first, so an edge from the next measurement isn't lost.
+        if self._interrupt_event is not None:
+            self._interrupt_event.clear()
         self.clear_interrupt
         # Return.
         return SensorReading(
@@ -226,21 +284,19 @@ class CBVL53L1X(I2CSensor):
     @distance_mode.setter
     def distance_mode(self, target_mode):
         """
-        Distance mode of the sensor. May be 'short' or 'long'
+        Distance mode of the sensor. May be 'short' or 'long'. If the sensor is ranging, ranging is stopped while the
+        mode is changed and then restarted.
 
         :param target_mode: str
         :return:
         """
-        if not self._fault:
-            # Pre-checking the distance mode lets us toss an error before actually setting anything.
-            if target_mode.lower() == 'short':
-                target_mode = 1
-            elif target_mode.lower() == 'long':
-                target_mode = 2
-            else:
-                raise ValueError("{} is not a valid distance mode".format(target_mode))
-            self._distance_mode = target_mode
-            self._sensor_obj.distance_mode = target_mode
+        # Pre-checking the distance mode lets us toss an error before actually setting anything.
+        if target_mode.lower() not in ('short', 'long'):
+            raise ValueError("{} is not a valid distance mode".format(target_mode))
+        self._distance_mode = target_mode.lower()
+        # If object is initialized, set immediately.
+        if self._sensor_obj is not None and not self._fault:
+            self._apply_settings()
 
     @property
     def enable_board(self):
@@ -403,16 +459,50 @@ class CBVL53L1X(I2CSensor):
 
         if not isinstance(timing_input, Quantity):
             timing_input = Quantity(timing_input)
-        if timing_input.magnitude not in (20, 33, 50, 100, 200, 500):
+        if timing_input.dimensionless:
+            timing_input = Quantity(timing_input.magnitude, 'ms')
+        if timing_input.m_as('ms') not in (20, 33, 50, 100, 200, 500):
             raise ValueError("Requested timing budget {} not valid. "
-                             "Must be one of: 20, 33, 50, 100, 200 or 500 ms".format(input))
+                             "Must be one of: 20, 33, 50, 100, 200 or 500 ms".format(timing_input))
         # Save the timing budget.
-        self._timing_budget = timing_input.magnitude
+        self._timing_budget = int(timing_input.m_as('ms'))
         # If object is initialized, set immediately.
-        if self._sensor_obj is not None:
-            self._sensor_obj.timing_budget(timing_input.magnitude)
+        if self._sensor_obj is not None and not self._fault:
+            self._apply_settings()
 
     ## Private Methods
+    def _apply_settings(self):
+        """
+        Send the saved distance mode and timing budget to the sensor. The sensor can't change these while measuring, so
+        if it's ranging, ranging is stopped around the change.
+        """
+        if self._ranging:
+            self._sensor_obj.stop_ranging()
+        # Setting the distance mode resets the timing budget, so the timing budget must go second.
+        self._sensor_obj.distance_mode = 1 if self._distance_mode == 'short' else 2
+        self._sensor_obj.timing_budget = self._timing_budget
+        if self._ranging:
+            self._sensor_obj.start_ranging()
+        self._logger.debug("Set distance mode '{}', timing budget {}ms".format(self._distance_mode,
+                                                                               self._timing_budget))
+
+    def _setup_interrupt(self):
+        """ Configure the pin for the sensor's GPIO1 interrupt line. """
+        if self._interrupt_board is None:
+            return
+        if self._interrupt_board == 0:
+            # GPIO1 is active low and needs a pull-up.
+            self._logger.debug("Using Pi GPIO {} for interrupt.".format(self._interrupt_pin))
+            self._interrupt_event = Event()
+            self._interrupt_device = DigitalInputDevice(self._interrupt_pin, pull_up=True)
+            self._interrupt_device.when_activated = self._interrupt_event.set
+        elif isinstance(self._interrupt_board, adafruit_aw9523.AW9523):
+            self._logger.debug("Using IO expander pin {} for interrupt.".format(self._interrupt_pin))
+            self._interrupt_pin_obj = self._interrupt_board.get_pin(self._interrupt_pin)
+            self._interrupt_pin_obj.switch_to_input()
+        else:
+            raise ValueError("Interrupt board must be 0 or an AW9523.")
+
     # def __del__(self):
     #     """Destructor, disables the sensor when the object is destroyed."""
     #     self._logger.debug("Disabling sensor on object deletion.")
@@ -458,6 +548,8 @@ class CBVL53L1X(I2CSensor):
             else:
                 # Change the I2C address to the target address.
                 self._sensor_obj.set_address(new_address=self.i2c_address)
+                # Apply the configured distance mode and timing budget.
+                self._apply_settings()
                 # Make sure fault isn't set, if we're recovering from failure.
                 self._fault = False
                 return
@@ -10,14 +10,18 @@ from cobrabay.sensors import SerialSensor
 # Required Cobra Bay datatypes
 from cobrabay.datatypes import SensorResponse, SensorReading, TFMPData
 # General libraries
+from collections import deque
 from pint import Quantity
-from time import monotonic
-from .tfmp import TFMP
+from statistics import median
+from time import monotonic, monotonic_ns
+from .tfmp import TFMP, TFMPTimeout
 import cobrabay.const
 from numpy import datetime64
 
 class TFMini(SerialSensor):
-    def __init__(self, name, port, baud, error_margin=None, parent_logger=None, clustering=1, log_level="WARNING"):
+    def __init__(self, name, port, baud, error_margin=None, parent_logger=None, clustering=1, read_mode='inline',
+                 ring_size=1000, acquisition='continuous', frame_rate=100, idle_frame_rate=10, idle_timeout=None,
+                 read_budget=None, log_level="WARNING"):
         """
         Sensor for TFMini
 
@@ -31,8 +35,25 @@ class TFMini(SerialSensor):
         :type baud: int
         :param parent_logger: Parent logger to attach to.
         :type parent_logger: logger
-        :param clustering: Should we cluster read, and if so how many to cluster?
+        :param clustering: Size of the filter. Readings are the median of the last 2n+1 frames.
         :type clustering: int
+        :param read_mode: Read the port when a reading is requested ('inline') or continuously in a background thread
+        ('thread').
+        :type read_mode: str
+        :param ring_size: Number of frames the background reader keeps.
+        :type ring_size: int
+        :param acquisition: How the sensor takes measurements. 'continuous' streams at frame_rate, 'trigger' measures
+        only when a reading is requested, 'adaptive' streams at frame_rate while the range is changing and drops to
+        idle_frame_rate once it has been steady for idle_timeout.
+        :type acquisition: str
+        :param frame_rate: Frames per second to stream at.
+        :type frame_rate: int
+        :param idle_frame_rate: Frames per second to stream at when idle, in 'adaptive' acquisition.
+        :type idle_frame_rate: int
+        :param idle_timeout: How long the range must be steady before dropping to the idle rate. Defaults to 30s.
+        :type idle_timeout: Quantity
+        :param read_budget: Most time a reading may spend collecting frames for the filter. Defaults to 50ms.
+        :type read_budget: Quantity
         :param log_level: If no parent logger provided, log level of the new logger to create.
         :type log_level: str
         """
@@ -53,12 +74,53 @@ class TFMini(SerialSensor):
         else:
             self._error_margin = error_margin
 
-        # Cluster reading setting.
+        # Filter settings. The window holds unconverted frames, oldest first.
         self._clustering = clustering
+        self._filter_window = deque(maxlen=clustering * 2 + 1)
+        self._error_margin_cm = Quantity(self._error_margin).m_as('cm')
+        if read_budget is None:
+            self._read_budget = 50
+        else:
+            self._read_budget = Quantity(read_budget).m_as('ms')
+
+        # Checksum errors seen as of the last reading, to spot new ones.
+        self._checksum_errors = 0
+
+        # Read mode settings.
+        if read_mode not in ('inline', 'thread'):
+            raise ValueError("Read mode must be 'inline' or 'thread'")
+        self._read_mode = read_mode
+        self._ring_size = ring_size
+        self._last_timestamp = None
+
+        # Acquisition settings.
+        if acquisition not in ('continuous', 'trigger', 'adaptive'):
+            raise ValueError("Acquisition must be 'continuous', 'trigger' or 'adaptive'")
+        if acquisition == 'trigger' and read_mode == 'thread':
+            raise ValueError("Trigger acquisition needs the 'inline' read mode, the background reader can't trigger.")
+        self._acquisition = acquisition
+        self._frame_rate = frame_rate
+        self._idle_frame_rate = idle_frame_rate
+        if idle_timeout is None:
+            self._idle_timeout = 30
+        else:
+            self._idle_timeout = Quantity(idle_timeout).m_as('s')
+        self._idle = False
+        self._idle_reference = None
+        self._last_activity = monotonic()
 
         # Create the sensor object.
         self._logger.debug("Creating TFMini object on serial port {}".format(self.serial_port))
         self._sensor_obj = TFMP(self.serial_port, self.baud_rate)
+        if self._acquisition == 'trigger':
+            self._logger.debug("Setting frame rate to 0 for triggered acquisition.")
+            self._sensor_obj.set_frame_rate(0)
+        else:
+            self._logger.debug("Setting frame rate to {} for {} acquisition.".format(self._frame_rate, self._acquisition))
+            self._sensor_obj.set_frame_rate(self._frame_rate)
+        if self._read_mode == 'thread':
+            self._logger.debug("Starting background reader with ring of {} frames.".format(self._ring_size))
+            self._sensor_obj.start_reader(ring_size=self._ring_size)
         self._logger.debug("Test reading: {} ({})".format(self.reading, type(self.reading)))
 
     # Public Methods
@@ -84,12 +146,22 @@ class TFMini(SerialSensor):
         """
         pass
 
+    def history(self, since=None):
+        """
+        Frames collected by the background reader, oldest first. Only available in 'thread' read mode.
+
+        :param since: Only return frames received after this time, in monotonic nanoseconds.
+        :type since: int
+        :return: list
+        """
+        return self._sensor_obj.history(since=since)
+
     def reading(self):
         """Reading from the sensor."""
-        #TODO: Determine source of frequent (every few second) checksum errors.
-        # "OSError: Sensor checksum error"
+        # Corrupt frames are skipped by the reader rather than raised. Log when they happen so a noisy line can be
+        # traced back to its cause.
         try:
-            reading = self._clustered_read(self._clustering)
+            reading, confidence, samples = self._filtered_read()
         except BaseException as e:
             self._logger.error("Reading received exception - '{}: {}'".format(type(e).__name__, e))
             self._state = cobrabay.const.SENSTATE_DISABLED
@@ -103,7 +175,20 @@ class TFMini(SerialSensor):
                 fault_reason=e
             )
         else:
-
+            self._log_frame_errors()
+            # If nothing new has arrived, there's nothing new to report.
+            if reading is None:
+                return SensorReading(
+                    state=self.state,
+                    status=self.status,
+                    fault=self._fault,
+                    response_type=cobrabay.const.SENSOR_RESP_INR,
+                    range=None,
+                    temp=None,
+                    fault_reason=None
+                )
+            if self._acquisition == 'adaptive':
+                self._adapt_rate(reading)
             # self._state = cobrabay.const.SENSTATE_RANGING
             self._logger.debug("TFmini read values: {}".format(reading))
             # Check the status to see if we got a value, or some kind of non-OK state.
@@ -115,7 +200,9 @@ class TFMini(SerialSensor):
                     response_type=cobrabay.const.SENSOR_RESP_OK,
                     range=reading.distance,
                     temp=reading.temperature,
-                    fault_reason=None
+                    fault_reason=None,
+                    confidence=confidence,
+                    samples=samples
                 )
             elif reading.status == "Weak":
                 return SensorReading(
@@ -158,22 +245,87 @@ class TFMini(SerialSensor):
                     fault_reason="Unknown reading '{}'".format(reading)
                 )
 
-    # The clustered read method requires the sensor to be returning a consistent result to return.
-    # Passing '1' will require two consecutive reads of the same value.
-    def _clustered_read(self, reading_count):
-        stable_count = 0
-        i = 0
-        previous_read = self._sensor_obj.data()
-        start = monotonic()
-        while stable_count < reading_count:
-            reading = self._sensor_obj.data()
-            if reading.distance == previous_read.distance:
-                stable_count += 1
-            previous_read = reading
-            i += 1
-        self._logger.debug("Took {} cycles in {}s to get stable reading of {}.".
-                           format(i, round(monotonic() - start, 2), previous_read))
-        return previous_read
+    # In adaptive acquisition, drop to the idle frame rate once the range has held steady, and go back to the full
+    # rate as soon as it moves.
+    def _adapt_rate(self, reading):
+        if reading.status != "OK":
+            return
+        if self._idle_reference is None or abs(reading.distance - self._idle_reference) > self._error_margin:
+            self._idle_reference = reading.distance
+            self._last_activity = monotonic()
+            if self._idle:
+                self._logger.info("Range changed, returning to {} Hz.".format(self._frame_rate))
+                self._sensor_obj.set_frame_rate(self._frame_rate)
+                self._idle = False
+        elif not self._idle and monotonic() - self._last_activity > self._idle_timeout:
+            self._logger.info("Range steady for {}s, dropping to {} Hz.".format(self._idle_timeout,
+                                                                               self._idle_frame_rate))
+            self._sensor_obj.set_frame_rate(self._idle_frame_rate)
+            self._idle = True
+
+    # Log any checksum errors the reader has seen since the last check.
+    def _log_frame_errors(self):
+        frame_stats = self._sensor_obj.frame_stats
+        if frame_stats['checksum_errors'] > self._checksum_errors:
+            self._logger.debug("Rejected {} frames on checksum since last reading. Totals: {}".
+                               format(frame_stats['checksum_errors'] - self._checksum_errors, frame_stats))
+            self._checksum_errors = frame_stats['checksum_errors']
+
+    # Filtered read. Adds new frames to a rolling window and returns the median of the good frames in it.
+    # In inline mode, frames are only collected while the read budget allows, so a slow or noisy sensor can't hold up
+    # the scan. In thread mode, everything the reader has received since the last call is used, without waiting.
+    def _filtered_read(self):
+        if self._read_mode == 'thread':
+            # A reader that's died will never deliver anything new, so that's a fault rather than a wait.
+            if not self._sensor_obj.reader_running:
+                raise IOError("Background reader is not running. ({})".format(self._sensor_obj.reader_error))
+            new_frames = self._sensor_obj.history(since=self._last_timestamp)
+            if len(new_frames) == 0:
+                return None, None, 0
+            self._last_timestamp = new_frames[-1].timestamp
+            self._filter_window.extend(new_frames)
+        else:
+            deadline = monotonic_ns() + self._read_budget * 1000000
+            # Always try for one fresh frame, but only for as long as the budget. If none arrives in time, there's
+            # nothing new to report.
+            try:
+                self._filter_window.append(self._sensor_obj.data(timeout=self._read_budget, convert=False))
+            except TFMPTimeout:
+                return None, None, 0
+            for i in range(self._clustering):
+                remaining = (deadline - monotonic_ns()) // 1000000
+                if remaining <= 0:
+                    break
+                try:
+                    self._filter_window.append(self._sensor_obj.data(timeout=remaining, convert=False))
+                except TFMPTimeout:
+                    break
+        return self._filter_result(self._filter_window, self._error_margin_cm, self._sensor_obj.convert)
+
+    @staticmethod
+    def _filter_result(window, error_margin, convert):
+        """
+        Reduce a window of frames to a single frame.
+
+        If at least half the frames are good, the result is the newest frame with its distance replaced by the median
+        of the good frames. Otherwise, it's the newest frame that wasn't good, so its status is reported.
+
+        :param window: Unconverted frames, oldest first.
+        :type window: collections.deque
+        :param error_margin: Distance from the median, in cm, that a frame can be and still agree with it.
+        :type error_margin: float
+        :param convert: Method to convert the resulting frame.
+        :type convert: method
+        :return: tuple of (TFMPData, confidence as a fraction of good frames that agree with the median, good frames used)
+        """
+        distances = [frame.distance for frame in window if frame.status == "OK"]
+        if len(distances) * 2 < len(window):
+            failed = next(frame for frame in reversed(window) if frame.status != "OK")
+            return convert(failed), None, len(distances)
+        middle = median(distances)
+        agree = sum(1 for distance in distances if abs(distance - middle) <= error_margin)
+        result = window[-1]._replace(status="OK", distance=middle)
+        return convert(result), agree / len(distances), len(distances)
 
     # State of the sensor.
     @property
@@ -201,14 +353,22 @@ class TFMini(SerialSensor):
         """
         Set the status of the TFMini Sensor.
 
-        The TFMini always ranges when it's powered on, thus any input is ignored. The sensor will always range.
+        The TFMini always ranges when it's powered on, thus any input is ignored. The sensor will always range. When
+        using the background reader, disabling stops the reader thread and any other status restarts it.
         :param target_status:
         :return:
         """
-        pass
+        if self._read_mode == 'thread':
+            if target_status == cobrabay.const.SENSTATE_DISABLED:
+                self._sensor_obj.stop_reader()
+            else:
+                self._sensor_obj.start_reader(ring_size=self._ring_size)
 
     @property
     def timing_budget(self):
-        # The TFMini's default update rate is 100 Hz. 1s = 1000000000 ns / 100 = 10000000 ns.
-        # This is static and assuming it hasn't been changed, so return it.
-        return Quantity('10000000 ns')
+        # Time between frames at the current frame rate. In trigger mode, a measurement takes about as long as a
+        # frame at the default 100 Hz.
+        frame_rate = self._sensor_obj.frame_rate
+        if not frame_rate:
+            frame_rate = 100
+        return Quantity(1000000000 // frame_rate, 'ns')
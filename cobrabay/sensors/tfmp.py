@@ -4,11 +4,23 @@
 #
 
 import importlib
+import math
+import select
+import threading
 import time
+from collections import deque
 import pint
 import serial
 from cobrabay.datatypes import TFMPData
 
+
+class TFMPTimeout(serial.SerialTimeoutException):
+    """
+    The sensor didn't return a valid frame before the read deadline.
+    """
+    pass
+
+
 class TFMP:
     ####
     # Class Constants
@@ -18,6 +30,13 @@ class TFMP:
     TFMP_FRAME_SIZE = 9  # Size of one data frame = 9 bytes
     TFMP_COMMAND_MAX = 8  # Longest command = 8 bytes
     TFMP_REPLY_SIZE = 8  # Longest command reply = 8 bytes
+    TFMP_BUFFER_MAX = 4096  # Most unparsed bytes to hold onto between reads.
+    TFMP_RING_SIZE = 1000  # Default number of frames kept by the background reader. 1s at 1000Hz.
+    TFMP_READER_WAIT = 0.1  # Longest the background reader blocks on the port, in seconds.
+    TFMP_READ_TIMEOUT = 500  # Default deadline for a frame or command reply, in milliseconds.
+
+    # Header for data frames.
+    TFMP_FRAME_HEADER = b'\x59\x59'
 
     # Timeout Limits for various functions
     TFMP_MAX_READS = 20  # readData() sets SERIAL error
@@ -92,13 +111,35 @@ class TFMP:
     FRAME_250 = 0x00FA
     FRAME_500 = 0x01F4
     FRAME_1000 = 0x03E8
+    FRAME_RATES = (0, 1, 2, 5, 10, 20, 25, 50, 100, 125, 200, 250, 500, 1000)
 
-    def __init__(self,serial_port="/dev/serial0", baud_rate=115200, unit_system='metric'):
+    def __init__(self,serial_port="/dev/serial0", baud_rate=115200, unit_system='metric', read_timeout=None):
         # Initialize variables.
         self._data_stream = None
+        self._frame_rate = None  # Unknown until set.
+        self._poller = None
+        # Bytes read from the port but not yet consumed as a frame.
+        self._rx_buffer = bytearray()
+        # Frame counters. Useful for diagnosing a noisy line.
+        self._frame_stats = {'frames': 0, 'dropped': 0, 'checksum_errors': 0}
+        # Background reader.
+        self._reader_thread = None
+        self._reader_terminate = False
+        self._reader_error = None  # Exception that stopped the background reader, if one did.
+        self._ring = None
+        self._ring_lock = threading.Lock()
+        # Commands take the port from the reader. The reader only reads while the port lock is free of a command, and
+        # a command waiting for the lock stops the reader from taking it again.
+        self._port_lock = threading.Lock()
+        self._port_free = threading.Event()
+        self._port_free.set()
         # Store the inputs as internal variables.
         self._serial_port = serial_port
         self._baud_rate = baud_rate
+        if read_timeout is None:
+            read_timeout = self.TFMP_READ_TIMEOUT
+        self._base_read_timeout = read_timeout
+        self._read_timeout = read_timeout
         # If pint is installed, use Quantities
         try:
             importlib.import_module("pint")
@@ -114,9 +155,161 @@ class TFMP:
         # Great, good to go!
 
     # Core data fetcher.
-    def data(self):
-        frames = self._read_frames(self.TFMP_FRAME_SIZE)
+    def data(self, timeout=None, convert=True):
+        """
+        Read the newest frame from the sensor.
+
+        :param timeout: Deadline for the frame, in milliseconds. Defaults to the read timeout.
+        :type timeout: int
+        :param convert: Convert to the current unit system. If False, distance is in centimeters and temperature in
+        Celsius.
+        :type convert: bool
+        :return: TFMPData
+        """
+        # The background reader owns the port while it's running, so hand back its newest frame.
+        if self.reader_running:
+            return self.latest()
+        # With a frame rate of zero, the sensor only measures when asked.
+        if self._frame_rate == 0:
+            self._send_cmd(self.TRIGGER_DETECTION, 0)
+        frames = self._read_frames(self.TFMP_FRAME_SIZE, timeout=timeout)
+        return self._decode(frames, timestamp=time.monotonic_ns(), convert=convert)
+
+    def set_frame_rate(self, frame_rate):
+        """
+        Set the rate the sensor streams frames at. A rate of 0 stops streaming, and data() will trigger a single
+        measurement on each call instead.
+
+        The read deadline is stretched if needed so it always covers several frame intervals.
+
+        :param frame_rate: Frames per second. Must be one of FRAME_RATES.
+        :type frame_rate: int
+        :return: bool
+        """
+        if frame_rate not in self.FRAME_RATES:
+            raise ValueError("Frame rate {} not valid. Must be one of: {}".format(frame_rate, self.FRAME_RATES))
+        # If the background reader is running it will eat the reply, so don't wait for one.
+        result = self._send_cmd(self.SET_FRAME_RATE, frame_rate, wait_reply=not self.reader_running)
+        self._frame_rate = frame_rate
+        if frame_rate > 0:
+            self._read_timeout = max(self._base_read_timeout, math.ceil(3000 / frame_rate))
+        else:
+            self._read_timeout = self._base_read_timeout
+        return result
+
+    @property
+    def frame_rate(self):
+        """
+        Frame rate last set on the sensor, or None if it hasn't been set.
+
+        :return: int
+        """
+        return self._frame_rate
+
+    def start_reader(self, ring_size=None):
+        """
+        Start a background thread to drain the serial port into a ring of decoded frames.
+
+        Once running, use latest() and history() to get frames rather than data().
+
+        :param ring_size: Number of frames to keep. Defaults to TFMP_RING_SIZE.
+        :type ring_size: int
+        :return: bool
+        """
+        if self.reader_running:
+            return False
+        if ring_size is None:
+            ring_size = self.TFMP_RING_SIZE
+        self._ring = deque(maxlen=ring_size)
+        self._reader_terminate = False
+        self._reader_error = None
+        self._reader_thread = threading.Thread(target=self._reader_main, name="tfmp-{}".format(self._serial_port))
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
+        return True
+
+    def stop_reader(self):
+        """
+        Stop the background reader thread.
+
+        :return: bool
+        """
+        if self._reader_thread is None:
+            return False
+        self._reader_terminate = True
+        if threading.current_thread() != self._reader_thread:
+            self._reader_thread.join()
+        self._reader_thread = None
+        return True
+
+    @property
+    def reader_running(self):
+        """
+        Is the background reader running?
+
+        :return: bool
+        """
+        return self._reader_thread is not None and self._reader_thread.is_alive()
+
+    @property
+    def reader_error(self):
+        """
+        Exception that stopped the background reader, such as the port going away.
+
+        :return: Exception or None if the reader hasn't failed.
+        """
+        return self._reader_error
+
+    def latest(self):
+        """
+        Newest frame from the background reader, converted to the current unit system.
 
+        :return: TFMPData or None if no frame has been received.
+        """
+        try:
+            frame = self._ring[-1]
+        except (IndexError, TypeError):
+            return None
+        return self.convert(frame)
+
+    def history(self, since=None):
+        """
+        Frames held by the background reader, oldest first. These are not converted, distance is in centimeters and
+        temperature in Celsius.
+
+        :param since: Only return frames with a timestamp after this time, in monotonic nanoseconds.
+        :type since: int
+        :return: list
+        """
+        if self._ring is None:
+            return []
+        with self._ring_lock:
+            if since is None:
+                return list(self._ring)
+            # Walk back from the newest, so only the new frames are touched.
+            frames = []
+            for frame in reversed(self._ring):
+                if frame.timestamp <= since:
+                    break
+                frames.append(frame)
+        frames.reverse()
+        return frames
+
+    # Frame counters.
+    @property
+    def frame_stats(self):
+        """
+        Counters for frames handled by the reader.
+
+        'frames' is the number of valid frames returned, 'dropped' the number of older, valid-looking frames discarded
+        in favor of a newer one, and 'checksum_errors' the number of candidate frames rejected on checksum.
+
+        :return: dict
+        """
+        return dict(self._frame_stats)
+
+    # Convert a raw data frame into a TFMPData object.
+    def _decode(self, frames, timestamp=None, convert=True):
         # Convert up the values from the raw bytes.
         dist = (frames[3] * 256) + frames[2]
         flux = (frames[5] * 256) + frames[4]
@@ -133,71 +326,85 @@ class TFMP:
         else:
             status = "OK"
 
-        # If we're using pint Quantities, wrap as quantities.
-        if self._use_pint:
-            if status == "OK":
-                dist = pint.Quantity(dist,"cm").to(self._unit_length)
-            temp = pint.Quantity(temp, "celsius").to(self._unit_temp)
-        return_data = TFMPData(status, dist, flux, temp)
+        return_data = TFMPData(status, dist, flux, temp, timestamp)
+        if convert:
+            return_data = self.convert(return_data)
         return return_data
 
+    def convert(self, tfmp_data):
+        """
+        Convert an unconverted frame to the current unit system. If pint isn't available, returns it unchanged.
+
+        :param tfmp_data: Frame with distance in centimeters and temperature in Celsius.
+        :type tfmp_data: TFMPData
+        :return: TFMPData
+        """
+        if not self._use_pint:
+            return tfmp_data
+        if tfmp_data.status == "OK":
+            tfmp_data = tfmp_data._replace(distance=pint.Quantity(tfmp_data.distance, "cm").to(self._unit_length))
+        return tfmp_data._replace(temperature=pint.Quantity(tfmp_data.temperature, "celsius").to(self._unit_temp))
+
     # Core command sender. This will send commands and process returns. Commands are then exposed through public
     # methods.
-    def _send_cmd(self, command, parameter):
-        # Create command data four-byte array
-        # Consists of reply length, command length, command data, and one-byte parameter.
-        command_data = bytearray(command.to_bytes(self.TFMP_COMMAND_MAX, byteorder='little'))
-        print("Initial command data: {}".format(command_data))
-        # Pull out the first two bytes to use later.
-        reply_length = command_data[0]
-        command_length = command_data[1]
-        print("Reply length: {}".format(reply_length))
-        print("Command length: {}".format(command_length))
-        command_data[0] = 0x5A     # Add the header at the beginning
-
-        # A couple commands have multi-byte parameters, so adjust for that if need be.
-        if  command == self.SET_FRAME_RATE:
-            command_data[3:2] = parameter.to_bytes(2, byteorder='little')
-        elif command == self.SET_BAUD_RATE:
-            command_data[3:3] = parameter.to_bytes(3, byteorder='little')
-
-        # Calculate a checksum value for everything.
-        checksum = 0
-        for i in range(command_length - 1):
-            checksum += command_data[i]
-        # Add the checksum in the final slot in the command
-        command_data[command_length - 1] = (checksum & 0xFF)
-
-
-        # Send the command
-        print("Sending Command: b{}".format(command_data))
-        # Flush out the serial buffers.
-        self._data_stream.reset_input_buffer()
-        self._data_stream.reset_output_buffer()
-        # Send the command out.
-        self._data_stream.write(command_data)
-
-        # If no reply is expected, return true and done.
-        if reply_length == 0:
-            return True
+    def _send_cmd(self, command, parameter, wait_reply=True):
+        command_data, reply_length = self._build_cmd(command, parameter)
 
-        # Get reply.
+        # Pause the background reader, if it's running, so it isn't reading the port while it's flushed.
+        self._port_free.clear()
         try:
-            reply = self._read_frames_cmd(reply_length)
-        except IOError:
-            # Failed checksum raises IO error, pass it on.
-            raise
+            with self._port_lock:
+                # Flush out the serial buffers.
+                self._data_stream.reset_input_buffer()
+                self._data_stream.reset_output_buffer()
+                self._rx_buffer.clear()
+                # Send the command out.
+                self._data_stream.write(command_data)
+
+                # If no reply is expected, or we've been told not to wait for it, return true and done.
+                if reply_length == 0 or not wait_reply:
+                    return True
+
+                # Get reply.
+                try:
+                    reply = self._read_frames_cmd(reply_length)
+                except IOError:
+                    # Failed checksum raises IO error, pass it on.
+                    raise
+        finally:
+            self._port_free.set()
 
         # Properly interpret the results.
         if command == self.GET_FIRMWARE_VERSION:
             return "{}.{}.{}".format(reply[5],reply[4],reply[3])
+        elif command in (self.SOFT_RESET, self.HARD_RESET, self.SAVE_SETTINGS):
+            if reply[3] == 1:
+                return False
+            else:
+                return True
         else:
-            if command in (self.SOFT_RESET, self.HARD_RESET, self.SAVE_SETTINGS):
-                if reply[3] == 1:
-                    return False
-                else:
-                    return True
+            # Everything else echoes the command back.
+            return True
+
+    # Assemble the bytes for a command.
+    @classmethod
+    def _build_cmd(cls, command, parameter):
+        # Command codes pack the reply length, command length, command number and a one-byte parameter.
+        command_data = bytearray(command.to_bytes(cls.TFMP_COMMAND_MAX, byteorder='little'))
+        # Pull out the first two bytes to use later.
+        reply_length = command_data[0]
+        command_length = command_data[1]
+        command_data[0] = 0x5A     # Add the header at the beginning
 
+        # A couple commands have multi-byte parameters, so adjust for that if need be.
+        if command == cls.SET_FRAME_RATE:
+            command_data[3:5] = parameter.to_bytes(2, byteorder='little')
+        elif command == cls.SET_BAUD_RATE:
+            command_data[3:6] = parameter.to_bytes(3, byteorder='little')
+
+        # Add the checksum of everything else in the final slot in the command
+        command_data[command_length - 1] = sum(command_data[:command_length - 1]) & 0xFF
+        return bytes(command_data[:command_length]), reply_length
 
     # Current unit system.
     @property
@@ -228,98 +435,193 @@ class TFMP:
                 self._baud_rate,
                 bytesize=8,
                 parity=serial.PARITY_NONE,
-                stopbits=1)
+                stopbits=1,
+                timeout=self.TFMP_READER_WAIT)
         else:
             # Otherwise, just open it again.
             self._data_stream.open()
+        # Poll the port's descriptor so reads can sleep until data arrives.
+        self._poller = select.poll()
+        self._poller.register(self._data_stream.fileno(), select.POLLIN)
 
     def _close(self):
         self._data_stream.close()
 
     # Method to read frames from the serial port. Used by both the data method and the command method.
-    def _read_frames(self, length, timeout = 1000):
-        #print("Reading TFMP frames...")
-        serial_timeout = time.time() + timeout
-        #  Flush all but last frame of data from the serial buffer.
-        #print("Resetting serial input buffer...")
-        ts = time.monotonic_ns()
-        while self._data_stream.inWaiting() > self.TFMP_FRAME_SIZE:
-            self._data_stream.reset_input_buffer()
-        end = time.monotonic_ns() - ts
-        #print("Serial input buffer reset in {}ms...".format(end/1000000))
-        # Reads data byte by byte from the serial buffer checking for the two header bytes.
-        frames = bytearray(length)  # 'frame' data buffer
-        while (frames[0] != 0x59) or (frames[1] != 0x59):
-            if self._data_stream.inWaiting():
-                #  Read 1 byte into the 'frame' plus one position.
-                next_byte = self._data_stream.read()[0]
-                #print("{}".format(hex(next_byte)), end=" ")
-                # frames.append(self._data_stream.read()[0])
-                frames.append(next_byte)
-                #  Shift entire length of 'frame' one byte left.
-                frames = frames[1:]
-            #  If no HEADER or serial data not available
-            #  after more than one second...
-            if time.time() > serial_timeout:
-                raise serial.SerialTimeoutException("Sensor did not return header or serial data within one second.")
-        #print("")
-        # If we haven't raised an exception, checksum the data.
-        if not self._checksum(frames):
-            raise IOError("Sensor checksum error")
-        else:
-            return frames
+    def _read_frames(self, length, timeout=None):
+        return self._wait_frame(self.TFMP_FRAME_HEADER, length, timeout)
 
-    def _read_frames_cmd(self, length, timeout = 1000):
+    def _read_frames_cmd(self, length, timeout=None):
         '''
         Method to read frames for a command response.
 
-        :param length:
-        :param timeout:
-        :return:
+        :param length: Length of the reply.
+        :type length: int
+        :param timeout: Deadline for the reply, in milliseconds. Defaults to the read timeout.
+        :type timeout: int
+        :return: bytes
         '''
-        serial_timeout = time.time() + timeout
-        #  Flush all but last frame of data from the serial buffer.
-        while self._data_stream.inWaiting() > self.TFMP_FRAME_SIZE:
-            self._data_stream.read()
-        # Reads data byte by byte from the serial buffer checking for the two header bytes.
-        frames = bytearray(length)  # 'frame' data buffer
         # Command replies should be '0x5A <RESPONSE LENGTH>'
-        print("Reading stream for reply header: 0x51 {}".format(length))
-        while (frames[0] != 0x5A) or (frames[1] != length):
-            if self._data_stream.inWaiting():
-                #  Read 1 byte into the 'frame' plus one position.
-                frames.append(self._data_stream.read()[0])
-                #  Shift entire length of 'frame' one byte left.
-                frames = frames[1:]
-                frame_string = ", ".join(hex(b) for b in frames)
-                print("Have frames: {}".format(frame_string))
-            #  If no HEADER or serial data not available after timeout interval.
-            if time.time() > serial_timeout:
-                print("\n")
-                raise serial.SerialTimeoutException("Sensor did not return header or serial data within one second.")
-        print("\nComplete. Have byte array:\n{}\nChecksumming data.".format(frames))
-
-        # If we haven't raised an exception, checksum the data.
-        if not self._checksum(frames):
-            raise IOError("Sensor checksum error")
-        else:
-            return frames
+        return self._wait_frame(bytes((0x5A, length)), length, timeout)
+
+    def _wait_frame(self, header, length, timeout=None):
+        '''
+        Wait for a valid frame, sleeping on the port until data arrives rather than spinning.
+
+        :param header: Header bytes that start the frame.
+        :type header: bytes
+        :param length: Total length of the frame, including header and checksum.
+        :type length: int
+        :param timeout: Deadline for the frame, in milliseconds. Defaults to the read timeout.
+        :type timeout: int
+        :return: bytes
+        :raises TFMPTimeout: if no valid frame arrives before the deadline.
+        '''
+        if timeout is None:
+            timeout = self._read_timeout
+        deadline = time.monotonic_ns() + timeout * 1000000
+        frames = self._take_frame(header, length)
+        while frames is None:
+            remaining = deadline - time.monotonic_ns()
+            if remaining <= 0:
+                raise TFMPTimeout("Sensor did not return a valid frame within {} ms.".format(timeout))
+            # Block until the port is readable or the deadline passes.
+            self._poller.poll(math.ceil(remaining / 1000000))
+            frames = self._take_frame(header, length)
+        return frames
+
+    def _take_frame(self, header, length):
+        '''
+        Pull everything waiting on the port and take the newest valid frame from it.
+
+        Older frames are discarded and counted as dropped. Only bytes after the returned frame that may be the start of a
+        frame still arriving are kept for the next call, so no frame is checked twice.
+
+        :param header: Header bytes that start the frame.
+        :type header: bytes
+        :param length: Total length of the frame, including header and checksum.
+        :type length: int
+        :return: bytes or None
+        '''
+        waiting = self._data_stream.in_waiting
+        if waiting:
+            self._rx_buffer += self._data_stream.read(waiting)
+        frame, position, rejected = self._find_frame(self._rx_buffer, header, length)
+        self._frame_stats['checksum_errors'] += rejected
+        if frame is None:
+            # Nothing valid. Keep only the tail, which may be the start of a frame still arriving. Anything before it
+            # has already been checked, so it can go.
+            del self._rx_buffer[:-(length - 1)]
+            return None
+        self._frame_stats['frames'] += 1
+        self._frame_stats['dropped'] += position // length
+        # Headers after the frame with a full frame behind them were checked and rejected on the way back, so they go
+        # too. Only the tail too short to have been checked is kept.
+        del self._rx_buffer[:max(position + length, len(self._rx_buffer) - length + 1)]
+        # Don't let a stalled consumer grow the buffer without bound.
+        if len(self._rx_buffer) > self.TFMP_BUFFER_MAX:
+            del self._rx_buffer[:-self.TFMP_BUFFER_MAX]
+        return frame
+
+    # Background reader loop. Blocks on the port, decodes everything that arrives and adds it to the ring. If the port
+    # fails, the error is kept for reader_error and the thread stops, so callers can see it rather than just getting no
+    # new frames.
+    def _reader_main(self):
+        buffer = bytearray()
+        try:
+            while not self._reader_terminate:
+                # Stay off the port while a command is being sent.
+                self._port_free.wait()
+                with self._port_lock:
+                    # Blocks until at least one byte arrives, or the port timeout lapses.
+                    chunk = self._data_stream.read(max(1, self._data_stream.in_waiting))
+                if not chunk:
+                    continue
+                timestamp = time.monotonic_ns()
+                buffer += chunk
+                frames, consumed, rejected = self._split_frames(buffer, self.TFMP_FRAME_HEADER, self.TFMP_FRAME_SIZE)
+                del buffer[:consumed]
+                self._frame_stats['checksum_errors'] += rejected
+                if frames:
+                    self._frame_stats['frames'] += len(frames)
+                    decoded = [self._decode(frame, timestamp=timestamp, convert=False) for frame in frames]
+                    with self._ring_lock:
+                        self._ring.extend(decoded)
+        except (serial.SerialException, OSError) as e:
+            self._reader_error = e
 
     # Destructor.
     def __del__(self):
+        if self._reader_thread is not None:
+            self.stop_reader()
         if self._data_stream is not None:
             self._data_stream.close()
 
     # Utility method to calculate checksums.
     @staticmethod
     def _checksum(frames):
-        # Checksum starts at 0.
-        chksum = 0
-        #  Add together all bytes but the last.
-        for i in range(len(frames) - 1):
-            chksum += frames[i]
-        #   If the low order byte does not equal the last byte...
-        if (chksum & 0xFF) == frames[len(frames) - 1]:
-            return True
+        # Low order byte of the sum of all bytes but the last must equal the last byte.
+        return (sum(frames[:-1]) & 0xFF) == frames[-1]
+
+    @staticmethod
+    def _find_frame(buffer, header, length):
+        """
+        Find the newest complete frame with a valid checksum in a buffer.
+
+        Searches backwards from the end of the buffer for the header, so the most recent frame is found without walking
+        every byte.
+
+        :param buffer: Bytes to search.
+        :type buffer: bytes or bytearray
+        :param header: Header bytes that start the frame.
+        :type header: bytes
+        :param length: Total length of the frame, including header and checksum.
+        :type length: int
+        :return: tuple of (frame bytes or None, position of the frame in the buffer, count of checksum failures)
+        """
+        view = memoryview(buffer)
+        rejected = 0
+        # Only consider headers with a full frame behind them.
+        position = buffer.rfind(header, 0, len(buffer) - length + len(header))
+        while position >= 0:
+            frame = view[position:position + length]
+            if (sum(frame[:-1]) & 0xFF) == frame[-1]:
+                return bytes(frame), position, rejected
+            rejected += 1
+            position = buffer.rfind(header, 0, position + len(header) - 1)
+        return None, -1, rejected
+
+    @staticmethod
+    def _split_frames(buffer, header, length):
+        """
+        Find all complete frames with valid checksums in a buffer, oldest first.
+
+        :param buffer: Bytes to search.
+        :type buffer: bytes or bytearray
+        :param header: Header bytes that start the frame.
+        :type header: bytes
+        :param length: Total length of the frame, including header and checksum.
+        :type length: int
+        :return: tuple of (list of frame bytes, number of bytes consumed from the buffer, count of checksum failures)
+        """
+        view = memoryview(buffer)
+        frames = []
+        rejected = 0
+        consumed = 0
+        position = buffer.find(header)
+        while 0 <= position <= len(buffer) - length:
+            frame = view[position:position + length]
+            if (sum(frame[:-1]) & 0xFF) == frame[-1]:
+                frames.append(bytes(frame))
+                consumed = position + length
+                position = buffer.find(header, consumed)
+            else:
+                rejected += 1
+                position = buffer.find(header, position + 1)
+        if position >= 0:
+            # Keep the incomplete frame at the end for next time.
+            consumed = max(consumed, position)
         else:
-            return False
\ No newline at end of file
+            # Keep enough of the tail that a split header isn't lost.
+            consumed = max(consumed, len(buffer) - len(header) + 1)
+        return frames, consumed, rejected
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+Cobrabay Compositor Benchmark
+"""
+
+import argparse
+import importlib.resources
+import time
+import tracemalloc
+import cobrabay
+from PIL import Image, ImageDraw, ImageFont
+from cobrabay.compositor import CBCompositor, CBSprite
+
+
+def compositebenchcli():
+    """
+    Compositor Benchmark Command Line Invoker
+    """
+    print("Cobrabay Compositor Benchmark - {}".format(cobrabay.__version__))
+
+    # Parse command line options.
+    parser = argparse.ArgumentParser(
+        description="Compare building motion frames with chained Image.alpha_composite and with the compositor."
+    )
+    parser.add_argument("-W", "--width", type=int, default=64, help="Matrix width, in pixels.")
+    parser.add_argument("-H", "--height", type=int, default=32, help="Matrix height, in pixels.")
+    parser.add_argument("-l", "--laterals", type=int, default=3, help="Number of lateral sensors.")
+    parser.add_argument("-f", "--frames", type=int, default=2000, help="Frames to build with each method.")
+    args = parser.parse_args()
+
+    layers = _make_layers(args.width, args.height, args.laterals)
+    sprites = [CBSprite.from_image(layer) for layer in layers]
+    compositor = CBCompositor(args.width, args.height)
+
+    def frame_pil():
+        final_image = Image.new("RGBA", (args.width, args.height), (0, 0, 0, 255))
+        for layer in layers:
+            final_image = Image.alpha_composite(final_image, layer)
+        return final_image
+
+    def frame_compositor():
+        compositor.clear()
+        for sprite in sprites:
+            compositor.blit(sprite)
+        return compositor.image
+
+    # Make sure the two agree before timing them.
+    difference = max(abs(a - b) for a, b in zip(frame_pil().convert('RGB').tobytes(),
+                                                   frame_compositor().convert('RGB').tobytes()))
+    print("Largest difference between methods: {} levels".format(difference))
+    layer_bytes = sum(len(layer.tobytes()) for layer in layers)
+    sprite_bytes = sum(sprite.nbytes for sprite in sprites)
+    print("Layer memory: {} bytes as full images, {} bytes as sprites".format(layer_bytes, sprite_bytes))
+    for name, method in (('alpha_composite', frame_pil), ('compositor', frame_compositor)):
+        per_frame, allocated = _time(method, args.frames)
+        print("{:16} {:8.1f} us/frame, {:8.0f} bytes allocated/frame".format(name, per_frame * 1e6, allocated))
+    # Pillow allocates image memory itself, where tracemalloc can't see it, so count it up.
+    print("alpha_composite also allocates {} bytes/frame of image memory that isn't traced.".format(
+        (len(layers) + 1) * args.width * args.height * 4))
+
+
+def _make_layers(width, height, laterals):
+    """
+    Layers like those of a motion frame. A range placard, a progress bar and a bar for each lateral sensor on each
+    side.
+    """
+    font = ImageFont.truetype(str(importlib.resources.files('cobrabay.data').joinpath('OpenSans-Light.ttf')),
+                              size=height // 2)
+    layers = []
+    img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text((width / 2, (height - 4) / 2), "12'3\"", fill=(0, 128, 0), font=font, anchor="mm")
+    layers.append(img)
+    img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, width - 1, height - 1), outline='white', width=1)
+    draw.line((1, height - 2, width // 2, height - 2), fill='green', width=1)
+    layers.append(img)
+    bar_height = (height - 6) // max(laterals, 1)
+    for i in range(laterals):
+        for x in (0, width - 3):
+            img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+            ImageDraw.Draw(img).rectangle([x, 1 + i * bar_height, x + 2, (i + 1) * bar_height],
+                                          fill=(255, 255, 0, 255), outline=(255, 255, 0, 255), width=1)
+            layers.append(img)
+    return layers
+
+
+def _time(method, frames):
+    """
+    Time a frame building method, and measure the memory it allocates.
+
+    :return: tuple of seconds per frame and bytes allocated per frame.
+    """
+    method()
+    start = time.perf_counter()
+    for _ in range(frames):
+        method()
+    per_frame = (time.perf_counter() - start) / frames
+    # Allocations are measured separately, since tracing slows everything down.
+    tracemalloc.start()
+    for _ in range(100):
+        method()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_frame, peak
+
+
+if __name__ == "__main__":
+    compositebenchcli()
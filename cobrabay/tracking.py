@@ -0,0 +1,118 @@
+"""
+Cobra Bay - Tracking
+
+Filters to smooth range readings and estimate where the vehicle is between them.
+"""
+
+
+class CBRangeTracker:
+    """
+    Alpha-beta tracker for one range sensor. Each reading corrects a constant velocity estimate of the range, so the
+    range can be smoothed and projected forward to the time it's used. Updates are constant time.
+    """
+
+    def __init__(self, alpha=0.5, beta=0.1, max_gap=1.0):
+        """
+        :param alpha: Weight given to each reading when correcting the range, from 0 to 1. Higher follows readings more
+        closely, lower smooths more.
+        :type alpha: float
+        :param beta: Weight given to each reading when correcting the velocity, from 0 to 2. Higher reacts faster to
+        changes in speed.
+        :type beta: float
+        :param max_gap: Restart the track if readings are further apart than this, in seconds.
+        :type max_gap: float
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError("Alpha must be greater than 0 and at most 1.")
+        if not 0 <= beta < 2:
+            raise ValueError("Beta must be at least 0 and less than 2.")
+        self._alpha = alpha
+        self._beta = beta
+        self._max_gap = max_gap
+        self._range = None  # Estimated range at the last reading, in mm.
+        self._velocity = 0.0  # Estimated rate of change of range, in mm/s.
+        self._timestamp = None  # Time of the last reading, in ns since the epoch.
+        self._error = None  # Difference between the last reading and its prediction, in mm.
+        self._error_ms = None  # Exponentially weighted mean of the squared prediction error.
+
+    # Public Methods
+    def predict(self, timestamp):
+        """
+        Estimated range at a given time. Projection stops at the maximum gap after the last reading.
+
+        :param timestamp: Time to estimate for, in ns since the epoch.
+        :type timestamp: int
+        :return: float, range in mm, or None if there's no track.
+        """
+        if self._range is None:
+            return None
+        dt = min((timestamp - self._timestamp) / 1e9, self._max_gap)
+        return self._range + self._velocity * dt
+
+    def reset(self):
+        """
+        Drop the track. The next reading starts a new one.
+        """
+        self._range = None
+        self._velocity = 0.0
+        self._timestamp = None
+        self._error = None
+        self._error_ms = None
+
+    def update(self, timestamp, range_mm):
+        """
+        Correct the track with a new reading. Readings no newer than the last are ignored.
+
+        :param timestamp: Time of the reading, in ns since the epoch.
+        :type timestamp: int
+        :param range_mm: Measured range, in mm.
+        :type range_mm: float
+        :return: bool, True if the reading was used.
+        """
+        if self._timestamp is not None and timestamp <= self._timestamp:
+            return False
+        if self._range is None or (timestamp - self._timestamp) / 1e9 > self._max_gap:
+            self.reset()
+            self._range = range_mm
+            self._timestamp = timestamp
+            return True
+        dt = (timestamp - self._timestamp) / 1e9
+        predicted = self._range + self._velocity * dt
+        error = range_mm - predicted
+        self._range = predicted + self._alpha * error
+        self._velocity += self._beta * error / dt
+        self._timestamp = timestamp
+        self._error = error
+        if self._error_ms is None:
+            self._error_ms = error ** 2
+        else:
+            self._error_ms += 0.1 * (error ** 2 - self._error_ms)
+        return True
+
+    # Public Properties
+    @property
+    def error(self):
+        """ Difference between the last reading and its prediction, in mm. None until the track has two readings. """
+        return self._error
+
+    @property
+    def error_rms(self):
+        """ Running RMS of the prediction error, in mm. None until the track has two readings. """
+        if self._error_ms is None:
+            return None
+        return self._error_ms ** 0.5
+
+    @property
+    def range(self):
+        """ Estimated range at the last reading, in mm. None if there's no track. """
+        return self._range
+
+    @property
+    def timestamp(self):
+        """ Time of the last reading, in ns since the epoch. """
+        return self._timestamp
+
+    @property
+    def velocity(self):
+        """ Estimated rate of change of the range, in mm/s. """
+        return self._velocity
@@ -0,0 +1,81 @@
+"""
+Cobra Bay tests for bays
+"""
+
+import pytest
+from types import SimpleNamespace
+from numpy import datetime64
+from pint import Quantity
+import cobrabay
+from cobrabay.const import GEN_UNKNOWN, SENSOR_QUALITY_CRIT, SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN, \
+    SENSOR_RESP_INR, SENSOR_RESP_OK, SENSTATE_RANGING
+from cobrabay.datatypes import SensorReading, SensorResponse
+
+BASE_NS = 1700000000000000000
+
+lateral_ranges = {
+    SENSOR_QUALITY_OK: [Quantity('20 cm'), Quantity('40 cm')],
+    SENSOR_QUALITY_WARN: [Quantity('10 cm'), Quantity('50 cm')],
+    SENSOR_QUALITY_CRIT: [Quantity('-1 km'), Quantity('1 km')]
+}
+
+
+def test_bay_compile_quality_ranges():
+    """ Overlapping ranges compile to intervals labeled by the first quality that covers them."""
+    bounds, labels = cobrabay.CBBay._compile_quality_ranges(
+        lateral_ranges, (SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN, SENSOR_QUALITY_CRIT))
+    assert bounds == [-1000000, 100, 200, 400, 500, 1000000]
+    assert labels == [SENSOR_QUALITY_CRIT, SENSOR_QUALITY_WARN, SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN,
+                      SENSOR_QUALITY_CRIT]
+
+
+def test_bay_compile_quality_ranges_gap():
+    """ Intervals not covered by any quality are unknown."""
+    bounds, labels = cobrabay.CBBay._compile_quality_ranges(
+        {SENSOR_QUALITY_OK: [Quantity('0 cm'), Quantity('1 cm')],
+         SENSOR_QUALITY_WARN: [Quantity('2 cm'), Quantity('3 cm')]},
+        (SENSOR_QUALITY_OK, SENSOR_QUALITY_WARN))
+    assert bounds == pytest.approx([0, 10, 20, 30])
+    assert labels == [SENSOR_QUALITY_OK, GEN_UNKNOWN, SENSOR_QUALITY_WARN]
+
+
+def make_bay():
+    """ A bay with one range sensor and one lateral, reading from its own sensor history."""
+    history = cobrabay.CBSensorHistory(['range', 'lat'])
+    longitudinal = {
+        'defaults': {'spread_park': Quantity('2 in'), 'zero_point': Quantity('30 cm'), 'pct_warn': 0.3,
+                     'pct_crit': 0.1},
+        'sensors': [{'name': 'range'}]}
+    lateral = {
+        'defaults': {'zero_point': Quantity('50 cm'), 'spread_ok': Quantity('5 cm'), 'spread_warn': Quantity('10 cm'),
+                     'limit': Quantity('200 cm'), 'side': 'L'},
+        'sensors': [{'name': 'lat', 'intercept': Quantity('100 cm')}]}
+    bay = cobrabay.CBBay('bay1', 'Bay 1', Quantity('500 cm'), longitudinal, lateral,
+                         SimpleNamespace(sensor_history=history), None,
+                         {'dock': Quantity('120 s'), 'undock': Quantity('120 s'), 'postroll': Quantity('10 s')})
+    return bay, history
+
+
+def make_scan(index, response_type, range_cm, lateral_cm):
+    """ Build a scan of both sensors, 100ms after the previous one."""
+    def reading(value):
+        return SensorReading(state=SENSTATE_RANGING, status=SENSTATE_RANGING, fault=False,
+                             response_type=response_type, range=Quantity(value, 'cm'), temp=None, fault_reason=None)
+    return SensorResponse(timestamp=datetime64(BASE_NS + index * 100000000, 'ns'),
+                          sensors={'range': reading(range_cm), 'lat': reading(lateral_cm)}, scan_time=0)
+
+
+def test_bay_inr_keeps_adjusted_reading():
+    """ A scan with no new reading keeps the last reading, still adjusted by the zero point."""
+    bay, history = make_bay()
+    history.append(make_scan(0, SENSOR_RESP_OK, 200, 52))
+    bay.update()
+    ok_readings = dict(bay._sensor_info['reading'])
+    ok_quality = dict(bay._sensor_info['quality'])
+    assert ok_readings['range'].m_as('cm') == pytest.approx(170)
+    assert ok_readings['lat'].m_as('cm') == pytest.approx(2)
+    history.append(make_scan(1, SENSOR_RESP_INR, 0, 0))
+    bay.update()
+    assert bay._sensor_info['reading']['range'].m_as('cm') == pytest.approx(170)
+    assert bay._sensor_info['reading']['lat'].m_as('cm') == pytest.approx(2)
+    assert bay._sensor_info['quality'] == ok_quality
@@ -0,0 +1,108 @@
+"""
+Cobra Bay tests for the compositor
+"""
+
+import importlib.resources
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+from cobrabay.compositor import CBCompositor, CBSprite
+
+WIDTH = 64
+HEIGHT = 32
+BACKGROUND = (40, 80, 120)
+FONT = str(importlib.resources.files('cobrabay.data').joinpath('OpenSans-Light.ttf'))
+
+
+def make_layer(kind):
+    """ Build a layer with transparent space around it, of each kind the compositor draws differently."""
+    layer = Image.new('RGBA', (WIDTH, HEIGHT), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(layer)
+    if kind == 'opaque':
+        draw.rectangle((10, 5, 30, 20), fill=(255, 128, 0, 255))
+    elif kind == 'masked':
+        draw.rectangle((10, 5, 30, 20), outline=(255, 128, 0, 255), width=2)
+    else:
+        # Half transparent shapes over each other, so pixels have a range of colors and alphas.
+        draw.rectangle((4, 4, 40, 28), fill=(200, 30, 90, 77))
+        draw.ellipse((20, 2, 60, 30), fill=(10, 250, 140, 190))
+    return layer
+
+
+def reference(*layers):
+    """ Composite layers over the background with PIL."""
+    frame = Image.new('RGBA', (WIDTH, HEIGHT), (*BACKGROUND, 255))
+    for layer in layers:
+        frame = Image.alpha_composite(frame, layer)
+    return np.asarray(frame.convert('RGB'), dtype=np.int16)
+
+
+def composite(*sprites):
+    """ Composite sprites over the background with the compositor."""
+    compositor = CBCompositor(WIDTH, HEIGHT)
+    compositor.clear()
+    compositor.fill(0, 0, WIDTH - 1, HEIGHT - 1, BACKGROUND)
+    for sprite in sprites:
+        compositor.blit(sprite)
+    return np.asarray(compositor.image.convert('RGB'), dtype=np.int16)
+
+
+@pytest.mark.parametrize('kind', ['opaque', 'masked', 'blended'])
+def test_compositor_matches_alpha_composite(kind):
+    """ Each kind of sprite draws the same as PIL's alpha_composite, allowing for premultiplying to bytes."""
+    layer = make_layer(kind)
+    sprite = CBSprite.from_image(layer)
+    assert (sprite.mask is not None) == (kind == 'masked')
+    assert (sprite.transmit is not None) == (kind == 'blended')
+    # Sprites are cropped to what they draw.
+    assert sprite.size[0] * sprite.size[1] < WIDTH * HEIGHT
+    tolerance = 1 if kind == 'blended' else 0
+    assert np.abs(composite(sprite) - reference(layer)).max() <= tolerance
+
+
+def test_compositor_stacked_layers():
+    """ Layers drawn over each other come out the same as PIL's."""
+    layers = [make_layer('blended'), make_layer('masked')]
+    assert np.abs(composite(*[CBSprite.from_image(layer) for layer in layers]) - reference(*layers)).max() <= 1
+
+
+@pytest.mark.parametrize('color', [(0, 128, 0), (255, 255, 0), (255, 0, 0)])
+def test_compositor_tinted(color):
+    """ Text kept as coverage and tinted draws exactly as the text in that color would."""
+    layer = Image.new('RGBA', (WIDTH, HEIGHT), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((32, 16), "8'2\"", fill=color, font=ImageFont.truetype(FONT, 14), anchor='mm')
+    coverage = CBSprite.from_alpha(layer)
+    sprite = coverage.tinted(color)
+    # The tinted sprite shares the coverage rather than copying it.
+    assert sprite.transmit is coverage.transmit
+    assert sprite.nbytes == coverage.nbytes == coverage.transmit.size
+    assert np.abs(composite(sprite) - reference(layer)).max() == 0
+
+
+def test_compositor_empty_layer():
+    """ A layer with nothing visible draws nothing."""
+    sprite = CBSprite.from_image(Image.new('RGBA', (WIDTH, HEIGHT), (0, 0, 0, 0)), offset=(3, 4))
+    assert sprite.size == (1, 1)
+    assert np.all(composite(sprite) == BACKGROUND)
+
+
+def test_compositor_fill():
+    """ Fills include both corners, and clearing goes back to black."""
+    compositor = CBCompositor(WIDTH, HEIGHT)
+    compositor.clear()
+    compositor.fill(2, 3, 5, 7, (255, 0, 0))
+    frame = np.asarray(compositor.image.convert('RGB'))
+    assert np.all(frame[3:8, 2:6] == (255, 0, 0))
+    assert frame[:, :, 0].sum() == 255 * 4 * 5
+    compositor.clear()
+    assert not np.asarray(compositor.image.convert('RGB')).any()
+
+
+def test_compositor_image_shares_buffer():
+    """ The frame image follows the buffer, without being made again."""
+    compositor = CBCompositor(WIDTH, HEIGHT)
+    image = compositor.image
+    compositor.clear()
+    compositor.fill(0, 0, 0, 0, (1, 2, 3))
+    assert compositor.image is image
+    assert image.convert('RGB').getpixel((0, 0)) == (1, 2, 3)
@@ -4,6 +4,8 @@ CobraBay tests for config
 
 import pytest
 from cobrabay.config import CBCoreConfig, CBValidator
+from cobrabay.config.schemas import CB_CORE, SCHEMA_SENSOR_VL53L1X
+from cobrabay.tracking import CBRangeTracker
 
 test_config_file = "./test_config.yaml"
 
@@ -12,4 +14,39 @@ def test_cbconfig_nofile():
         CBCoreConfig()
 
 def test_cbconfig_file():
-    CBCoreConfig(config_file=test_config_file)
\ No newline at end of file
+    CBCoreConfig(config_file=test_config_file)
+
+
+@pytest.mark.parametrize('alpha,beta,valid', [
+    (1, 0, True),
+    (0.001, 1.999, True),
+    (0, 0.1, False),
+    (0.5, 2, False)
+])
+def test_cbconfig_tracking_bounds(alpha, beta, valid):
+    """ Tracking settings the schema accepts are ones the tracker accepts, at both ends of their ranges."""
+    schema = CB_CORE['bays']['valuesrules']['schema']['longitudinal']['schema']
+    validator = CBValidator(schema)
+    document = {'defaults': {'tracking': True, 'tracking_alpha': alpha, 'tracking_beta': beta},
+                'sensors': [{'name': 'range', 'tracking_alpha': alpha, 'tracking_beta': beta}]}
+    assert validator.validate(document) == valid
+    if valid:
+        defaults = validator.document['defaults']
+        CBRangeTracker(alpha=defaults['tracking_alpha'], beta=defaults['tracking_beta'])
+    else:
+        with pytest.raises(ValueError):
+            CBRangeTracker(alpha=alpha, beta=beta)
+
+
+@pytest.mark.parametrize('interrupt,valid', [
+    ({}, True),
+    ({'interrupt_board': 0x58, 'interrupt_pin': 3}, True),
+    ({'interrupt_board': 0x58}, False),
+    ({'interrupt_pin': 3}, False)
+])
+def test_cbconfig_interrupt_pair(interrupt, valid):
+    """ The interrupt board and pin have to be set together."""
+    validator = CBValidator(SCHEMA_SENSOR_VL53L1X)
+    document = {'name': 'range', 'hw_type': 'VL53L1X', 'i2c_address': 0x30, 'enable_board': 0, 'enable_pin': 4,
+                **interrupt}
+    assert validator.validate(document) == valid
@@ -0,0 +1,59 @@
+"""
+Cobra Bay tests for the core's main loop wakes
+"""
+
+import threading
+import time
+from cobrabay import CBCore
+from cobrabay.mailbox import CBMailbox
+
+
+class RacingCore(CBCore):
+    """ Core that's woken again by another thread just after the main loop reads the wake count."""
+    race = False
+
+    @property
+    def _wakes(self):
+        wakes = self._wake_count
+        if self.race:
+            self.race = False
+            self.wake()
+        return wakes
+
+    @_wakes.setter
+    def _wakes(self, wakes):
+        self._wake_count = wakes
+
+
+def make_core():
+    """ Build a core with only what waking the main loop needs, since a full core needs a config and hardware."""
+    core = RacingCore.__new__(RacingCore)
+    core._wakes = 0
+    core._wakes_seen = 0
+    core._wake_lock = threading.Lock()
+    core._mailbox = CBMailbox()
+    return core
+
+
+def test_core_wake():
+    """ A wake is seen by the next check only."""
+    core = make_core()
+    assert not core._woken()
+    core.wake()
+    core.wake()
+    assert core._woken()
+    assert not core._woken()
+
+
+def test_core_wake_during_check():
+    """ A wake that lands while the loop is checking for one is seen on the next pass, not lost."""
+    core = make_core()
+    core.wake()
+    core.race = True
+    assert core._woken()
+    # The mailbox lets the loop's wait return at once, and the next check finds the wake.
+    start = time.monotonic()
+    core._mailbox.wait(after=0, timeout=5)
+    assert time.monotonic() - start < 1
+    assert core._woken()
+    assert not core._woken()
@@ -0,0 +1,109 @@
+"""
+Cobra Bay tests for the display's placard caches
+"""
+
+import importlib.resources
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from cobrabay import CBDisplay
+from cobrabay.compositor import CBCompositor
+
+FONT = str(importlib.resources.files('cobrabay.data').joinpath('OpenSans-Light.ttf'))
+
+
+def make_display(**kwargs):
+    """ Build a 64x32 display with fixed font sizes."""
+    core = SimpleNamespace(net_data={'interface': (0, True), 'mqtt': (0, True)})
+    options = {'unit_system': 'metric', 'range_table': 'off'}
+    options.update(kwargs)
+    return CBDisplay(width=64, height=32, gpio_slowdown=4, cbcore=core, font=FONT, font_size_clock=18,
+                     font_size_range=14, icons={'network': True}, **options)
+
+
+def draw(sprite):
+    """ Draw a sprite on its own, as RGB."""
+    compositor = CBCompositor(64, 32)
+    compositor.clear()
+    compositor.blit(sprite)
+    return np.asarray(compositor.image.convert('RGB'), dtype=np.int16)
+
+
+@pytest.fixture
+def display():
+    """ Fixture for a display with a small placard cache."""
+    return make_display(placard_cache_size=2)
+
+
+def test_display_placard_cache(display):
+    """ Placards are reused until they're the least recently used one when the cache is full."""
+    # Setting up the display's layers makes placards too, so count from here.
+    before = display.diagnostics['placard_cache']
+    first = display._placard("1 m", 'green', font_size=14)
+    assert display._placard("1 m", 'green', font_size=14) is first
+    display._placard("2 m", 'green', font_size=14)
+    # Using the first placard again makes the second the oldest, so it's the one dropped.
+    display._placard("1 m", 'green', font_size=14)
+    display._placard("3 m", 'green', font_size=14)
+    assert display._placard("1 m", 'green', font_size=14) is first
+    display._placard("2 m", 'green', font_size=14)
+    after = display.diagnostics['placard_cache']
+    assert (after['hits'] - before['hits'], after['misses'] - before['misses']) == (3, 4)
+    assert after['size'] == after['max_size'] == 2
+    # Color is part of the key.
+    assert display._placard("1 m", 'red', font_size=14) is not first
+
+
+@pytest.mark.parametrize('range_mm,range_string', [(2500, "2.5 m"), (501, "0.5 m"), (500, "50 cm"), (300, "30 cm"),
+                                                   (-200, "-20 cm")])
+def test_display_range_string_metric(display, range_mm, range_string):
+    """ Short metric ranges are shown in centimeters, longer ones in meters."""
+    assert display._range_string_mm(range_mm) == range_string
+
+
+def test_display_range_table_get(display):
+    """ Ranges in the table get its placards, anything else gets nothing, so a placard is rendered instead."""
+    display._range_table_build('bay1', -300, 600)
+    placard = display._range_table_get('bay1', 300, 'green')
+    # Ranges that show the same string share a placard, in each color.
+    assert display._range_table_get('bay1', 304.2, 'green') is placard
+    assert display._range_table_get('bay1', 300, 'red').transmit is placard.transmit
+    assert np.abs(draw(placard) - draw(display._placard("30 cm", 'green'))).max() <= 1
+    assert display._range_table_get('bay1', -300, 'yellow') is not None
+    for range_mm in (-301, 601, None):
+        assert display._range_table_get('bay1', range_mm, 'green') is None
+    assert display._range_table_get('bay2', 300, 'green') is None
+
+
+def test_display_range_table_saved(tmp_path):
+    """ A saved range table loads back the same, and one that can't be read is rendered again."""
+    first = make_display(cache_dir=str(tmp_path))
+    first._range_table_build('bay1', 0, 400)
+    cache_file = first._range_table_file(0, 400)
+    assert os.listdir(tmp_path) == [os.path.basename(cache_file)]
+    loaded = make_display(cache_dir=str(tmp_path))._range_table_load(cache_file)
+    rendered = first._range_tables['bay1']
+    assert loaded['low'] == 0
+    assert np.array_equal(loaded['index'], rendered['index'])
+    for loaded_placard, rendered_placard in zip(loaded['placards'], rendered['placards'], strict=True):
+        assert (loaded_placard.x, loaded_placard.y) == (rendered_placard.x, rendered_placard.y)
+        assert np.array_equal(loaded_placard.transmit, rendered_placard.transmit)
+    with open(cache_file, 'wb') as f:
+        f.write(b'not a table')
+    assert first._range_table_load(cache_file) is None
+    first._range_table_build('bay1', 0, 400)
+    assert first._range_table_load(cache_file) is not None
+
+
+def test_display_scale_font(display):
+    """ Bisection finds the same size as counting up from 1."""
+    for text in ("8'2\"", "12:45", "50 cm", "Error"):
+        for w, h in ((58, 26), (56, 28), (20, 10), (3, 3)):
+            size = 1
+            while True:
+                bbox = display._font_sized(size).getbbox(text)
+                if not (bbox[2] - bbox[0] < w and bbox[3] - bbox[1] < h):
+                    break
+                size += 1
+            assert display._scale_font(text, w, h) == size
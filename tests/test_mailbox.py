@@ -0,0 +1,72 @@
+"""
+Cobra Bay tests for the mailbox
+"""
+
+import multiprocessing
+import threading
+import time
+from cobrabay.mailbox import CBMailbox
+
+
+def _put_later(mailbox, item, delay):
+    """ Put an item after a delay."""
+    time.sleep(delay)
+    mailbox.put(item)
+
+
+def test_mailbox_empty():
+    """ A new mailbox has nothing in it, and waiting times out."""
+    mailbox = CBMailbox()
+    assert mailbox.get() == (0, None)
+    assert not mailbox.wait(timeout=0.01)
+
+
+def test_mailbox_overwrite():
+    """ Only the latest item is kept, and waiting for one already seen returns at once."""
+    mailbox = CBMailbox()
+    mailbox.put('first')
+    assert mailbox.put('second') == 2
+    assert mailbox.get() == (2, 'second')
+    assert mailbox.wait(after=1, timeout=0)
+    assert not mailbox.wait(after=2, timeout=0.01)
+
+
+def test_mailbox_thread_wakes():
+    """ A put from another thread wakes a waiting consumer."""
+    mailbox = CBMailbox()
+    producer = threading.Thread(target=_put_later, args=(mailbox, 'scan', 0.05))
+    producer.start()
+    assert mailbox.wait(timeout=5)
+    assert mailbox.get() == (1, 'scan')
+    producer.join()
+
+
+def test_mailbox_notify():
+    """ Notifying wakes a waiting consumer without a new item."""
+    mailbox = CBMailbox()
+    timer = threading.Timer(0.05, mailbox.notify)
+    timer.start()
+    start = time.monotonic()
+    assert not mailbox.wait(timeout=5)
+    assert time.monotonic() - start < 5
+    timer.join()
+
+
+def test_mailbox_process():
+    """ A put in another process wakes a consumer in this one. Only the sequence comes across."""
+    mailbox = CBMailbox(context=multiprocessing.get_context())
+    producer = multiprocessing.Process(target=_put_later, args=(mailbox, 'scan', 0.05))
+    producer.start()
+    assert mailbox.wait(timeout=5)
+    assert mailbox.get() == (1, None)
+    producer.join()
+
+
+def test_mailbox_notify_before_wait():
+    """ A notify that comes before the wait isn't lost, and only wakes one wait."""
+    mailbox = CBMailbox()
+    mailbox.notify()
+    start = time.monotonic()
+    assert not mailbox.wait(timeout=5)
+    assert time.monotonic() - start < 1
+    assert not mailbox.wait(timeout=0.01)
@@ -0,0 +1,79 @@
+"""
+Cobra Bay tests for the shared memory sensor board
+"""
+
+import pickle
+import pytest
+from numpy import datetime64
+from pint import Quantity
+import cobrabay.const
+from cobrabay.datatypes import SensorReading, SensorResponse
+from cobrabay.sensorboard import BOARD_FAULT_REASON_LENGTH, CBSensorBoard
+
+
+@pytest.fixture
+def board():
+    """ Fixture for a new board with two sensors."""
+    board_obj = CBSensorBoard(['range', 'lateral'])
+    yield board_obj
+    board_obj.close()
+
+
+def make_response(range_cm):
+    """ Build a scan with one good reading and one faulted sensor."""
+    return SensorResponse(
+        timestamp=datetime64(1700000000123456789, 'ns'),
+        sensors={
+            'range': SensorReading(
+                state=cobrabay.const.SENSTATE_RANGING, status=cobrabay.const.SENSTATE_RANGING, fault=False,
+                response_type=cobrabay.const.SENSOR_RESP_OK, range=Quantity(range_cm, 'cm'),
+                temp=Quantity(30, 'degC'), fault_reason=None, confidence=0.75, samples=5),
+            'lateral': SensorReading(
+                state=cobrabay.const.SENSTATE_FAULT, status=cobrabay.const.SENSTATE_FAULT, fault=True,
+                response_type=cobrabay.const.SENSTATE_FAULT, range=cobrabay.const.GEN_UNAVAILABLE,
+                temp=cobrabay.const.GEN_UNAVAILABLE, fault_reason="Did not initialize.")
+        },
+        scan_time=2500000, generation=7)
+
+
+def test_board_empty(board):
+    """ Nothing is read before the first write."""
+    assert board.sequence == 0
+    assert board.read() is None
+
+
+def test_board_round_trip(board):
+    """ A scan written to the board reads back the same."""
+    board.write(make_response(123.4))
+    scan = board.read()
+    assert board.sequence == 2
+    assert scan.timestamp == datetime64(1700000000123456789, 'ns')
+    assert scan.scan_time == 2500000
+    assert scan.generation == 7
+    assert scan.sensors['range'].range.m_as('cm') == pytest.approx(123.4)
+    assert scan.sensors['range'].response_type == cobrabay.const.SENSOR_RESP_OK
+    assert scan.sensors['range'].confidence == 0.75
+    assert scan.sensors['range'].samples == 5
+    assert scan.sensors['lateral'].fault
+    assert scan.sensors['lateral'].response_type == cobrabay.const.SENSTATE_FAULT
+    assert scan.sensors['lateral'].range is None
+    assert scan.sensors['lateral'].fault_reason == "Did not initialize."
+    assert scan.sensors['range'].fault_reason is None
+
+
+def test_board_fault_reason_exception(board):
+    """ An exception as a fault reason comes across as its message, cut to fit."""
+    response = make_response(50)
+    reason = OSError("é" * BOARD_FAULT_REASON_LENGTH)
+    response.sensors['lateral'] = response.sensors['lateral']._replace(fault_reason=reason)
+    board.write(response)
+    fault_reason = board.read().sensors['lateral'].fault_reason
+    assert fault_reason == "é" * (BOARD_FAULT_REASON_LENGTH // 2)
+
+
+def test_board_attach(board):
+    """ A board unpickled in another process attaches to the same memory."""
+    attached = pickle.loads(pickle.dumps(board))
+    board.write(make_response(50))
+    assert attached.read().sensors['range'].range.m_as('cm') == pytest.approx(50)
+    attached.close()
@@ -0,0 +1,85 @@
+"""
+Cobra Bay tests for the sensor history
+"""
+
+import pytest
+from numpy import datetime64
+from pint import Quantity
+import cobrabay.const
+from cobrabay.datatypes import SensorReading, SensorResponse
+from cobrabay.sensorhistory import CBSensorHistory
+
+BASE_NS = 1700000000000000000
+
+
+def make_response(index, range_cm, response_type=cobrabay.const.SENSOR_RESP_OK):
+    """ Build a scan with a reading from the range sensor, 100ms after the previous one."""
+    return SensorResponse(
+        timestamp=datetime64(BASE_NS + index * 100000000, 'ns'),
+        sensors={
+            'range': SensorReading(
+                state=cobrabay.const.SENSTATE_RANGING, status=cobrabay.const.SENSTATE_RANGING, fault=False,
+                response_type=response_type, range=Quantity(range_cm, 'cm'), temp=None, fault_reason=None)
+        },
+        scan_time=0)
+
+
+def test_history_empty():
+    """ A new history has nothing in it."""
+    history = CBSensorHistory(['range'], size=4)
+    assert len(history) == 0
+    assert history.latest is None
+    assert history.last('range') is None
+    assert len(history.window('range')[0]) == 0
+
+
+def test_history_wrap():
+    """ Once full, the oldest scans are replaced and readings come back newest first."""
+    history = CBSensorHistory(['range'], size=4)
+    for i in range(6):
+        history.append(make_response(i, 100 + i))
+    timestamps, ranges = history.window('range')
+    assert len(history) == 4
+    assert list(ranges) == [1050, 1040, 1030, 1020]
+    assert timestamps[0] == BASE_NS + 5 * 100000000
+    assert history.latest.sensors['range'].range == Quantity(105, 'cm')
+
+
+def test_history_window_filters():
+    """ Windows can be limited by count, time and response type."""
+    history = CBSensorHistory(['range'], size=10)
+    for i in range(5):
+        history.append(make_response(i, 100 + i))
+    history.append(make_response(5, 0, response_type=cobrabay.const.SENSOR_RESP_INR))
+    assert list(history.window('range', count=2)[1]) == [1040, 1030]
+    assert list(history.window('range', since=BASE_NS + 300000000)[1]) == [1040, 1030]
+    assert list(history.window('range', since=datetime64(BASE_NS + 300000000, 'ns'))[1]) == [1040, 1030]
+    assert len(history.window('range', response_type=None)[0]) == 6
+    assert len(history.window('range', response_type=cobrabay.const.SENSOR_RESP_INR)[0]) == 1
+
+
+def test_history_last():
+    """ The last good reading is returned even when newer readings aren't good."""
+    history = CBSensorHistory(['range'], size=4)
+    history.append(make_response(0, 150))
+    history.append(make_response(1, 0, response_type=cobrabay.const.SENSOR_RESP_INR))
+    timestamp, range_value = history.last('range')
+    assert timestamp == BASE_NS
+    assert range_value.m_as('cm') == pytest.approx(150)
+
+
+def test_history_trend():
+    """ A steady approach fits exactly, and too few readings don't fit at all."""
+    history = CBSensorHistory(['range'], size=10)
+    history.append(make_response(0, 300))
+    assert history.trend('range') is None
+    for i in range(1, 5):
+        history.append(make_response(i, 300 - i * 10))
+    rate, stderr, r_squared, samples, newest = history.trend('range')
+    # 10cm every 100ms, getting closer.
+    assert rate == pytest.approx(-1000)
+    assert stderr == pytest.approx(0)
+    assert r_squared == pytest.approx(1)
+    assert samples == 5
+    assert newest == BASE_NS + 4 * 100000000
+    assert history.trend('range', count=2)[1] is None
@@ -134,3 +134,14 @@ def test_sensormgr_bus_enable(new_sensormgr):
     sensormgr._enable_i2c_bus()
 
     assert sensormgr._ctrl_ready.value
+
+
+@pytest.mark.parametrize("budgets,offsets", [
+    ([], []),
+    ([200], [0]),
+    ([200, 200, 200, 200], [0, 50, 100, 150]),
+    ([50, 200], [0, 100])
+])
+def test_sensormgr_phase_offsets(budgets, offsets):
+    """ Ranging starts on a shared bus are spread evenly across the longest timing budget."""
+    assert cobrabay.sensormgr.CBSensorMgr._phase_offsets(budgets) == offsets
@@ -0,0 +1,76 @@
+"""
+Cobra Bay tests for the TFMini reading filter
+"""
+
+import select
+import time
+from collections import deque
+import cobrabay.const
+from cobrabay.datatypes import TFMPData
+from cobrabay.sensors import TFMini
+from cobrabay.sensors.tfmp import TFMP
+from .test_tfmp import FailingPort, make_frame
+
+
+def frame(distance, status="OK"):
+    """ An unconverted frame."""
+    return TFMPData(status, distance, 1000, 24, 0)
+
+
+def no_convert(tfmp_data):
+    return tfmp_data
+
+
+def test_filter_median():
+    """ An outlier doesn't move the reading, and is reflected in the confidence."""
+    window = deque([frame(100), frame(101), frame(250)])
+    result, confidence, samples = TFMini._filter_result(window, 2, no_convert)
+    assert result.status == "OK"
+    assert result.distance == 101
+    assert samples == 3
+    assert confidence == 2 / 3
+
+
+def test_filter_mostly_failed():
+    """ When most of the window isn't good, the newest failure is reported."""
+    window = deque([frame(100), frame(65535, "Weak"), frame(65535, "Weak")])
+    result, confidence, samples = TFMini._filter_result(window, 2, no_convert)
+    assert result.status == "Weak"
+    assert confidence is None
+    assert samples == 1
+
+
+def test_filter_newest_failed():
+    """ A single failed frame at the end doesn't discard a good window."""
+    window = deque([frame(100), frame(100), frame(65532, "Flood")])
+    result, confidence, samples = TFMini._filter_result(window, 2, no_convert)
+    assert result.status == "OK"
+    assert result.distance == 100
+    assert confidence == 1
+
+
+def test_thread_reader_failure(monkeypatch):
+    """ In thread mode, a reader that has died gives a fault rather than waiting for frames forever."""
+    def fake_open(tfmp):
+        tfmp._data_stream = FailingPort([make_frame(100)])
+    monkeypatch.setattr(TFMP, '_open', fake_open)
+    monkeypatch.setattr(TFMP, '_send_cmd', lambda tfmp, command, parameter, wait_reply=True: True)
+    sensor = TFMini('range', '/dev/null', 115200, read_mode='thread')
+    sensor._sensor_obj._reader_thread.join(timeout=5)
+    reading = sensor.reading()
+    assert reading.response_type == cobrabay.const.SENSTATE_FAULT
+    assert 'device disconnected' in str(reading.fault_reason)
+
+
+def test_inline_read_budget(monkeypatch):
+    """ In inline mode, a sensor that sends nothing only holds up a reading for the read budget."""
+    def fake_open(tfmp):
+        tfmp._data_stream = FailingPort([])
+        tfmp._poller = select.poll()
+    monkeypatch.setattr(TFMP, '_open', fake_open)
+    monkeypatch.setattr(TFMP, '_send_cmd', lambda tfmp, command, parameter, wait_reply=True: True)
+    sensor = TFMini('range', '/dev/null', 115200, read_budget='20 ms')
+    start = time.monotonic()
+    reading = sensor.reading()
+    assert time.monotonic() - start < 0.2
+    assert reading.response_type == cobrabay.const.SENSOR_RESP_INR
@@ -0,0 +1,223 @@
+"""
+Cobra Bay tests for the TFMini Plus frame decoder
+"""
+
+import time
+import pytest
+import serial
+from cobrabay.sensors.tfmp import TFMP
+
+
+def make_frame(distance, flux=1000, temp=0x0A00):
+    """ Build a valid 9-byte data frame."""
+    frame = bytearray(b'\x59\x59')
+    frame += distance.to_bytes(2, 'little') + flux.to_bytes(2, 'little') + temp.to_bytes(2, 'little')
+    frame.append(sum(frame) & 0xFF)
+    return bytes(frame)
+
+
+def test_checksum_valid():
+    """ Checksum accepts a well-formed frame."""
+    assert TFMP._checksum(make_frame(150))
+
+
+def test_checksum_invalid():
+    """ Checksum rejects a frame with a flipped byte."""
+    frame = bytearray(make_frame(150))
+    frame[3] ^= 0x01
+    assert not TFMP._checksum(frame)
+
+
+def test_find_frame_newest():
+    """ The newest complete frame is returned and the older ones are counted as behind it."""
+    buffer = make_frame(100) + make_frame(200) + make_frame(300)
+    frame, position, rejected = TFMP._find_frame(buffer, TFMP.TFMP_FRAME_HEADER, TFMP.TFMP_FRAME_SIZE)
+    assert frame == make_frame(300)
+    assert position // TFMP.TFMP_FRAME_SIZE == 2
+    assert rejected == 0
+
+
+def test_find_frame_partial_tail():
+    """ A partial frame at the end is skipped in favor of the last complete one."""
+    buffer = make_frame(100) + make_frame(200)[:5]
+    frame, position, rejected = TFMP._find_frame(buffer, TFMP.TFMP_FRAME_HEADER, TFMP.TFMP_FRAME_SIZE)
+    assert frame == make_frame(100)
+    assert position == 0
+
+
+def test_find_frame_corrupt():
+    """ A corrupt newest frame is rejected and counted, and the previous valid frame is used."""
+    corrupt = bytearray(make_frame(300))
+    corrupt[-1] ^= 0xFF
+    buffer = b'\x00\x13' + make_frame(200) + bytes(corrupt)
+    frame, position, rejected = TFMP._find_frame(buffer, TFMP.TFMP_FRAME_HEADER, TFMP.TFMP_FRAME_SIZE)
+    assert frame == make_frame(200)
+    assert position == 2
+    assert rejected == 1
+
+
+@pytest.mark.parametrize("buffer", [b'', b'\x59', b'\x00' * 20, make_frame(100)[:8]])
+def test_find_frame_none(buffer):
+    """ No frame is found when there isn't a complete one."""
+    frame, position, rejected = TFMP._find_frame(buffer, TFMP.TFMP_FRAME_HEADER, TFMP.TFMP_FRAME_SIZE)
+    assert frame is None
+
+
+def test_find_frame_command_reply():
+    """ Command replies are found by their own header."""
+    reply = bytearray(b'\x5A\x06\x03\x64\x00')
+    reply.append(sum(reply) & 0xFF)
+    buffer = make_frame(100) + bytes(reply) + make_frame(110)[:4]
+    frame, position, rejected = TFMP._find_frame(buffer, bytes((0x5A, 6)), 6)
+    assert frame == bytes(reply)
+
+
+def test_split_frames():
+    """ All valid frames are returned in order, and the partial frame at the end is left in the buffer."""
+    corrupt = bytearray(make_frame(150))
+    corrupt[4] ^= 0x01
+    buffer = make_frame(100) + bytes(corrupt) + make_frame(200) + make_frame(300)[:3]
+    frames, consumed, rejected = TFMP._split_frames(buffer, TFMP.TFMP_FRAME_HEADER, TFMP.TFMP_FRAME_SIZE)
+    assert frames == [make_frame(100), make_frame(200)]
+    assert consumed == TFMP.TFMP_FRAME_SIZE * 3
+    assert rejected == 1
+
+
+def test_split_frames_split_header():
+    """ A header split across reads isn't thrown away."""
+    buffer = make_frame(100) + b'\x59'
+    frames, consumed, rejected = TFMP._split_frames(buffer, TFMP.TFMP_FRAME_HEADER, TFMP.TFMP_FRAME_SIZE)
+    assert frames == [make_frame(100)]
+    assert buffer[consumed:] == b'\x59'
+
+
+def test_build_cmd_frame_rate():
+    """ Set frame rate packs its two-byte parameter in place, with the checksum last."""
+    command, reply_length = TFMP._build_cmd(TFMP.SET_FRAME_RATE, 100)
+    assert command == bytes((0x5A, 0x06, 0x03, 0x64, 0x00, 0xC7))
+    assert reply_length == 6
+
+
+def test_build_cmd_trigger():
+    """ Trigger is a four-byte command with no reply."""
+    command, reply_length = TFMP._build_cmd(TFMP.TRIGGER_DETECTION, 0)
+    assert command == bytes((0x5A, 0x04, 0x04, 0x62))
+    assert reply_length == 0
+
+
+class QueuedPort:
+    """ Stands in for a serial port with bytes waiting to be read."""
+    def __init__(self, data=b''):
+        self.data = bytearray(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size=1):
+        chunk = bytes(self.data[:size])
+        del self.data[:size]
+        return chunk
+
+    def close(self):
+        pass
+
+
+def test_take_frame_counts_corrupt_once(monkeypatch):
+    """ A corrupt frame after the newest valid one is counted once, and isn't checked again on the next read."""
+    corrupt = bytearray(make_frame(300))
+    corrupt[-1] ^= 0xFF
+    port = QueuedPort(make_frame(200) + bytes(corrupt) + make_frame(400)[:4])
+    monkeypatch.setattr(TFMP, '_open', lambda tfmp: setattr(tfmp, '_data_stream', port))
+    tfmp = TFMP()
+    header, length = TFMP.TFMP_FRAME_HEADER, TFMP.TFMP_FRAME_SIZE
+    assert tfmp._take_frame(header, length) == make_frame(200)
+    assert tfmp.frame_stats['checksum_errors'] == 1
+    assert tfmp._take_frame(header, length) is None
+    assert tfmp.frame_stats['checksum_errors'] == 1
+    # The partial frame at the end is kept, and completes when the rest arrives.
+    port.data += make_frame(400)[4:]
+    assert tfmp._take_frame(header, length) == make_frame(400)
+    assert tfmp.frame_stats == {'frames': 2, 'dropped': 0, 'checksum_errors': 1}
+
+
+class FailingPort:
+    """ Stands in for a serial port that delivers some frames and then drops off the bus."""
+    def __init__(self, frames):
+        self._frames = list(frames)
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        if self._frames:
+            return self._frames.pop(0)
+        raise serial.SerialException("device disconnected")
+
+    def close(self):
+        pass
+
+
+def test_reader_port_failure(monkeypatch):
+    """ If the port fails, the reader stops and keeps the error, and the frames it got are still there."""
+    def fake_open(tfmp):
+        tfmp._data_stream = FailingPort([make_frame(100), make_frame(110)])
+    monkeypatch.setattr(TFMP, '_open', fake_open)
+    tfmp = TFMP()
+    assert tfmp.start_reader()
+    tfmp._reader_thread.join(timeout=5)
+    assert not tfmp.reader_running
+    assert isinstance(tfmp.reader_error, serial.SerialException)
+    assert [frame.distance for frame in tfmp.history()] == [100, 110]
+    # A dead reader can be started again.
+    monkeypatch.setattr(tfmp, '_data_stream', FailingPort([make_frame(120)]))
+    assert tfmp.start_reader()
+    tfmp._reader_thread.join(timeout=5)
+    assert [frame.distance for frame in tfmp.history()] == [120]
+
+
+class BusyPort:
+    """ Stands in for a serial port, and records whether it was flushed in the middle of a read."""
+    def __init__(self):
+        self.reading = False
+        self.overlaps = 0
+        self.flushes = 0
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        self.reading = True
+        time.sleep(0.002)
+        self.reading = False
+        return make_frame(100)
+
+    def reset_input_buffer(self):
+        self.flushes += 1
+        self.overlaps += self.reading
+
+    def reset_output_buffer(self):
+        pass
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_command_pauses_reader(monkeypatch):
+    """ Commands sent while the reader is running don't flush the port in the middle of a read."""
+    port = BusyPort()
+    monkeypatch.setattr(TFMP, '_open', lambda tfmp: setattr(tfmp, '_data_stream', port))
+    tfmp = TFMP()
+    tfmp.start_reader()
+    for _ in range(20):
+        tfmp.set_frame_rate(100)
+        time.sleep(0.001)
+    tfmp.stop_reader()
+    assert port.flushes == 20
+    assert port.overlaps == 0
+    assert len(tfmp.history()) > 0
@@ -0,0 +1,49 @@
+"""
+Cobra Bay tests for range tracking
+"""
+
+import pytest
+from cobrabay.tracking import CBRangeTracker
+
+BASE_NS = 1700000000000000000
+STEP_NS = 100000000
+
+
+def test_tracker_constant_speed():
+    """ A steady approach is locked onto, and projected forward between readings."""
+    tracker = CBRangeTracker(alpha=0.5, beta=0.3)
+    assert tracker.predict(BASE_NS) is None
+    # 1.4m/s, about 5 km/h, toward the sensor.
+    for i in range(40):
+        tracker.update(BASE_NS + i * STEP_NS, 3000 - i * 140)
+    assert tracker.velocity == pytest.approx(-1400, rel=0.01)
+    assert tracker.error == pytest.approx(0, abs=1)
+    # Halfway to the next reading.
+    assert tracker.predict(BASE_NS + 39 * STEP_NS + STEP_NS // 2) == pytest.approx(3000 - 39.5 * 140, abs=2)
+
+
+def test_tracker_ignores_old_readings():
+    """ A reading no newer than the last one is dropped."""
+    tracker = CBRangeTracker()
+    assert tracker.update(BASE_NS, 1000)
+    assert not tracker.update(BASE_NS, 2000)
+    assert tracker.range == 1000
+
+
+def test_tracker_gap_restarts():
+    """ Readings too far apart start a new track."""
+    tracker = CBRangeTracker(max_gap=0.5)
+    tracker.update(BASE_NS, 1000)
+    tracker.update(BASE_NS + STEP_NS, 900)
+    assert tracker.error is not None
+    tracker.update(BASE_NS + 20 * STEP_NS, 500)
+    assert tracker.range == 500
+    assert tracker.velocity == 0
+    assert tracker.error is None
+
+
+@pytest.mark.parametrize("alpha,beta", [(0, 0.1), (1.5, 0.1), (0.5, -1), (0.5, 2)])
+def test_tracker_bad_gains(alpha, beta):
+    """ Gains outside the stable range are rejected."""
+    with pytest.raises(ValueError):
+        CBRangeTracker(alpha=alpha, beta=beta)